@@ -5,12 +5,16 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from sql import models
+from sql import models, database, search
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# use the same database as the app (.env / DATABASE_URL)
+config.set_main_option(
+    "sqlalchemy.url", database.SQLALCHEMY_DATABASE_URL.replace("%", "%%"))
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -22,6 +26,13 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = models.Base.metadata
 
+def include_object(object, name, type_, reflected, compare_to):
+    # the full-text index (and sqlite's FTS5 shadow tables) is managed by
+    # sql.search, not by the models
+    if type_ == "table" and name.startswith(search.SEARCH_TABLE):
+        return False
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -44,6 +55,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -67,7 +79,8 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            include_object=include_object
         )
 
         with context.begin_transaction():
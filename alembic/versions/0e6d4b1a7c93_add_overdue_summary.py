@@ -0,0 +1,36 @@
+"""add overdue summary
+
+Revision ID: 0e6d4b1a7c93
+Revises: f31c5a8e92b4
+Create Date: 2026-10-17 16:40:19.502731
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0e6d4b1a7c93'
+down_revision: Union[str, None] = 'f31c5a8e92b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('overdue_summary',
+    sa.Column('borrower_id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=100), nullable=False),
+    sa.Column('email', sa.String(length=150), nullable=False),
+    sa.Column('overdue_count', sa.Integer(), nullable=False),
+    sa.Column('oldest_due_back', sa.Date(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('borrower_id')
+    )
+    op.create_index('ix_bookinstances_status_due_back', 'bookinstances', ['status', 'due_back'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_bookinstances_status_due_back', table_name='bookinstances')
+    op.drop_table('overdue_summary')
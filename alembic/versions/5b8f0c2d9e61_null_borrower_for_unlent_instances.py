@@ -0,0 +1,28 @@
+"""null borrower for unlent instances
+
+Revision ID: 5b8f0c2d9e61
+Revises: e15c274b32ab
+Create Date: 2026-10-17 09:12:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8f0c2d9e61'
+down_revision: Union[str, None] = 'e15c274b32ab'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 0 was written as "no borrower", which the foreign key to users
+    # refuses wherever it's enforced
+    op.execute("UPDATE bookinstances SET borrower_id = NULL WHERE borrower_id = 0")
+
+
+def downgrade() -> None:
+    pass
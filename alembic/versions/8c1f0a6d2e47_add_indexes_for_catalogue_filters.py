@@ -0,0 +1,36 @@
+"""add indexes for catalogue filters
+
+Revision ID: 8c1f0a6d2e47
+Revises: 5bfa191fd64f
+Create Date: 2026-10-17 10:12:41.208315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1f0a6d2e47'
+down_revision: Union[str, None] = '5bfa191fd64f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_books_genre_id_language_id_id', 'books', ['genre_id', 'language_id', 'id'], unique=False)
+    op.create_index('ix_books_language_id_id', 'books', ['language_id', 'id'], unique=False)
+    op.create_index('ix_books_author_id', 'books', ['author_id'], unique=False)
+    op.create_index('ix_bookinstances_book_id_status', 'bookinstances', ['book_id', 'status'], unique=False)
+    op.create_index('ix_bookinstances_status_id', 'bookinstances', ['status', 'id'], unique=False)
+    op.create_index('ix_bookinstances_borrower_id_status', 'bookinstances', ['borrower_id', 'status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_bookinstances_borrower_id_status', table_name='bookinstances')
+    op.drop_index('ix_bookinstances_status_id', table_name='bookinstances')
+    op.drop_index('ix_bookinstances_book_id_status', table_name='bookinstances')
+    op.drop_index('ix_books_author_id', table_name='books')
+    op.drop_index('ix_books_language_id_id', table_name='books')
+    op.drop_index('ix_books_genre_id_language_id_id', table_name='books')
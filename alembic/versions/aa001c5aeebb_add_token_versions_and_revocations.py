@@ -0,0 +1,36 @@
+"""add token versions and revocations
+
+Revision ID: aa001c5aeebb
+Revises: 0e6d4b1a7c93
+Create Date: 2026-10-17 04:24:30.642992
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'aa001c5aeebb'
+down_revision: Union[str, None] = '0e6d4b1a7c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('token_revocations',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('token_version', sa.Integer(), nullable=False),
+    sa.Column('revoked_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index(op.f('ix_token_revocations_revoked_at'), 'token_revocations', ['revoked_at'], unique=False)
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('token_version')
+    op.drop_index(op.f('ix_token_revocations_revoked_at'), table_name='token_revocations')
+    op.drop_table('token_revocations')
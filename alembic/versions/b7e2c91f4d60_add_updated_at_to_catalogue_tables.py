@@ -0,0 +1,35 @@
+"""add updated_at to catalogue tables
+
+Revision ID: b7e2c91f4d60
+Revises: d4a9e3b07c15
+Create Date: 2026-10-17 14:03:52.640118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+import datetime
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2c91f4d60'
+down_revision: Union[str, None] = 'd4a9e3b07c15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ['authors', 'genres', 'languages', 'books', 'bookinstances']
+
+
+def upgrade() -> None:
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(sa.table(table, sa.column('updated_at', sa.DateTime())).update().values(updated_at=now))
+
+
+def downgrade() -> None:
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,29 @@
+"""add book full text search index
+
+Revision ID: d4a9e3b07c15
+Revises: 8c1f0a6d2e47
+Create Date: 2026-10-17 11:03:27.541920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from sql import search
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a9e3b07c15'
+down_revision: Union[str, None] = '8c1f0a6d2e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # sqlite FTS5 table or postgres tsvector + GIN, filled from existing books
+    search.create_index(op.get_bind())
+
+
+def downgrade() -> None:
+    search.drop_index(op.get_bind())
@@ -0,0 +1,40 @@
+"""add instance counters to books
+
+Revision ID: f31c5a8e92b4
+Revises: b7e2c91f4d60
+Create Date: 2026-10-17 15:21:07.118402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f31c5a8e92b4'
+down_revision: Union[str, None] = 'b7e2c91f4d60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COUNTERS = {
+    'available_count': 'a',
+    'on_loan_count': 'o',
+    'reserved_count': 'r',
+}
+
+
+def upgrade() -> None:
+    for counter in COUNTERS:
+        op.add_column('books', sa.Column(counter, sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        "UPDATE books SET " + ", ".join(
+            f"{counter} = (SELECT count(*) FROM bookinstances "
+            f"WHERE bookinstances.book_id = books.id AND bookinstances.status = '{status}')"
+            for counter, status in COUNTERS.items()))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('books') as batch_op:
+        for counter in reversed(list(COUNTERS)):
+            batch_op.drop_column(counter)
@@ -0,0 +1,134 @@
+"""
+Query plans and latency of the crud.py filter queries, without and with
+the composite indexes of the catalogue tables.
+
+    python -m benchmarks.indexes --instances 1000000
+
+It seeds a throwaway sqlite database (or the database given with --url,
+whose tables are dropped and recreated), runs every query with the
+indexes dropped and again after creating them, and prints the plans
+and the median latency of each run.
+"""
+from sqlalchemy import create_engine, select, text, and_
+from sqlalchemy.engine import make_url
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sql import models
+from sql.models import BookInstanceStatus
+from benchmarks.seed import seed
+
+# the indexes under test, everything else (primary keys, unique columns)
+# exists in both runs
+BENCHMARKED_INDEXES = {
+    "ix_books_genre_id_language_id_id",
+    "ix_books_language_id_id",
+    "ix_books_author_id",
+    "ix_bookinstances_book_id_status",
+    "ix_bookinstances_status_id",
+    "ix_bookinstances_borrower_id_status",
+}
+
+def queries(books: int, users: int):
+    """
+    the query shapes of crud.py, with parameters picked from the seeded
+    ranges.
+    """
+    Book = models.Book
+    Instance = models.BookInstance
+    book_id = random.randint(1, books)
+    return {
+        "books by genre": select(Book).
+            where(Book.genre_id == 3).order_by(Book.id).limit(100),
+        "books by genre and language": select(Book).
+            where(Book.genre_id == 3).where(Book.language_id == 2).order_by(Book.id).limit(100),
+        "books by language": select(Book).
+            where(Book.language_id == 2).order_by(Book.id).limit(100),
+        "author's books": select(Book).where(Book.author_id == 7),
+        "instances by status": select(Instance).
+            where(Instance.status == BookInstanceStatus.r).order_by(Instance.id).limit(100),
+        "instances by borrower": select(Instance).
+            where(Instance.borrower_id == random.randint(1, users)).order_by(Instance.id).limit(100),
+        "book's instances": select(Instance).where(Instance.book_id == book_id),
+        "available copy of a book": select(Instance.id).
+            where(and_(Instance.book_id == book_id, Instance.status == BookInstanceStatus.a)).limit(1),
+    }
+
+def set_indexes(engine, enabled: bool):
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in BENCHMARKED_INDEXES:
+                if enabled:
+                    index.create(engine, checkfirst=True)
+                else:
+                    index.drop(engine, checkfirst=True)
+    with engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+
+def explain(connection, statement) -> str:
+    compiled = statement.compile(connection, compile_kwargs={"literal_binds": True})
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+        return "\n".join(row[-1] for row in rows)
+    rows = connection.execute(text(f"EXPLAIN {compiled}")).all()
+    return "\n".join(row[0] for row in rows)
+
+def measure(engine, statements: dict, repeat: int) -> dict:
+    results = {}
+    with engine.connect() as connection:
+        for name, statement in statements.items():
+            timings = []
+            for _ in range(repeat):
+                started_at = time.perf_counter()
+                connection.execute(statement).all()
+                timings.append((time.perf_counter() - started_at) * 1000)
+            results[name] = {
+                "plan": explain(connection, statement),
+                "median_ms": statistics.median(timings),
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="database to use, a temporary sqlite file by default")
+    parser.add_argument("--authors", type=int, default=20000)
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--instances", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    directory = None
+    url = args.url
+    if url is None:
+        directory = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(directory.name, 'benchmark.db')}"
+    engine = create_engine(url)
+    print(f"seeding {make_url(url).get_backend_name()} with {args.instances} instances ...")
+    seed(engine, args.authors, args.books, args.instances, args.users)
+    statements = queries(args.books, args.users)
+
+    set_indexes(engine, enabled=False)
+    before = measure(engine, statements, args.repeat)
+    set_indexes(engine, enabled=True)
+    after = measure(engine, statements, args.repeat)
+
+    for name in statements:
+        print(f"\n== {name}: {before[name]['median_ms']:.2f} ms -> {after[name]['median_ms']:.2f} ms")
+        print("-- before")
+        print(before[name]["plan"])
+        print("-- after")
+        print(after[name]["plan"])
+    engine.dispose()
+    if directory is not None:
+        directory.cleanup()
+
+if __name__ == "__main__":
+    main()
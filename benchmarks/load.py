@@ -0,0 +1,208 @@
+"""
+Load benchmark of the app, for tracking regressions across releases.
+
+    python -m benchmarks.load --duration 30 --concurrency 20 --output load.json
+
+It seeds a throwaway sqlite database (or the database given with --url,
+whose tables are dropped and recreated) with benchmarks.seed, then runs
+--concurrency virtual users against the app in process. Each one logs
+in through /token and then loops over a weighted mix of catalogue
+reads, /users/me/ and borrow/return/reserve until --duration is over.
+
+The result is JSON: per route p50/p95/p99 latency, requests per
+second, error count and mean SQL queries per request (read from the
+Server-Timing header), plus the totals.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+
+# route label -> weight in the mix
+MIX = {
+    "GET /books/?genre=": 30,
+    "GET /authors/{id}": 20,
+    "GET /users/me/": 10,
+    "POST /bookinstances/{id}/borrow": 10,
+    "POST /bookinstances/{id}/return": 10,
+    "POST /bookinstances/{id}/reserve": 5,
+}
+TOKEN_ROUTE = "POST /token"
+QUERY_COUNT = re.compile(r'desc="(\d+) queries"')
+
+def percentile(values: list[float], percent: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, route: str, response, elapsed_ms: float, expected=(200,)):
+        sample = self.samples.setdefault(route, {"latencies": [], "queries": [], "errors": 0, "statuses": {}})
+        sample["latencies"].append(elapsed_ms)
+        status = str(response.status_code)
+        sample["statuses"][status] = sample["statuses"].get(status, 0) + 1
+        if response.status_code not in expected:
+            sample["errors"] += 1
+        match = QUERY_COUNT.search(response.headers.get("server-timing", ""))
+        if match:
+            sample["queries"].append(int(match.group(1)))
+
+    def add_exception(self, route: str, exc: Exception, elapsed_ms: float):
+        sample = self.samples.setdefault(route, {"latencies": [], "queries": [], "errors": 0, "statuses": {}})
+        sample["latencies"].append(elapsed_ms)
+        status = type(exc).__name__
+        sample["statuses"][status] = sample["statuses"].get(status, 0) + 1
+        sample["errors"] += 1
+
+    def report(self, duration: float) -> dict:
+        routes = {}
+        for route, sample in sorted(self.samples.items()):
+            latencies = sample["latencies"]
+            routes[route] = {
+                "requests": len(latencies),
+                "requests_per_second": round(len(latencies) / duration, 2),
+                "errors": sample["errors"],
+                "statuses": sample["statuses"],
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+                "mean_queries": round(sum(sample["queries"]) / len(sample["queries"]), 2) if sample["queries"] else None,
+            }
+        latencies = [latency for sample in self.samples.values() for latency in sample["latencies"]]
+        total = {
+            "requests": len(latencies),
+            "requests_per_second": round(len(latencies) / duration, 2),
+            "errors": sum(sample["errors"] for sample in self.samples.values()),
+        }
+        if latencies:
+            total.update({
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+            })
+        return {"total": total, "routes": routes}
+
+async def timed(client, recorder: Recorder, route: str, method: str, url: str, expected=(200,), **kwargs):
+    started_at = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    recorder.add(route, response, (time.perf_counter() - started_at) * 1000, expected)
+    return response
+
+async def virtual_user(client, recorder: Recorder, rng: random.Random, deadline: float, scale: dict, password: str):
+    username = f"user{rng.randint(2, scale['users'])}"
+    response = await timed(client, recorder, TOKEN_ROUTE, "POST", "/token",
+                           data={"username": username, "password": password})
+    if response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    instance_ids = scale["instance_ids"]
+    borrowed = []
+    routes, weights = zip(*MIX.items())
+    while time.perf_counter() < deadline:
+        route = rng.choices(routes, weights)[0]
+        if route == "GET /books/?genre=":
+            await timed(client, recorder, route, "GET", f"/books/?genre=genre%20{rng.randint(1, 30)}&limit=20")
+        elif route == "GET /authors/{id}":
+            await timed(client, recorder, route, "GET", f"/authors/{rng.randint(1, scale['authors'])}")
+        elif route == "GET /users/me/":
+            await timed(client, recorder, route, "GET", "/users/me/", headers=headers)
+        elif route == "POST /bookinstances/{id}/borrow":
+            # 409 means someone else holds the copy, which is part of the mix
+            instance_id = rng.choice(instance_ids)
+            response = await timed(client, recorder, route, "POST", f"/bookinstances/{instance_id}/borrow",
+                                   expected=(200, 409), headers=headers)
+            if response.status_code == 200:
+                borrowed.append(instance_id)
+        elif route == "POST /bookinstances/{id}/return":
+            if borrowed:
+                instance_id = borrowed.pop(rng.randrange(len(borrowed)))
+                await timed(client, recorder, route, "POST", f"/bookinstances/{instance_id}/return", headers=headers)
+        elif route == "POST /bookinstances/{id}/reserve":
+            await timed(client, recorder, route, "POST", f"/bookinstances/{rng.choice(instance_ids)}/reserve",
+                        expected=(200, 409), headers=headers)
+
+async def run(app, concurrency: int, duration: float, scale: dict, password: str, seed: int) -> dict:
+    import httpx
+
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        started_at = time.perf_counter()
+        deadline = started_at + duration
+        await asyncio.gather(*(
+            virtual_user(client, recorder, random.Random(seed * 1000 + i), deadline, scale, password)
+            for i in range(concurrency)))
+        elapsed = time.perf_counter() - started_at
+    report = recorder.report(elapsed)
+    report["duration_s"] = round(elapsed, 2)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="database to use, a temporary sqlite file by default")
+    parser.add_argument("--authors", type=int, default=2000)
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--instances", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12,
+                        help="cost of the seeded password hash, which every /token pays")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    directory = None
+    if args.url is None:
+        directory = tempfile.TemporaryDirectory()
+        args.url = f"sqlite:///{os.path.join(directory.name, 'benchmark.db')}"
+    # the engines are created on import, so the url has to be set first
+    os.environ["DATABASE_URL"] = args.url
+
+    from sqlalchemy import select
+    from sql import database, models
+    from benchmarks.seed import seed, PASSWORD
+    import main as app_module
+
+    print(f"seeding {args.users} users, {args.books} books and {args.instances} instances ...", file=sys.stderr)
+    seed(database.engine, args.authors, args.books, args.instances, args.users, bcrypt_rounds=args.bcrypt_rounds)
+    with database.engine.connect() as connection:
+        instance_ids = connection.scalars(select(models.BookInstance.id)).all()
+    scale = {"authors": args.authors, "users": args.users, "instance_ids": instance_ids}
+
+    print(f"running {args.concurrency} virtual users for {args.duration}s ...", file=sys.stderr)
+    report = asyncio.run(run(app_module.app, args.concurrency, args.duration, scale, PASSWORD, args.seed))
+    report["config"] = {
+        "database": database.engine.dialect.name,
+        "authors": args.authors,
+        "books": args.books,
+        "instances": args.instances,
+        "users": args.users,
+        "bcrypt_rounds": args.bcrypt_rounds,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "seed": args.seed,
+        "python": platform.python_version(),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    database.engine.dispose()
+    if directory is not None:
+        directory.cleanup()
+
+if __name__ == "__main__":
+    main()
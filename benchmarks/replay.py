@@ -0,0 +1,234 @@
+"""
+Replays a recorded request log against the app, in process.
+
+    python -m benchmarks.replay traffic.jsonl --speed 1 --output replay.json
+    python -m benchmarks.replay traffic.jsonl --fast --concurrency 50
+
+The log has one JSON object per line:
+
+    {"timestamp": "2024-03-01T10:00:00.120Z", "method": "GET",
+     "path": "/books/", "query": {"genre": "genre 3"}, "user": "user42"}
+
+`timestamp` is ISO 8601 or seconds since the epoch, `query` a mapping or
+an urlencoded string, `body` is sent as JSON and `form` as a form, and
+`user` is the username the request was made as. Tokens are minted for
+the users directly, like /token would, so no time is spent on /token
+unless the log has it.
+
+By default requests are sent at their recorded offsets from the first
+one (divided by --speed), each on its own task, so the recorded
+concurrency is kept. With --fast the log is sent as fast as possible by
+--concurrency workers, in order.
+
+It seeds a throwaway sqlite database like benchmarks.load does, or uses
+the database given with --url as it is when --no-seed is given. The
+result is JSON: latency percentiles, status counts and errors (5xx, or
+a status other than the recorded `status` when the log has one) per
+route template, e.g. `GET /authors/{author_id}`.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.load import Recorder
+
+def parse_timestamp(value) -> float | None:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+def read_log(path: str, limit: int | None = None) -> list[dict]:
+    entries = []
+    with open(path) as log:
+        for number, line in enumerate(log, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "path" not in entry:
+                raise ValueError(f"{path}:{number}: entry has no path")
+            entry["method"] = entry.get("method", "GET").upper()
+            entry["timestamp"] = parse_timestamp(entry.get("timestamp"))
+            entries.append(entry)
+            if limit is not None and len(entries) >= limit:
+                break
+    if any(entry["timestamp"] is not None for entry in entries):
+        # entries without a timestamp go with the previous one
+        last = next(entry["timestamp"] for entry in entries if entry["timestamp"] is not None)
+        for entry in entries:
+            if entry["timestamp"] is None:
+                entry["timestamp"] = last
+            last = entry["timestamp"]
+        entries.sort(key=lambda entry: entry["timestamp"])
+    return entries
+
+def route_template(app, method: str, path: str) -> str:
+    from starlette.routing import Match
+
+    scope = {"type": "http", "method": method, "path": path}
+    partial = None
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return f"{method} {route.path}"
+        if match == Match.PARTIAL and partial is None:
+            # the path matches but not the method, a 405
+            partial = route
+    if partial is not None:
+        return f"{method} {partial.path}"
+    return f"{method} (unmatched)"
+
+def mint_tokens(engine, usernames: set[str]) -> dict[str, str]:
+    from sqlalchemy import select
+    from sql import models
+    import dependencies
+
+    users = {}
+    with engine.connect() as connection:
+        names = sorted(usernames)
+        for start in range(0, len(names), 500):
+            for user in connection.execute(
+                    select(models.User.id, models.User.username, models.User.is_active,
+                           models.User.is_superuser, models.User.token_version).
+                    where(models.User.username.in_(names[start:start + 500]))):
+                users[user.username] = user
+    expires_delta = datetime.timedelta(days=1)
+    # users missing from the database get a token for their name only,
+    # which the app refuses like it would have
+    return {
+        username: dependencies.create_user_token(users[username], expires_delta) if username in users else
+            dependencies.create_access_token({"sub": username, "scopes": []}, expires_delta)
+        for username in usernames
+    }
+
+async def send(client, recorder: Recorder, entry: dict, tokens: dict[str, str]):
+    headers = dict(entry.get("headers") or {})
+    if entry.get("user"):
+        headers["Authorization"] = f"Bearer {tokens[entry['user']]}"
+    kwargs = {"params": entry.get("query"), "headers": headers}
+    if "body" in entry:
+        kwargs["json"] = entry["body"]
+    elif "form" in entry:
+        kwargs["data"] = entry["form"]
+    started_at = time.perf_counter()
+    try:
+        response = await client.request(entry["method"], entry["path"], **kwargs)
+    except Exception as exc:
+        recorder.add_exception(entry["route"], exc, (time.perf_counter() - started_at) * 1000)
+        return
+    elapsed_ms = (time.perf_counter() - started_at) * 1000
+    if "status" in entry:
+        expected = (entry["status"],)
+    else:
+        expected = range(100, 500)
+    recorder.add(entry["route"], response, elapsed_ms, expected)
+
+async def replay(app, entries: list[dict], tokens: dict[str, str], fast: bool, concurrency: int,
+                 speed: float) -> dict:
+    import httpx
+
+    recorder = Recorder()
+    lag = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None) as client:
+        started_at = time.perf_counter()
+        if fast:
+            queue = iter(entries)
+            async def worker():
+                for entry in queue:
+                    await send(client, recorder, entry, tokens)
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        else:
+            first = entries[0]["timestamp"] or 0.0
+            tasks = []
+            for entry in entries:
+                offset = ((entry["timestamp"] or first) - first) / speed
+                delay = started_at + offset - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                lag.append(max(0.0, -delay) * 1000)
+                tasks.append(asyncio.create_task(send(client, recorder, entry, tokens)))
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started_at
+    report = recorder.report(elapsed)
+    report["duration_s"] = round(elapsed, 2)
+    if lag:
+        # how late requests were sent compared to the recording, a large
+        # value means the replay could not keep up and the numbers are off
+        report["schedule_lag_ms"] = {"max": round(max(lag), 2), "mean": round(sum(lag) / len(lag), 2)}
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", help="JSONL request log")
+    parser.add_argument("--url", help="database to use, a temporary sqlite file by default")
+    parser.add_argument("--no-seed", action="store_true", help="use the database at --url as it is")
+    parser.add_argument("--authors", type=int, default=2000)
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--instances", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--fast", action="store_true", help="ignore the recorded timing")
+    parser.add_argument("--concurrency", type=int, default=20, help="workers with --fast")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale of the recorded timing")
+    parser.add_argument("--limit", type=int, help="replay only the first LIMIT entries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    if args.no_seed and args.url is None:
+        parser.error("--no-seed needs --url")
+
+    entries = read_log(args.log, args.limit)
+    if not entries:
+        parser.error(f"{args.log} has no entries")
+
+    random.seed(args.seed)
+    directory = None
+    if args.url is None:
+        directory = tempfile.TemporaryDirectory()
+        args.url = f"sqlite:///{os.path.join(directory.name, 'benchmark.db')}"
+    # the engines are created on import, so the url has to be set first
+    os.environ["DATABASE_URL"] = args.url
+
+    from sql import database
+    from benchmarks.seed import seed
+    import main as app_module
+
+    if not args.no_seed:
+        print(f"seeding {args.users} users, {args.books} books and {args.instances} instances ...", file=sys.stderr)
+        seed(database.engine, args.authors, args.books, args.instances, args.users, bcrypt_rounds=4)
+    for entry in entries:
+        entry["route"] = route_template(app_module.app, entry["method"], entry["path"])
+    tokens = mint_tokens(database.engine, {entry["user"] for entry in entries if entry.get("user")})
+
+    mode = "as fast as possible" if args.fast else f"at {args.speed}x the recorded timing"
+    print(f"replaying {len(entries)} requests {mode} ...", file=sys.stderr)
+    report = asyncio.run(replay(app_module.app, entries, tokens, args.fast, args.concurrency, args.speed))
+    report["config"] = {
+        "log": args.log,
+        "entries": len(entries),
+        "database": database.engine.dialect.name,
+        "seeded": not args.no_seed,
+        "fast": args.fast,
+        "concurrency": args.concurrency if args.fast else None,
+        "speed": None if args.fast else args.speed,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    database.engine.dispose()
+    if directory is not None:
+        directory.cleanup()
+
+if __name__ == "__main__":
+    main()
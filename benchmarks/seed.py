@@ -0,0 +1,118 @@
+"""
+Seeds a synthetic catalogue for the benchmarks.
+
+    python -m benchmarks.seed --url sqlite:///./benchmark.db --users 100000
+
+The tables of the database are dropped and recreated. Every user is
+called `user{n}` and has the password `benchmark`; they all share one
+bcrypt hash, so seeding 100k users costs a single hash. Book counters
+and the search index are filled in, so the data looks like the app's
+own. The same --seed gives the same data.
+"""
+from sqlalchemy import create_engine, insert, update, bindparam
+
+from collections import Counter
+import argparse
+import datetime
+import random
+import uuid
+
+import bcrypt
+
+from sql import models, search
+from sql.crud import BOOK_COUNTERS
+from sql.models import BookInstanceStatus
+
+PASSWORD = "benchmark"
+GENRES = 30
+LANGUAGES = 10
+STATUSES = [BookInstanceStatus.a] * 6 + [BookInstanceStatus.o] * 3 + [BookInstanceStatus.r, BookInstanceStatus.m]
+
+def _insert_chunked(engine, model, rows, chunk: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk:
+            with engine.begin() as connection:
+                connection.execute(insert(model), batch)
+            batch = []
+    if batch:
+        with engine.begin() as connection:
+            connection.execute(insert(model), batch)
+
+def seed(engine, authors: int, books: int, instances: int, users: int,
+         chunk: int = 50000, bcrypt_rounds: int = 12):
+    with engine.begin() as connection:
+        search.drop_index(connection)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    hashed_password = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(bcrypt_rounds)).decode("utf-8")
+    today = datetime.date.today()
+
+    with engine.begin() as connection:
+        connection.execute(insert(models.Genre), [{"id": i, "name": f"genre {i}"} for i in range(1, GENRES + 1)])
+        connection.execute(insert(models.Language), [{"id": i, "name": f"language {i}"} for i in range(1, LANGUAGES + 1)])
+    _insert_chunked(engine, models.User, (
+        {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "hashed_password": hashed_password,
+         "is_active": True, "is_superuser": i == 1}
+        for i in range(1, users + 1)), chunk)
+    _insert_chunked(engine, models.Author, (
+        {"id": i, "first_name": "First", "last_name": f"Last {i}", "date_of_birth": datetime.date(1900, 1, 1)}
+        for i in range(1, authors + 1)), chunk)
+    _insert_chunked(engine, models.Book, (
+        {"id": i, "title": f"Book {i}", "description": f"description of book {i}",
+         "author_id": random.randint(1, authors), "genre_id": random.randint(1, GENRES),
+         "language_id": random.randint(1, LANGUAGES)}
+        for i in range(1, books + 1)), chunk)
+
+    counts = Counter()
+    def instance_rows():
+        for _ in range(instances):
+            book_id = random.randint(1, books)
+            status = random.choice(STATUSES)
+            lent = status in (BookInstanceStatus.o, BookInstanceStatus.r)
+            counts[book_id, status] += 1
+            yield {
+                "id": str(uuid.uuid4()),
+                "book_id": book_id,
+                "imprint": "",
+                "status": status,
+                "due_back": today + datetime.timedelta(days=random.randint(-20, 14)) if lent else None,
+                "borrower_id": random.randint(1, users) if lent else None,
+            }
+    _insert_chunked(engine, models.BookInstance, instance_rows(), chunk)
+
+    counters = {}
+    for (book_id, status), count in counts.items():
+        if status in BOOK_COUNTERS:
+            counters.setdefault(book_id, {counter: 0 for counter in BOOK_COUNTERS.values()})
+            counters[book_id][BOOK_COUNTERS[status]] = count
+    if counters:
+        statement = update(models.Book).\
+            where(models.Book.id == bindparam("book_id")).\
+            values({counter: bindparam(f"new_{counter}") for counter in BOOK_COUNTERS.values()})
+        with engine.begin() as connection:
+            connection.execute(statement, [
+                {"book_id": book_id, **{f"new_{counter}": count for counter, count in values.items()}}
+                for book_id, values in counters.items()])
+    with engine.begin() as connection:
+        search.create_index(connection)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", required=True, help="database to seed, its tables are dropped")
+    parser.add_argument("--authors", type=int, default=2000)
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--instances", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    engine = create_engine(args.url)
+    seed(engine, args.authors, args.books, args.instances, args.users, bcrypt_rounds=args.bcrypt_rounds)
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
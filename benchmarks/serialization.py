@@ -0,0 +1,95 @@
+"""
+Requests per second of the list routes with the default serialization
+(ORM objects validated against response_model) and with the fast path
+(Inline schema columns as rows, rendered by orjson).
+
+    python -m benchmarks.serialization --requests 500
+
+It seeds a throwaway sqlite database (or the database given with --url,
+whose tables are dropped and recreated) and calls the app in process
+with the response cache off, so the numbers leave out the network, the
+HTTP server and the cache.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+PATHS = [
+    "/books/?limit=100",
+    "/books/?limit=100&genre=genre%203",
+    "/authors/?limit=100",
+    "/bookinstances/?limit=100",
+    "/users/?limit=100",
+]
+
+async def measure(app, fast: bool, requests: int) -> dict:
+    import httpx
+    import cache
+    import dependencies
+    import main
+
+    dependencies.FAST_LIST_SERIALIZATION = fast
+    # /books/ and /authors/ would be answered by the response cache after
+    # the first request, which measures the cache, not the serialization.
+    # nothing is cached while measuring, and nothing the other run cached
+    # is served
+    main.CACHED_ROUTES = {}
+    cache.invalidate_responses("books", "authors", "genres", "languages")
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for path in PATHS:
+            for _ in range(10):
+                (await client.get(path)).raise_for_status()
+            started_at = time.perf_counter()
+            for _ in range(requests):
+                (await client.get(path)).raise_for_status()
+            results[path] = {
+                "requests_per_second": requests / (time.perf_counter() - started_at),
+                "body": (await client.get(path)).json(),
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="database to use, a temporary sqlite file by default")
+    parser.add_argument("--authors", type=int, default=2000)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--instances", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    directory = None
+    if args.url is None:
+        directory = tempfile.TemporaryDirectory()
+        args.url = f"sqlite:///{os.path.join(directory.name, 'benchmark.db')}"
+    # the engines are created on import, so the url has to be set first
+    os.environ["DATABASE_URL"] = args.url
+
+    from sql import database
+    from benchmarks.seed import seed
+    import main as app_module
+
+    print(f"seeding {args.books} books and {args.instances} instances ...")
+    seed(database.engine, args.authors, args.books, args.instances, args.users)
+
+    default = asyncio.run(measure(app_module.app, False, args.requests))
+    fast = asyncio.run(measure(app_module.app, True, args.requests))
+
+    for path in PATHS:
+        before = default[path]["requests_per_second"]
+        after = fast[path]["requests_per_second"]
+        same = "same body" if default[path]["body"] == fast[path]["body"] else "BODIES DIFFER"
+        print(f"{path:40} {before:8.1f} -> {after:8.1f} req/s  x{after / before:.2f}  ({same})")
+    database.engine.dispose()
+    if directory is not None:
+        directory.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+
+import time
+import uuid
+
+
+class CacheBackend(ABC):
+    """
+    interface of a cache backend. subclass it to share the cache between
+    workers (e.g. on top of redis or memcached) and pass an instance to
+    `set_user_backend`. values are plain dicts, so a shared backend only
+    has to serialize them as json.
+    """
+    @abstractmethod
+    def get(self, key: str):
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value, ttl: float):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+class LocalCache(CacheBackend):
+    """
+    process-local LRU cache whose entries expire after their ttl.
+    """
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class DictCache(CacheBackend):
+    """
+    process-local dict whose entries never expire and are never evicted,
+    for a small, fixed set of keys.
+    """
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key: str):
+        return self._entries.get(key)
+
+    def set(self, key: str, value, ttl: float):
+        self._entries[key] = value
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+
+# authenticated users
+USER_CACHE_TTL_SECONDS = 30
+USER_CACHE_MAX_SIZE = 4096
+
+_user_backend: CacheBackend = LocalCache(USER_CACHE_MAX_SIZE)
+
+def set_user_backend(backend: CacheBackend):
+    global _user_backend
+    _user_backend = backend
+
+def get_user(username: str) -> dict | None:
+    return _user_backend.get(f"user:{username}")
+
+def set_user(username: str, user) -> dict:
+    """
+    caches the fields authorization needs and returns them.
+    """
+    data = {
+        "id": user.id,
+        "username": user.username,
+        "is_active": bool(user.is_active),
+        "is_superuser": bool(user.is_superuser),
+    }
+    _user_backend.set(f"user:{username}", data, USER_CACHE_TTL_SECONDS)
+    return data
+
+def invalidate_user(username: str):
+    _user_backend.delete(f"user:{username}")
+
+
+# token revocations. tokens embedding their user's claims are verified
+# against this table alone: user id -> lowest token version still
+# valid, for the users whose tokens were revoked within the token
+# lifetime, so it stays small. it is reloaded from the token_revocations
+# table once it's TOKEN_REVOCATIONS_REFRESH_SECONDS old, which is how
+# the revocations of other workers arrive, and a worker revoking tokens
+# applies it right away.
+TOKEN_REVOCATIONS_REFRESH_SECONDS = 5
+
+_token_revocations: dict[int, int] = {}
+_token_revocations_loaded_at = None
+
+def token_revocations_stale() -> bool:
+    return _token_revocations_loaded_at is None or \
+        time.monotonic() - _token_revocations_loaded_at >= TOKEN_REVOCATIONS_REFRESH_SECONDS
+
+def set_token_revocations(revocations: dict[int, int]):
+    global _token_revocations, _token_revocations_loaded_at
+    _token_revocations = revocations
+    _token_revocations_loaded_at = time.monotonic()
+
+def revoke_tokens(user_id: int, token_version: int):
+    """
+    refuses the tokens of `user_id` with a version below `token_version`.
+    """
+    _token_revocations[user_id] = max(token_version, _token_revocations.get(user_id, 0))
+
+def token_revoked(user_id: int, token_version: int) -> bool:
+    return token_version < _token_revocations.get(user_id, 0)
+
+
+# responses of public, rarely changing GET routes. every entry is tagged
+# with the entity types it was rendered from and remembers their
+# generation when it was stored. crud bumps the generation of a type
+# whenever it changes rows of it, which makes every entry tagged with
+# it stale at once. generations are kept apart from the responses, so
+# filling the LRU with responses can't evict them and make every entry
+# of a type stale.
+RESPONSE_CACHE_TTL_SECONDS = 60
+RESPONSE_CACHE_MAX_SIZE = 1024
+GENERATION_TTL_SECONDS = 24 * 60 * 60
+
+_response_backend: CacheBackend = LocalCache(RESPONSE_CACHE_MAX_SIZE)
+_generation_backend: CacheBackend = DictCache()
+_response_stats = {}
+_response_stats_lock = Lock()
+
+def set_response_backend(backend: CacheBackend, generation_backend: CacheBackend | None = None):
+    """
+    a backend shared between workers needs a shared `generation_backend`
+    too, for them to see each other's invalidations. it should keep the
+    generations for GENERATION_TTL_SECONDS without evicting them.
+    """
+    global _response_backend, _generation_backend
+    _response_backend = backend
+    if generation_backend is not None:
+        _generation_backend = generation_backend
+
+def _new_generation(tag: str) -> str:
+    generation = uuid.uuid4().hex
+    _generation_backend.set(f"generation:{tag}", generation, GENERATION_TTL_SECONDS)
+    return generation
+
+def generations(tags) -> dict:
+    """
+    the current generation of every tag. a tag without one (never seen,
+    or expired in a shared backend) gets a new one, which no entry can
+    match.
+    """
+    return {tag: _generation_backend.get(f"generation:{tag}") or _new_generation(tag) for tag in tags}
+
+def get_response(key: str, tags) -> dict | None:
+    entry = _response_backend.get(f"response:{key}")
+    if entry is None or entry["generations"] != generations(tags):
+        return None
+    return entry
+
+def set_response(key: str, entry: dict, entry_generations: dict):
+    """
+    stores `entry` (a dict of plain values) with the generations read
+    *before* the response was rendered, so a change committed meanwhile
+    leaves it stale instead of cached.
+    """
+    _response_backend.set(f"response:{key}", {**entry, "generations": entry_generations}, RESPONSE_CACHE_TTL_SECONDS)
+
+def invalidate_responses(*tags: str):
+    for tag in tags:
+        _new_generation(tag)
+
+def record_response(route: str, hit: bool):
+    with _response_stats_lock:
+        stats = _response_stats.setdefault(route, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+
+def response_stats() -> dict:
+    with _response_stats_lock:
+        routes = {route: dict(stats) for route, stats in _response_stats.items()}
+    return {
+        "hits": sum(stats["hits"] for stats in routes.values()),
+        "misses": sum(stats["misses"] for stats in routes.values()),
+        "routes": routes,
+    }
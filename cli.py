@@ -0,0 +1,125 @@
+"""
+Maintenance commands that run against the configured database without
+going through the API.
+
+    python cli.py import books books.ndjson
+    python cli.py import bookinstances copies.csv
+    python cli.py reconcile-counters
+    python cli.py sweep-reservations
+    python cli.py overdue --format csv > overdue.csv
+    python cli.py refresh-overdue-summary
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from sql import bulk, crud, database, reports
+import streaming
+import sweeper
+
+IMPORTERS = {
+    "authors": bulk.import_authors,
+    "books": bulk.import_books,
+    "bookinstances": bulk.import_book_instances,
+}
+
+async def read_file(path: str, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+async def import_file(kind: str, path: str, file_format: str):
+    rows = bulk.parse_csv(read_file(path)) if file_format == "csv" else bulk.parse_ndjson(read_file(path))
+    async with database.AsyncSessionLocal() as db:
+        result = await IMPORTERS[kind](db, rows)
+    await database.async_engine.dispose()
+    return result
+
+def run_import(args):
+    file_format = args.format or ("csv" if os.path.splitext(args.file)[1].lower() == ".csv" else "ndjson")
+    result = asyncio.run(import_file(args.kind, args.file, file_format))
+    for error in result.errors:
+        print(f"line {error.line}: {error.error}", file=sys.stderr)
+    print(f"inserted {result.inserted} {args.kind}, {len(result.errors)} errors")
+    return 1 if result.errors else 0
+
+async def reconcile_counters():
+    async with database.AsyncSessionLocal() as db:
+        await crud.reconcile_book_counters(db)
+    await database.async_engine.dispose()
+
+def run_reconcile_counters(args):
+    asyncio.run(reconcile_counters())
+    print("book counters recomputed")
+    return 0
+
+async def sweep_reservations():
+    released = await sweeper.sweep_once()
+    await database.async_engine.dispose()
+    return released
+
+def run_sweep_reservations(args):
+    released = asyncio.run(sweep_reservations())
+    if released is None:
+        print("another process is sweeping")
+    else:
+        print(f"released {released} expired reservations")
+    return 0
+
+async def write_overdue(file_format: str):
+    batches = streaming.stream_batches(reports.overdue_loans())
+    if file_format == "csv":
+        chunks = streaming.encode_csv(batches, [*reports.BORROWER_COLUMNS, *reports.LOAN_COLUMNS])
+    else:
+        chunks = streaming.encode_ndjson(reports.group_by_borrower(batches))
+    async for chunk in chunks:
+        sys.stdout.write(chunk)
+    await database.async_engine.dispose()
+
+def run_overdue(args):
+    asyncio.run(write_overdue(args.format))
+    return 0
+
+async def refresh_overdue_summary():
+    async with database.AsyncSessionLocal() as db:
+        count = await reports.refresh_overdue_summary(db)
+    await database.async_engine.dispose()
+    return count
+
+def run_refresh_overdue_summary(args):
+    count = asyncio.run(refresh_overdue_summary())
+    print(f"{count} borrowers with overdue loans")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="bulk import rows from an NDJSON or CSV file")
+    import_parser.add_argument("kind", choices=IMPORTERS)
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=["ndjson", "csv"],
+                               help="guessed from the file extension by default")
+    import_parser.set_defaults(handler=run_import)
+
+    reconcile_parser = commands.add_parser(
+        "reconcile-counters", help="recompute the instance counters of every book from its instances")
+    reconcile_parser.set_defaults(handler=run_reconcile_counters)
+
+    sweep_parser = commands.add_parser("sweep-reservations", help="release every expired reservation")
+    sweep_parser.set_defaults(handler=run_sweep_reservations)
+
+    overdue_parser = commands.add_parser("overdue", help="write every overdue loan to stdout")
+    overdue_parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    overdue_parser.set_defaults(handler=run_overdue)
+
+    summary_parser = commands.add_parser(
+        "refresh-overdue-summary", help="recompute the overdue_summary table, e.g. daily from cron")
+    summary_parser.set_defaults(handler=run_refresh_overdue_summary)
+
+    args = parser.parse_args()
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
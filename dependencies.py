@@ -1,16 +1,25 @@
 from typing import Annotated
 
 from fastapi.security import OAuth2PasswordBearer, SecurityScopes
-from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import Depends, HTTPException, Request, Response, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import ValidationError, BaseModel
 
+import asyncio
 import jwt
 import bcrypt
+import hashlib
+import hmac
 import json
+import secrets
+import uuid
 from datetime import timedelta, datetime, timezone
+from email.utils import format_datetime
 
-from sql import crud, database, models
+from sql import crud, database, models, pagination, schemas
+import cache
+import hashing
 
 with open(".env", "r") as env_file:
     file_dict = json.loads(env_file.read())
@@ -19,6 +28,21 @@ with open(".env", "r") as env_file:
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# refresh tokens renew access tokens without the password (and bcrypt).
+# every refresh moves the expiry forward, so a session lives as long as
+# it's used at least once per period.
+REFRESH_TOKEN_EXPIRE_DAYS = database.settings.get("refresh_token_expire_days", 14)
+
+# list routes load only the columns of their Inline schema as plain rows
+# and serialize them with orjson, skipping the ORM objects and the
+# response_model validation. off by default, turn it on in .env.
+FAST_LIST_SERIALIZATION = database.settings.get("fast_list_serialization", False)
+
+# tokens carry the user's id, active and superuser flags and token
+# version (uid, act, su, ver), which lets get_current_user skip the
+# database and check them against cache's token revocations instead.
+# tokens without them still work, through the user cache.
+TOKEN_USER_CLAIMS = database.settings.get("token_user_claims", True)
 
 class TokenData(BaseModel):
     username: str | None = None
@@ -28,22 +52,99 @@ oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl='token',
     scopes={"super": "permission to perform administrator action"},)
 
-def hash_password(password):
+def _hash_password(password):
     password_as_bytes = bytes(password, "utf-8")
     return bcrypt.hashpw(password_as_bytes, bcrypt.gensalt()).decode("utf-8")
 
-def check_password(password, hashed_password):
+def _check_password(password, hashed_password):
     password_as_bytes = bytes(password, 'utf-8')
     hashed_password_as_bytes = bytes(hashed_password, 'utf-8')
     return bcrypt.checkpw(password_as_bytes, 
                           hashed_password_as_bytes)
 
-def get_db():
-    db = database.SessionLocal()
-    try:
+# bcrypt runs on hashing.pool. these raise hashing.HashingPoolBusy when
+# too many hashes are already waiting.
+async def hash_password_async(password):
+    return await hashing.pool.run_async(_hash_password, password)
+
+async def check_password_async(password, hashed_password):
+    return await hashing.pool.run_async(_check_password, password, hashed_password)
+
+async def get_db():
+    async with database.AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+def _cursor(cursor: str | None, key_types: tuple):
+    if cursor is None:
+        return None
+    try:
+        return pagination.decode_cursor(cursor, key_types)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def get_cursor(cursor: str | None = None):
+    """
+    decodes the opaque `cursor` query parameter of list endpoints sorted
+    by an integer id.
+    """
+    return _cursor(cursor, (int,))
+
+def get_uuid_cursor(cursor: str | None = None):
+    """
+    get_cursor for list endpoints sorted by a uuid id.
+    """
+    return _cursor(cursor, (uuid.UUID,))
+
+def set_next_cursor(response: Response, items, limit: int):
+    """
+    puts the cursor of the next page in the X-Next-Cursor header. the
+    header is missing on the last page.
+    """
+    next_cursor = pagination.next_cursor(items, limit)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+def list_row_schema(schema: type[BaseModel]):
+    """
+    the `row_schema` to pass to a crud list function, None unless the
+    fast serialization path is on.
+    """
+    return schema if FAST_LIST_SERIALIZATION else None
+
+def list_response(response: Response, items, limit: int):
+    """
+    sets the next page cursor and returns what a list route should return
+    for `items`: the items themselves, or on the fast path their rows
+    already rendered by orjson.
+    """
+    set_next_cursor(response, items, limit)
+    if not FAST_LIST_SERIALIZATION:
+        return items
+    headers = {key: value for key, value in response.headers.items() if key != "content-length"}
+    return ORJSONResponse([item._asdict() for item in items], headers=headers)
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+def not_modified(request: Request, response: Response, version: tuple):
+    """
+    sets a strong ETag and Last-Modified derived from `version` (see the
+    crud versions) on `response`. returns a 304 response to send instead
+    of the body when the client's If-None-Match already has this version,
+    None otherwise.
+    """
+    etag = '"' + hashlib.sha256(repr(version).encode("utf-8")).hexdigest()[:32] + '"'
+    headers = {"ETag": etag}
+    timestamps = [part for part in version if isinstance(part, datetime)]
+    if timestamps:
+        headers["Last-Modified"] = format_datetime(max(timestamps).replace(tzinfo=timezone.utc), usegmt=True)
+    response.headers.update(headers)
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+    return None
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -55,10 +156,64 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(
+def create_user_token(user, expires_delta: timedelta | None = None):
+    """
+    the access token /token issues for `user` (a models.User).
+    """
+    data = {"sub": user.username, "scopes": ["super"] if user.is_superuser else []}
+    if TOKEN_USER_CLAIMS:
+        data.update({
+            "uid": user.id,
+            "act": bool(user.is_active),
+            "su": bool(user.is_superuser),
+            "ver": user.token_version,
+        })
+    return create_access_token(data, expires_delta)
+
+def _refresh_secret_hash(secret: str) -> str:
+    return hmac.new(SECRET_KEY.encode("utf-8"), secret.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def _refresh_token_expiry():
+    return models.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+
+async def create_refresh_token(db: AsyncSession, user_id: int) -> str:
+    """
+    starts a session for `user_id` and returns its refresh token.
+    """
+    session_id = uuid.uuid4().hex
+    secret = secrets.token_urlsafe(32)
+    await crud.create_session(db, user_id, session_id, _refresh_secret_hash(secret), _refresh_token_expiry())
+    return f"{session_id}.{secret}"
+
+async def rotate_refresh_token(db: AsyncSession, refresh_token: str):
+    """
+    returns the user of `refresh_token` and the refresh token replacing
+    it, or None if it isn't valid (anymore).
+    """
+    session_id, _, secret = refresh_token.partition(".")
+    if not session_id or not secret:
+        return None
+    new_secret = secrets.token_urlsafe(32)
+    user = await crud.rotate_session(
+        db, session_id, _refresh_secret_hash(secret), _refresh_secret_hash(new_secret), _refresh_token_expiry())
+    if user is None:
+        return None
+    return user, f"{session_id}.{new_secret}"
+
+_token_revocations_lock = asyncio.Lock()
+
+async def refresh_token_revocations(db: AsyncSession):
+    if not cache.token_revocations_stale():
+        return
+    async with _token_revocations_lock:
+        # another request may have reloaded them while this one waited
+        if cache.token_revocations_stale():
+            cache.set_token_revocations(await crud.get_token_revocations(db))
+
+async def get_current_user(
         security_scopes: SecurityScopes,
         token: Annotated[str, Depends(oauth2_scheme)], 
-        db: Annotated[Session, Depends(get_db)]):
+        db: Annotated[AsyncSession, Depends(get_db)]):
     
     if security_scopes.scopes:
         authenticate_value = f"Bearer scopes=\"{security_scopes.scope_str}\""
@@ -78,9 +233,23 @@ def get_current_user(
         token_data = TokenData(username=username, scopes=token_scopes)
     except (jwt.exceptions.InvalidTokenError, ValidationError):
         raise credintials_exception
-    user = crud.get_user_by_username(db, username)
+    if "uid" in payload and "ver" in payload:
+        await refresh_token_revocations(db)
+        if cache.token_revoked(payload["uid"], payload["ver"]):
+            raise credintials_exception
+        user = {
+            "id": payload["uid"],
+            "username": username,
+            "is_active": payload.get("act", False),
+            "is_superuser": payload.get("su", False),
+        }
+    else:
+        user = cache.get_user(username)
     if user is None:
-        raise credintials_exception
+        db_user = await crud.get_user_by_username(db, username)
+        if db_user is None:
+            raise credintials_exception
+        user = cache.set_user(username, db_user)
     for scope in security_scopes.scopes:
         if scope not in token_data.scopes:
                         raise HTTPException(
@@ -88,10 +257,10 @@ def get_current_user(
                 detail="Not enough permissions",
                 headers={"WWW-Authenticate": authenticate_value},
             )
-    return user
+    return schemas.CurrentUser(**user)
 
-def get_current_active_user(
-        current_user: Annotated[models.User, Depends(get_current_user)]
+async def get_current_active_user(
+        current_user: Annotated[schemas.CurrentUser, Depends(get_current_user)]
         ):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
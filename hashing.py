@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Lock
+
+import asyncio
+import time
+
+# bcrypt releases the GIL while hashing, so threads are enough to use
+# every worker core without the pickling overhead of a process pool.
+HASHING_WORKERS = 2
+HASHING_MAX_PENDING = 32 # hashes queued or running before new ones are refused
+
+class HashingPoolBusy(Exception):
+    pass
+
+class HashingPool:
+    """
+    a small dedicated pool for bcrypt, so password hashing can't take
+    the threads the rest of the app needs. once `max_pending` hashes are
+    waiting, `submit` raises HashingPoolBusy instead of queueing more.
+    """
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashing")
+        self._lock = Lock()
+        self._pending = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._queue_wait_seconds = 0.0
+        self._queue_wait_seconds_max = 0.0
+        self._hash_seconds = 0.0
+
+    def submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise HashingPoolBusy()
+            self._pending += 1
+            self._submitted += 1
+        queued_at = time.perf_counter()
+
+        def run():
+            started_at = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self._record(started_at - queued_at, time.perf_counter() - started_at)
+
+        try:
+            future = self._executor.submit(run)
+        except RuntimeError:
+            self._release()
+            raise
+        # also called when the future is cancelled before it ran, e.g. by
+        # run_async when the request awaiting it is cancelled
+        future.add_done_callback(self._release)
+        return future
+
+    async def run_async(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _release(self, future: Future | None = None):
+        with self._lock:
+            self._pending -= 1
+
+    def _record(self, queue_wait: float, hash_time: float):
+        with self._lock:
+            self._completed += 1
+            self._queue_wait_seconds += queue_wait
+            self._queue_wait_seconds_max = max(self._queue_wait_seconds_max, queue_wait)
+            self._hash_seconds += hash_time
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "queue_wait_seconds_total": self._queue_wait_seconds,
+                "queue_wait_seconds_max": self._queue_wait_seconds_max,
+                "hash_seconds_total": self._hash_seconds,
+            }
+
+pool = HashingPool(HASHING_WORKERS, HASHING_MAX_PENDING)
@@ -0,0 +1,277 @@
+"""
+Per request database instrumentation.
+
+Cursor execution hooks on both engines count the statements and add up
+the time spent in them for the request being served, found through a
+context variable set by `record_request` (an http middleware). Every
+response gets a `Server-Timing` header, e.g.
+
+    Server-Timing: db;dur=4.81;desc="7 queries", app;dur=12.06
+
+and one JSON log line on the "instrumentation.requests" logger (INFO).
+Statements slower than `slow_query_ms` are logged on the
+"instrumentation.slow_queries" logger (WARNING) with their parameters
+and query plan, except that statements on the users and sessions tables
+(which carry password hashes and session secrets) only get the type and
+length of each parameter and no plan.
+
+Requests are also counted and timed per route template in `metrics`,
+which `render_metrics` (GET /metrics) renders along with the state of
+the connection pools, the threadpool, the hashing pool and the response
+cache. With several workers set `metrics_dir` to a directory they can
+all write to (empty it before starting them): each worker writes its
+snapshot there every `metrics_snapshot_interval_seconds` and on every
+scrape, and a scrape returns all of them merged.
+"""
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+import anyio.to_thread
+
+from contextvars import ContextVar
+import asyncio
+import json
+import logging
+import re
+import time
+
+from sql import database, models
+import cache
+import hashing
+import metrics
+
+SLOW_QUERY_MS = database.settings.get("slow_query_ms", 200)
+EXPLAIN_SLOW_QUERIES = database.settings.get("explain_slow_queries", True)
+MAX_LOGGED_PARAMETER_LENGTH = 200
+REDACTED_TABLES = (models.User.__tablename__, models.UserSession.__tablename__)
+METRICS_DIR = database.settings.get("metrics_dir")
+METRICS_SNAPSHOT_INTERVAL_SECONDS = database.settings.get("metrics_snapshot_interval_seconds", 5)
+
+request_logger = logging.getLogger("instrumentation.requests")
+slow_query_logger = logging.getLogger("instrumentation.slow_queries")
+metrics_logger = logging.getLogger("instrumentation.metrics")
+
+_request_stats: ContextVar[dict | None] = ContextVar("request_stats", default=None)
+
+REQUEST_LABELS = ["method", "router", "route"]
+REQUESTS = metrics.Counter(
+    "http_requests_total", "Requests served.", [*REQUEST_LABELS, "status"])
+REQUEST_DURATION = metrics.Histogram(
+    "http_request_duration_seconds", "Time until the response starts.", REQUEST_LABELS)
+REQUEST_QUERIES = metrics.Counter(
+    "http_request_db_queries_total", "SQL statements run for requests.", REQUEST_LABELS)
+REQUEST_DB_SECONDS = metrics.Counter(
+    "http_request_db_seconds_total", "Time spent in SQL statements for requests.", REQUEST_LABELS)
+REQUESTS_IN_PROGRESS = metrics.Gauge(
+    "http_requests_in_progress", "Requests being served.")
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_started_at"].pop()) * 1000
+    if conn.info.get("explaining"):
+        return
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["db_ms"] += elapsed_ms
+    if SLOW_QUERY_MS and elapsed_ms >= SLOW_QUERY_MS:
+        _log_slow_query(conn, statement, parameters, executemany, elapsed_ms)
+
+def _short(value):
+    text = repr(value)
+    if len(text) > MAX_LOGGED_PARAMETER_LENGTH:
+        return text[:MAX_LOGGED_PARAMETER_LENGTH] + "..."
+    return text
+
+_redacted_statement = re.compile(r"\b(%s)\b" % "|".join(REDACTED_TABLES), re.IGNORECASE)
+
+def _redact(value):
+    """
+    `value` (statement parameters) with every value replaced by its
+    type, and its length for strings.
+    """
+    if isinstance(value, (list, tuple)):
+        return [_redact(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _redact(item) for key, item in value.items()}
+    if value is None:
+        return None
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    return f"<{type(value).__name__}>"
+
+def explain(conn, statement: str, parameters) -> str | None:
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE")):
+        return None
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    conn.info["explaining"] = True
+    try:
+        rows = conn.exec_driver_sql(prefix + statement, parameters).all()
+    except Exception as exc:
+        return f"EXPLAIN failed: {exc}"
+    finally:
+        conn.info["explaining"] = False
+    return "\n".join(str(row[-1]) for row in rows)
+
+def _log_slow_query(conn, statement, parameters, executemany, elapsed_ms):
+    redacted = _redacted_statement.search(statement) is not None
+    record = {
+        "event": "slow_query",
+        "duration_ms": round(elapsed_ms, 2),
+        "statement": statement,
+        "parameters": _short(_redact(parameters) if redacted else parameters),
+    }
+    stats = _request_stats.get()
+    if stats is not None:
+        record["path"] = stats["path"]
+    # postgres plans show the parameters the statement was run with
+    if EXPLAIN_SLOW_QUERIES and not executemany and not redacted:
+        record["plan"] = explain(conn, statement, parameters)
+    slow_query_logger.warning(json.dumps(record))
+
+def instrument(engine):
+    """
+    installs the hooks on a (sync) engine. for an AsyncEngine pass its
+    `sync_engine`.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+instrument(database.engine)
+instrument(database.async_engine.sync_engine)
+
+def route_labels(method: str, route) -> tuple:
+    """
+    (method, router, route) labels of a request. the router is the first
+    segment of the route template, requests that matched no route share
+    one label so unknown paths can't grow the series.
+    """
+    template = getattr(route, "path", None)
+    if template is None:
+        return method, "", "(unmatched)"
+    router = "/" + template.strip("/").split("/")[0]
+    return method, router, template
+
+async def record_request(request: Request, call_next):
+    stats = {"path": request.url.path, "queries": 0, "db_ms": 0.0}
+    token = _request_stats.set(stats)
+    REQUESTS_IN_PROGRESS.inc()
+    started_at = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _request_stats.reset(token)
+        REQUESTS_IN_PROGRESS.dec()
+    total_ms = (time.perf_counter() - started_at) * 1000
+    response.headers["Server-Timing"] = \
+        f'db;dur={stats["db_ms"]:.2f};desc="{stats["queries"]} queries", app;dur={total_ms:.2f}'
+    route = request.scope.get("route")
+    labels = route_labels(request.method, route)
+    REQUESTS.inc(*labels, str(response.status_code))
+    REQUEST_DURATION.observe(total_ms / 1000, *labels)
+    REQUEST_QUERIES.inc(*labels, amount=stats["queries"])
+    REQUEST_DB_SECONDS.inc(*labels, amount=stats["db_ms"] / 1000)
+    request_logger.info(json.dumps({
+        "event": "request",
+        "method": request.method,
+        "path": request.url.path,
+        "route": getattr(route, "path", None),
+        "status": response.status_code,
+        "duration_ms": round(total_ms, 2),
+        "db_queries": stats["queries"],
+        "db_ms": round(stats["db_ms"], 2),
+    }))
+    return response
+
+def _pool_families() -> list[dict]:
+    samples = {"size": [], "checked_out": [], "overflow": [], "max_overflow": []}
+    for label, engine in (("sync", database.engine), ("async", database.async_engine.sync_engine)):
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        labels = {"engine": label}
+        samples["size"].append(("db_pool_size", labels, pool.size()))
+        samples["checked_out"].append(("db_pool_checked_out", labels, pool.checkedout()))
+        # negative while the pool hasn't opened pool_size connections yet
+        samples["overflow"].append(("db_pool_overflow", labels, max(0, pool.overflow())))
+        samples["max_overflow"].append(("db_pool_max_overflow", labels, database.MAX_OVERFLOW))
+    return [
+        metrics.family("db_pool_size", "gauge", "Connections the pool keeps.", samples["size"]),
+        metrics.family("db_pool_checked_out", "gauge", "Connections in use.", samples["checked_out"]),
+        metrics.family("db_pool_overflow", "gauge", "Connections open beyond the pool size.", samples["overflow"]),
+        metrics.family("db_pool_max_overflow", "gauge", "Connections allowed beyond the pool size.",
+                       samples["max_overflow"]),
+    ]
+
+def _threadpool_families() -> list[dict]:
+    # the limiter run_in_threadpool (sync dependencies and routes) goes through
+    statistics = anyio.to_thread.current_default_thread_limiter().statistics()
+    return [
+        metrics.family("threadpool_threads", "gauge", "Threads the threadpool may run.",
+                       [("threadpool_threads", {}, statistics.total_tokens)]),
+        metrics.family("threadpool_busy", "gauge", "Threads running a call.",
+                       [("threadpool_busy", {}, statistics.borrowed_tokens)]),
+        metrics.family("threadpool_waiting", "gauge", "Calls waiting for a thread.",
+                       [("threadpool_waiting", {}, statistics.tasks_waiting)]),
+    ]
+
+def _hashing_families() -> list[dict]:
+    stats = hashing.pool.stats()
+    def one(name, kind, documentation, value):
+        return metrics.family(name, kind, documentation, [(name, {}, value)])
+    return [
+        one("hashing_workers", "gauge", "Threads hashing passwords.", stats["workers"]),
+        one("hashing_pending", "gauge", "Hashes running or queued.", stats["pending"]),
+        one("hashing_queued", "gauge", "Hashes waiting for a thread.", max(0, stats["pending"] - stats["workers"])),
+        one("hashing_submitted_total", "counter", "Hashes submitted.", stats["submitted"]),
+        one("hashing_rejected_total", "counter", "Hashes refused because the queue was full.", stats["rejected"]),
+        one("hashing_queue_wait_seconds_total", "counter", "Time hashes spent queued.",
+            stats["queue_wait_seconds_total"]),
+        one("hashing_seconds_total", "counter", "Time spent hashing.", stats["hash_seconds_total"]),
+    ]
+
+def _cache_families() -> list[dict]:
+    samples = []
+    for route, stats in cache.response_stats()["routes"].items():
+        samples.append(("cache_responses_total", {"route": route, "result": "hit"}, stats["hits"]))
+        samples.append(("cache_responses_total", {"route": route, "result": "miss"}, stats["misses"]))
+    return [metrics.family("cache_responses_total", "counter", "Cached route lookups.", samples)]
+
+COLLECTORS = [_pool_families, _threadpool_families, _hashing_families, _cache_families]
+
+def render_metrics() -> str:
+    """
+    every metric in the Prometheus text format, of all workers when
+    METRICS_DIR is set. has to run on the event loop.
+    """
+    families = metrics.collect(COLLECTORS)
+    if METRICS_DIR:
+        metrics.write_snapshot(METRICS_DIR, families)
+        families = metrics.read_snapshots(METRICS_DIR)
+    return metrics.render(families)
+
+async def write_snapshots(interval: float = METRICS_SNAPSHOT_INTERVAL_SECONDS):
+    while True:
+        try:
+            metrics.write_snapshot(METRICS_DIR, metrics.collect(COLLECTORS))
+        except Exception:
+            metrics_logger.exception("writing the metrics snapshot failed")
+        await asyncio.sleep(interval)
+
+def start() -> asyncio.Task | None:
+    if not METRICS_DIR:
+        return None
+    return asyncio.create_task(write_snapshots())
+
+async def stop(task: asyncio.Task | None):
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    # the last values, so the counters of this worker outlive it
+    metrics.write_snapshot(METRICS_DIR, metrics.collect(COLLECTORS))
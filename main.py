@@ -1,14 +1,21 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
 
 from typing import Annotated
 from datetime import timedelta
+from urllib.parse import urlencode
 import json
 
-from sql import crud, models, schemas, database
+from sql import crud, models, schemas, database, search
 from sql.database import engine
+import cache
 import dependencies
+import hashing
+import instrumentation
+import sweeper
 from dependencies import get_db, get_current_active_user
 from routers.users import router as users_router
 from routers.books import router as books_router
@@ -16,10 +23,15 @@ from routers.authors import router as authors_router
 from routers.genres import router as genres_router
 from routers.languages import router as langauges_router
 from routers.book_instances import router as book_instances_router
+from routers.admin import router as admin_router
+from routers.export import router as export_router
+from routers.reports import router as reports_router
 
 from contextlib import asynccontextmanager
 
 models.Base.metadata.create_all(bind=engine)
+with engine.begin() as connection:
+    search.create_index(connection)
 
 tags_metadata = [
     {
@@ -81,36 +93,38 @@ only by and exiting super user.
 These are the items you can actually borrow or reserve, not books themselves.
 """
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = crud.get_user_by_username(db, username)
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await crud.get_user_by_username(db, username)
     if not user:
         return False
-    if not dependencies.check_password(password, user.hashed_password):
+    if not await dependencies.check_password_async(password, user.hashed_password):
         return False
     return user
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    db = database.SessionLocal()
-    try:
+    async with database.AsyncSessionLocal() as db:
         with open(".env", "r") as env_file:
             file_dict = json.loads(env_file.read())
             SUPER_USER_USERNAME = file_dict['super_user_username']
             SUPER_USER_PASSWORD = file_dict['super_user_password']
             SUPER_USER_EMAIL = file_dict['super_user_email']
-        superuser_count = db.query(models.User).filter(models.User.is_superuser == True).count()
+        superuser_count = await db.scalar(
+            select(func.count()).select_from(models.User).where(models.User.is_superuser == True))
         if superuser_count == 0:
             super_user_schema = schemas.UserCreate(
                 username=SUPER_USER_USERNAME, 
                 password=SUPER_USER_PASSWORD, 
                 email=SUPER_USER_EMAIL)
-            super_user = crud.create_user(db, super_user_schema)
+            super_user = await crud.create_user(db, super_user_schema)
             super_user.is_superuser = True
-            db.commit()
-    finally:
-        db.close()
+            await db.commit()
+    sweeper_task = sweeper.start()
+    metrics_task = instrumentation.start()
     yield
-    #nothing
+    await instrumentation.stop(metrics_task)
+    await sweeper.stop(sweeper_task)
+    await database.async_engine.dispose()
 
 app = FastAPI(
     lifespan=lifespan, 
@@ -124,17 +138,77 @@ app = FastAPI(
         "email": "p.gharibpour@gmail.com",
     },)
 
+@app.exception_handler(hashing.HashingPoolBusy)
+async def hashing_pool_busy_handler(request: Request, exc: hashing.HashingPoolBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+# public GET routes served through the response cache, with the entity
+# types their responses are rendered from
+CACHED_ROUTES = {
+    "/genres/": ("genres",),
+    "/languages/": ("languages",),
+    "/authors/": ("authors",),
+    "/books/": ("books", "genres", "languages"),
+}
+
+def cache_tags(request: Request):
+    if request.method != "GET":
+        return None
+    return CACHED_ROUTES.get(request.url.path)
+
+@app.middleware("http")
+async def cache_responses(request: Request, call_next):
+    tags = cache_tags(request)
+    if tags is None:
+        return await call_next(request)
+    path = request.url.path
+    key = path + "?" + urlencode(sorted(request.query_params.multi_items()))
+    entry = cache.get_response(key, tags)
+    if entry is not None:
+        cache.record_response(path, hit=True)
+        # a hit never reaches the router, set the route it would have
+        # matched for the instrumentation
+        request.scope["route"] = next(
+            (route for route in app.routes if getattr(route, "path", None) == path), None)
+        headers = {**entry["headers"], "X-Cache": "HIT"}
+        if_none_match = request.headers.get("If-None-Match")
+        etag = entry["headers"].get("etag")
+        if etag and if_none_match and dependencies.etag_matches(etag, if_none_match):
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry["body"], headers=headers)
+    cache.record_response(path, hit=False)
+    generations = cache.generations(tags)
+    response = await call_next(request)
+    if response.status_code != 200:
+        response.headers["X-Cache"] = "MISS"
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+    cache.set_response(key, {"body": body.decode("utf-8"), "headers": headers}, generations)
+    return Response(content=body, headers={**headers, "X-Cache": "MISS"})
+
+# added last, so it's the outermost middleware and also times cache hits
+app.middleware("http")(instrumentation.record_request)
+
 @app.get('/')
 async def index():
     return {"msg": "Welcome!"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(instrumentation.render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/token", tags=["authorization"])
-def login_for_access_token(
+async def login_for_access_token(
         form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-        db: Annotated[Session, Depends(get_db)]
+        db: Annotated[AsyncSession, Depends(get_db)]
     ):
 
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -142,25 +216,50 @@ def login_for_access_token(
             headers={'WWW-Authenticate': "Bearer"},
         )
     access_token_expires = timedelta(minutes=dependencies.ACCESS_TOKEN_EXPIRE_MINUTES)
-    scopes = []
-    if user.is_superuser:
-        scopes = ["super"]
-    access_token = dependencies.create_access_token(
-        data={"sub": user.username, "scopes": scopes},
-        expires_delta=access_token_expires
+    access_token = dependencies.create_user_token(user, expires_delta=access_token_expires)
+    refresh_token = await dependencies.create_refresh_token(db, user.id)
+    return {"access_token": access_token, "token_type":"bearer", "refresh_token": refresh_token}
+
+@app.post("/token/refresh", tags=["authorization"])
+async def refresh_access_token(
+        refresh_token: Annotated[str, Form()],
+        db: Annotated[AsyncSession, Depends(get_db)]
+    ):
+    """
+    A new access token for the `refresh_token` from /token (or from the
+    last refresh), without the password. The refresh token is replaced by
+    the one returned and stops working; using it again ends the session.
+    """
+
+    refreshed = await dependencies.rotate_refresh_token(db, refresh_token)
+    if refreshed is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid refresh token",
+            headers={'WWW-Authenticate': "Bearer"},
         )
-    return {"access_token": access_token, "token_type":"bearer"}
+    user, new_refresh_token = refreshed
+    access_token_expires = timedelta(minutes=dependencies.ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = dependencies.create_user_token(user, expires_delta=access_token_expires)
+    return {"access_token": access_token, "token_type":"bearer", "refresh_token": new_refresh_token}
 
 @app.get("/users/me/", response_model=schemas.User, tags=["users"])
-def get_current_logged_in_user(
-        current_user: Annotated[schemas.User, Depends(get_current_active_user)]
+async def get_current_logged_in_user(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        current_user: Annotated[schemas.CurrentUser, Depends(get_current_active_user)]
     ):
 
-    return current_user
+    db_user = await crud.get_user(db, current_user.id, schemas.User)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User does not exist")
+    return db_user
 
 app.include_router(users_router)
 app.include_router(authors_router)
 app.include_router(genres_router)
 app.include_router(langauges_router)
 app.include_router(books_router)
-app.include_router(book_instances_router)
\ No newline at end of file
+app.include_router(book_instances_router)
+app.include_router(admin_router)
+app.include_router(export_router)
+app.include_router(reports_router)
\ No newline at end of file
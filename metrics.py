@@ -0,0 +1,190 @@
+"""
+In-process counters, gauges and histograms, rendered in the Prometheus
+text format by `render`.
+
+Recording is a dict update under a lock, nothing is sent anywhere.
+Each gunicorn worker has its own values, so when a directory is given to
+`write_snapshot`/`read_snapshots` every worker dumps its families to a
+file of its own there and a scrape, served by any one worker, merges
+them: counters and histograms are added up (a worker that exited still
+counts), gauges of live workers are kept apart by a `pid` label.
+"""
+from threading import Lock
+
+import bisect
+import json
+import math
+import os
+import uuid
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# every Counter, Gauge and Histogram, in the order they were created
+registry = []
+
+def family(name: str, kind: str, documentation: str, samples: list) -> dict:
+    """
+    a metric family as `render` and the snapshots take it. `samples` are
+    (sample name, labels dict, value) triples.
+    """
+    return {"name": name, "type": kind, "help": documentation, "samples": samples}
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = Lock()
+        self._values = {}
+        registry.append(self)
+
+    def _check(self, label_values: tuple):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}")
+
+    def collect(self) -> dict:
+        with self._lock:
+            values = list(self._values.items())
+        return family(self.name, self.kind, self.documentation, [
+            (self.name, dict(zip(self.labels, label_values)), value) for label_values, value in values])
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self._check(label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *label_values):
+        self._check(label_values)
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values, amount: float = 1):
+        self._check(label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values):
+        self._check(label_values)
+        # the count per bucket (not cumulative), then +Inf, then the sum
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            values[index] += 1
+            values[-1] += value
+
+    def collect(self) -> dict:
+        with self._lock:
+            values = [(label_values, list(counts)) for label_values, counts in self._values.items()]
+        samples = []
+        for label_values, counts in values:
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return family(self.name, self.kind, self.documentation, samples)
+
+def collect(collectors=()) -> list[dict]:
+    """
+    the families of every registered metric, then those returned by the
+    `collectors` (callables returning a list of families).
+    """
+    families = [metric.collect() for metric in registry]
+    for collector in collectors:
+        families.extend(collector())
+    return families
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render(families: list[dict]) -> str:
+    lines = []
+    for metric in families:
+        lines.append(f"# HELP {metric['name']} {_escape(metric['help'])}")
+        lines.append(f"# TYPE {metric['name']} {metric['type']}")
+        for name, labels, value in metric["samples"]:
+            if labels:
+                label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+# one file per worker process, even when a pid gets reused
+_snapshot_name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+
+def write_snapshot(directory: str, families: list[dict]):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _snapshot_name)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as snapshot:
+        json.dump({"pid": os.getpid(), "families": families}, snapshot)
+    os.replace(temporary_path, path)
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def read_snapshots(directory: str) -> list[dict]:
+    """
+    the families of every worker that wrote to `directory`, merged.
+    """
+    merged = {}
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, file_name)) as snapshot:
+                data = json.load(snapshot)
+        except (OSError, ValueError):
+            continue
+        alive = _is_alive(data["pid"])
+        for metric in data["families"]:
+            if metric["type"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(metric["name"], {**metric, "samples": {}})
+            for name, labels, value in metric["samples"]:
+                if metric["type"] == "gauge":
+                    labels = {**labels, "pid": str(data["pid"])}
+                key = (name, tuple(labels.items()))
+                if key in target["samples"]:
+                    target["samples"][key] = (name, labels, target["samples"][key][2] + value)
+                else:
+                    target["samples"][key] = (name, labels, value)
+    return [{**metric, "samples": list(metric["samples"].values())} for metric in merged.values()]
@@ -0,0 +1,26 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Security
+
+from sql import schemas
+
+from dependencies import get_current_active_user
+import cache
+import hashing
+
+router = APIRouter(prefix="/admin")
+
+@router.get("/stats/hashing", tags=["admin"])
+async def get_hashing_stats(
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])]
+    ):
+
+    return hashing.pool.stats()
+
+
+@router.get("/stats/cache", tags=["admin"])
+async def get_cache_stats(
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])]
+    ):
+
+    return cache.response_stats()
@@ -1,66 +1,96 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Security
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
-from sql import schemas, crud
+from sql import schemas, crud, bulk
 
-from dependencies import get_db, get_current_active_user
+from dependencies import get_db, get_current_active_user, get_cursor, list_row_schema, list_response, not_modified
 
 router = APIRouter(prefix="/authors")
 
 @router.post("/", response_model=schemas.Author, tags=["admin"])
-def create_author(
-        db: Annotated[Session, Depends(get_db)], 
+async def create_author(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         author: schemas.AuthorCreate
     ):
 
     try:
-        return crud.create_author(db, author)
+        return await crud.create_author(db, author, schemas.Author)
     except IntegrityError:
         raise HTTPException(status_code=400, detail="Failed to create author")
     
+@router.post("/bulk", response_model=schemas.BulkImportResult, tags=["admin"],
+             openapi_extra={"requestBody": bulk.OPENAPI_REQUEST_BODY})
+async def bulk_create_authors(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])],
+        request: Request
+    ):
+    """
+    Streams NDJSON (one author per line) or, with `Content-Type: text/csv`,
+    CSV with a header line. Rows that fail are reported by line number and
+    don't stop the others.
+    """
+
+    rows = bulk.parse_rows(request.stream(), request.headers.get("content-type"))
+    return await bulk.import_authors(db, rows)
+
 @router.get("/", response_model=list[schemas.AuthorInline], tags=["authors"])
-def get_authors(
-        db: Annotated[Session, Depends(get_db)], 
+async def get_authors(
+        db: Annotated[AsyncSession, Depends(get_db)], 
+        response: Response,
+        cursor: Annotated[tuple | None, Depends(get_cursor)],
         skip: int = 0, limit: int = 100
     ):
 
-    return crud.get_authors(db, skip, limit)
+    items = await crud.get_authors(db, skip, limit, cursor, list_row_schema(schemas.AuthorInline))
+    return list_response(response, items, limit)
 
 @router.get("/{author_id}", response_model=schemas.Author, tags=["authors"])
-def get_author(
-        db: Annotated[Session, Depends(get_db)], 
+async def get_author(
+        db: Annotated[AsyncSession, Depends(get_db)], 
+        request: Request,
+        response: Response,
         author_id: int
     ):
+    """
+    Sends an ETag. Send it back in `If-None-Match` to get a 304 while
+    neither the author nor their books changed.
+    """
 
-    db_author = crud.get_author(db, author_id)
+    version = await crud.get_author_version(db, author_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Author deos not exist")
+    if unchanged := not_modified(request, response, version):
+        return unchanged
+    db_author = await crud.get_author(db, author_id, schemas.Author)
     if db_author is None:
         raise HTTPException(status_code=404, detail="Author deos not exist")
     return db_author
 
 @router.patch("/{author_id}", response_model=schemas.Author, tags=["admin"])
-def update_author(
-        db: Annotated[Session, Depends(get_db)], 
+async def update_author(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         author: schemas.AuthorUpdate, author_id: int
     ):
     
-    db_author = crud.update_author(db, author_id, author)
+    db_author = await crud.update_author(db, author_id, author, schemas.Author)
     if db_author is None:
         raise HTTPException(status_code=404, detail="Author does not exist")
     return db_author
 
 @router.delete("/{author_id}/delete", response_model=schemas.Author, tags=["admin"])
-def delete_author(
-        db: Annotated[Session, Depends(get_db)], 
+async def delete_author(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         author_id: int
     ):
 
-    db_author = crud.delete_author(db, author_id)
+    db_author = await crud.delete_author(db, author_id, schemas.Author)
     if db_author is None:
         raise HTTPException(status_code=404, detail="Author does not exist")
     return db_author
\ No newline at end of file
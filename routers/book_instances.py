@@ -1,142 +1,133 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Path, Request, Response, Security
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
-from sql import schemas, crud
+from sql import schemas, crud, bulk
 from sql.models import BookInstanceStatus
 
-from dependencies import get_db, get_current_active_user
-
-from datetime import timedelta, datetime
+from dependencies import get_db, get_current_active_user, get_uuid_cursor, list_row_schema, list_response
 
 router = APIRouter(prefix="/bookinstances")
 
-def can_borrow_book_instance(book_instance: schemas.BookInstance, user_id: int) -> bool:
-    """
-    returns true if the book is available or if the user had reserved it or
-    if the book was reserved more than 1 day ago but haven't been borrowed.
-    """
-    return book_instance.status is BookInstanceStatus.a or \
-        (book_instance.status is BookInstanceStatus.r and ( 
-            book_instance.borrower_id is user_id or \
-            datetime.today().date > book_instance.due_back + timedelta(days=1)
-        ))
-
+# ids are uuids. anything else is refused up front, postgres would fail
+# the query casting it instead of just finding nothing
+InstanceId = Annotated[str, Path(pattern=r"^[0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}$")]
 
 @router.post("/", response_model=schemas.BookInstance, tags=["admin"])
-def create_bookinstance(
-        db: Annotated[Session, Depends(get_db)], 
+async def create_bookinstance(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         instance: schemas.BookInstanceCreate
     ):
 
     try:
-        return crud.create_book_instance(db, instance)
+        return await crud.create_book_instance(db, instance)
     except IntegrityError:
         raise HTTPException(status_code=400, detail="Failed to create book instance")
     
+@router.post("/bulk", response_model=schemas.BulkImportResult, tags=["admin"],
+             openapi_extra={"requestBody": bulk.OPENAPI_REQUEST_BODY})
+async def bulk_create_bookinstances(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])],
+        request: Request
+    ):
+    """
+    Streams NDJSON (one book instance per line) or, with `Content-Type: text/csv`,
+    CSV with a header line. Rows that fail are reported by line number and
+    don't stop the others.
+    """
+
+    rows = bulk.parse_rows(request.stream(), request.headers.get("content-type"))
+    return await bulk.import_book_instances(db, rows)
+
 @router.get("/", response_model=list[schemas.BookInstance], tags=["bookinstances"])
-def get_bookinstances(
-        db: Annotated[Session, Depends(get_db)], 
+async def get_bookinstances(
+        db: Annotated[AsyncSession, Depends(get_db)], 
+        response: Response,
+        cursor: Annotated[tuple | None, Depends(get_uuid_cursor)],
         skip: int = 0, limit: int = 100,
         status: BookInstanceStatus | None = None
     ):
 
-    return crud.get_book_instances(db, skip, limit, status)
+    instances = await crud.get_book_instances(
+        db, skip, limit, status, cursor, list_row_schema(schemas.BookInstance))
+    return list_response(response, instances, limit)
 
 @router.get("/{instance_id}", response_model=schemas.BookInstance, tags=["bookinstances"])
-def get_bookinstance(
-        db: Annotated[Session, Depends(get_db)], 
-        instance_id: str
+async def get_bookinstance(
+        db: Annotated[AsyncSession, Depends(get_db)], 
+        instance_id: InstanceId
     ):
 
-    db_bookinstance = crud.get_book_instance(db, instance_id)
+    db_bookinstance = await crud.get_book_instance(db, instance_id)
     if db_bookinstance is None:
         raise HTTPException(status_code=404, detail="Book instance deos not exist")
     return db_bookinstance
 
 @router.patch("/{instance_id}", response_model=schemas.BookInstance, tags=["admin"])
-def update_bookinstance(
-        db: Annotated[Session, Depends(get_db)], 
+async def update_bookinstance(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
-        instance: schemas.BookInstanceUpdate, instance_id: str
+        instance: schemas.BookInstanceUpdate, instance_id: InstanceId
     ):
     
-    db_bookinstance = crud.update_book_instance(db, instance_id, crud)
+    db_bookinstance = await crud.update_book_instance(db, instance_id, instance)
     if db_bookinstance is None:
         raise HTTPException(status_code=404, detail="Book instance does not exist")
     return db_bookinstance
 
 @router.delete("/{instance_id}/delete", response_model=schemas.BookInstance, tags=["admin"])
-def delete_bookinstance(
-        db: Annotated[Session, Depends(get_db)], 
+async def delete_bookinstance(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])], 
-        instance_id: str
+        instance_id: InstanceId
     ):
 
-    db_bookinstance = crud.delete_book_instance(db, instance_id)
+    db_bookinstance = await crud.delete_book_instance(db, instance_id)
     if db_bookinstance is None:
         raise HTTPException(status_code=404, detail="Book does not exist")
     return db_bookinstance
 
 @router.post("/{instance_id}/borrow", response_model=schemas.BookInstance, tags=["bookinstances"])
-def borrow_book(
-        db: Annotated[Session, Depends(get_db)],
+async def borrow_book(
+        db: Annotated[AsyncSession, Depends(get_db)],
         current_user: Annotated[schemas.User, Depends(get_current_active_user)],
-        instance_id: str
+        instance_id: InstanceId
     ):
 
-    instance_db = crud.get_book_instance(db, instance_id)
+    instance_db = await crud.borrow_book_instance(db, instance_id, current_user.id)
     if instance_db is None:
-        raise HTTPException(status_code=404, detail="Book instance not found")
-    
-    if can_borrow_book_instance(instance_db, current_user.id):
-        update_data = schemas.BookInstanceUpdate(
-            status=BookInstanceStatus.o,
-            borrower_id=current_user.id,
-            due_back=datetime.today().date() + timedelta(days=14))
-        return crud.update_book_instance(db, instance_id, update_data)
-    else:
-        raise HTTPException(status_code=400, detail="Book instance is not available")
+        if await crud.get_book_instance(db, instance_id) is None:
+            raise HTTPException(status_code=404, detail="Book instance not found")
+        raise HTTPException(status_code=409, detail="Book instance is not available")
+    return instance_db
 
 @router.post("/{instance_id}/return", response_model=schemas.BookInstance, tags=["bookinstances"]) 
-def return_book(
-        db: Annotated[Session, Depends(get_db)],
+async def return_book(
+        db: Annotated[AsyncSession, Depends(get_db)],
         current_user: Annotated[schemas.User, Depends(get_current_active_user)],
-        instance_id: str
+        instance_id: InstanceId
     ):
 
-    instance_db = crud.get_book_instance(db, instance_id)
+    instance_db = await crud.return_book_instance(db, instance_id, current_user.id)
     if instance_db is None:
-        raise HTTPException(status_code=404, detail="Book instance not found")
-    
-    if instance_db.status == schemas.BookInstanceStatus.o and \
-        instance_db.borrower_id == current_user.id:
-        update_data = schemas.BookInstanceUpdate(
-            status=schemas.BookInstanceStatus.a,
-            borrower_id=0)
-        return crud.update_book_instance(db, instance_id, update_data)
-    else:
-        raise HTTPException(status_code=400, detail="This book instance is not borrowed to you")
+        if await crud.get_book_instance(db, instance_id) is None:
+            raise HTTPException(status_code=404, detail="Book instance not found")
+        raise HTTPException(status_code=409, detail="This book instance is not borrowed to you")
+    return instance_db
     
 @router.post("/{instance_id}/reserve", response_model=schemas.BookInstance, tags=["bookinstances"])
-def reserve_book(
-    db: Annotated[Session, Depends(get_db)],
+async def reserve_book(
+    db: Annotated[AsyncSession, Depends(get_db)],
     current_user: Annotated[schemas.User, Depends(get_current_active_user)],
-    instance_id: str
+    instance_id: InstanceId
 ):
-    instance_db = crud.get_book_instance(db, instance_id)
+    instance_db = await crud.reserve_book_instance(db, instance_id, current_user.id)
     if instance_db is None:
-        raise HTTPException(status_code=404, detail="Book instance not found")
-    
-    if can_borrow_book_instance(instance_db, current_user.id):
-        update_data = schemas.BookInstanceUpdate(
-            status=BookInstanceStatus.r,
-            borrower_id=current_user.id,
-            due_back=datetime.today().date() + timedelta(days=1)
-        )
-        return crud.update_book_instance(db, instance_id, update_data)
-    else:
-        raise HTTPException(status_code=400, detail="Book instance is not available")
\ No newline at end of file
+        if await crud.get_book_instance(db, instance_id) is None:
+            raise HTTPException(status_code=404, detail="Book instance not found")
+        raise HTTPException(status_code=409, detail="Book instance is not available")
+    return instance_db
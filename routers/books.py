@@ -1,79 +1,137 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, Security
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
-from sql import schemas, crud
+from sql import schemas, crud, bulk
 
-from dependencies import get_db, get_current_active_user
+from dependencies import get_db, get_current_active_user, get_cursor, list_row_schema, list_response, not_modified
 
 router = APIRouter(prefix="/books")
 
 @router.post("/", response_model=schemas.Book, tags=["admin"])
-def create_book(
-        db: Annotated[Session, Depends(get_db)], 
+async def create_book(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         book: schemas.BookCreate
     ):
 
     try:
-        return crud.create_book(db, book)
+        return await crud.create_book(db, book, schemas.Book)
     except IntegrityError:
         raise HTTPException(status_code=400, detail="Failed to create book")
     
+@router.post("/bulk", response_model=schemas.BulkImportResult, tags=["admin"],
+             openapi_extra={"requestBody": bulk.OPENAPI_REQUEST_BODY})
+async def bulk_create_books(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])],
+        request: Request
+    ):
+    """
+    Streams NDJSON (one book per line) or, with `Content-Type: text/csv`,
+    CSV with a header line. Rows that fail are reported by line number and
+    don't stop the others.
+    """
+
+    rows = bulk.parse_rows(request.stream(), request.headers.get("content-type"))
+    return await bulk.import_books(db, rows)
+
 @router.get("/", response_model=list[schemas.BookInline], tags=["books"])
-def get_books(
-        db: Annotated[Session, Depends(get_db)],
+async def get_books(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        response: Response,
+        cursor: Annotated[tuple | None, Depends(get_cursor)],
         skip: int = 0, limit: int = 100,
-        genre: str = '', language: str = ''
+        genre: Annotated[list[str], Query()] = [],
+        language: Annotated[list[str], Query()] = [],
+        author_id: Annotated[list[int], Query()] = [],
+        available: bool | None = None
+    ):
+    """
+    Every filter can be repeated (`?genre=Fantasy&genre=Horror`) to match
+    any of the given values. Different filters must all match.
+    """
+
+    books = await crud.get_books(
+        db, skip, limit, cursor,
+        genres=genre,
+        languages=language,
+        author_ids=author_id,
+        available=available,
+        row_schema=list_row_schema(schemas.BookInline))
+    return list_response(response, books, limit)
+
+@router.get("/search", response_model=list[schemas.BookSearchResult], tags=["books"])
+async def search_books(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        q: Annotated[str, Query(min_length=1, max_length=200)],
+        skip: int = 0, limit: Annotated[int, Query(le=100)] = 20
     ):
+    """
+    Searches titles, descriptions and author names. Results are ranked
+    best match first and carry a snippet with the matches highlighted.
+    """
 
-    if not (genre or language):
-        return crud.get_books(db, skip, limit)
-    elif genre and language:
-        return crud.filter_books_by_language_and_genre(
-            db, 
-            language, 
-            genre,
-            skip,
-            limit)
-    elif genre:
-        return crud.get_books_by_genre(db, genre, skip, limit)
-    else:
-        return crud.get_books_by_language(db, language, skip, limit)
+    return await crud.search_books(db, q, skip, limit)
 
 @router.get("/{book_id}", response_model=schemas.Book, tags=["books"])
-def get_book(
-        db: Annotated[Session, Depends(get_db)], 
+async def get_book(
+        db: Annotated[AsyncSession, Depends(get_db)], 
+        request: Request,
+        response: Response,
         book_id: int
     ):
+    """
+    Sends an ETag. Send it back in `If-None-Match` to get a 304 while
+    neither the book nor its instances changed.
+    """
 
-    db_book = crud.get_book(db, book_id)
+    version = await crud.get_book_version(db, book_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Book deos not exist")
+    if unchanged := not_modified(request, response, version):
+        return unchanged
+    db_book = await crud.get_book(db, book_id, schemas.Book)
     if db_book is None:
         raise HTTPException(status_code=404, detail="Book deos not exist")
     return db_book
 
 @router.patch("/{book_id}", response_model=schemas.Book, tags=["admin"])
-def update_book(
-        db: Annotated[Session, Depends(get_db)], 
+async def update_book(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         book: schemas.BookUpdate, book_id: int
     ):
 
-    db_book = crud.update_book(db, book_id, book)
+    db_book = await crud.update_book(db, book_id, book, schemas.Book)
     if db_book is None:
         raise HTTPException(status_code=404, detail="Book does not exist")
     return db_book
 
 @router.delete("/{book_id}/delete", response_model=schemas.Book, tags=["admin"])
-def delete_book(
-        db: Annotated[Session, Depends(get_db)], 
+async def delete_book(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         book_id: int
     ):
 
-    db_book = crud.delete_book(db, book_id)
+    db_book = await crud.delete_book(db, book_id, schemas.Book)
     if db_book is None:
         raise HTTPException(status_code=404, detail="Book does not exist")
-    return db_book
\ No newline at end of file
+    return db_book
+
+@router.post("/{book_id}/borrow", response_model=schemas.BookInstance, tags=["books"])
+async def borrow_book(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        current_user: Annotated[schemas.User, Depends(get_current_active_user)],
+        book_id: int
+    ):
+
+    instance_db = await crud.borrow_any_book_instance(db, book_id, current_user.id)
+    if instance_db is None:
+        if await crud.get_book(db, book_id) is None:
+            raise HTTPException(status_code=404, detail="Book does not exist")
+        raise HTTPException(status_code=409, detail="No instance of this book is available")
+    return instance_db
\ No newline at end of file
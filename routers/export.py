@@ -0,0 +1,53 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Security
+from sqlalchemy import select
+
+from sql import schemas, models
+
+from dependencies import get_current_active_user
+from streaming import StreamFormat, stream_query
+
+router = APIRouter(prefix="/export")
+
+@router.get("/books", tags=["admin"])
+async def export_books(
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])],
+        format: StreamFormat = StreamFormat.ndjson
+    ):
+    """
+    Every book, streamed as NDJSON or CSV.
+    """
+
+    Book = models.Book
+    statement = select(Book.id, Book.title, Book.description,
+                       Book.author_id, Book.genre_id, Book.language_id).order_by(Book.id)
+    return stream_query(statement, format, "books")
+
+@router.get("/bookinstances", tags=["admin"])
+async def export_bookinstances(
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])],
+        format: StreamFormat = StreamFormat.ndjson
+    ):
+    """
+    Every book instance, streamed as NDJSON or CSV.
+    """
+
+    Instance = models.BookInstance
+    statement = select(Instance.id, Instance.book_id, Instance.imprint, Instance.status,
+                       Instance.due_back, Instance.borrower_id).order_by(Instance.id)
+    return stream_query(statement, format, "bookinstances")
+
+@router.get("/users", tags=["admin"])
+async def export_users(
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])],
+        format: StreamFormat = StreamFormat.ndjson
+    ):
+    """
+    Every user without their password hash, streamed as NDJSON or CSV.
+    """
+
+    User = models.User
+    statement = select(User.id, User.username, User.email,
+                       User.is_active, User.is_superuser).order_by(User.id)
+    return stream_query(statement, format, "users")
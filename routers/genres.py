@@ -1,55 +1,77 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Security
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
-from sql import schemas, crud
+from sql import schemas, crud, models
 
-from dependencies import get_db, get_current_active_user
+from dependencies import get_db, get_current_active_user, get_cursor, list_row_schema, list_response, not_modified
 
 router = APIRouter(prefix="/genres")
 
 @router.post("/", response_model=schemas.Genre, tags=["admin"])
-def create_genre(
-        db: Annotated[Session, Depends(get_db)], 
+async def create_genre(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         genre: schemas.GenreCreate
     ):
 
     try:
-        return crud.create_genre(db, genre)
+        return await crud.create_genre(db, genre, schemas.Genre)
     except IntegrityError:
         raise HTTPException(status_code=400, detail="Failed to create genre")
     
 @router.get("/", response_model=list[schemas.GenreInline], tags=["genres"])
-def get_genres(
-        db: Annotated[Session, Depends(get_db)], 
+async def get_genres(
+        db: Annotated[AsyncSession, Depends(get_db)], 
+        request: Request,
+        response: Response,
+        cursor: Annotated[tuple | None, Depends(get_cursor)],
         skip: int = 0, limit: int = 100
     ):
+    """
+    Sends an ETag. Send it back in `If-None-Match` to get a 304 while
+    no genre changed.
+    """
 
-    return crud.get_genres(db, skip, limit)
+    version = await crud.get_table_version(db, models.Genre)
+    if unchanged := not_modified(request, response, version):
+        return unchanged
+    items = await crud.get_genres(db, skip, limit, cursor, list_row_schema(schemas.GenreInline))
+    return list_response(response, items, limit)
+
+@router.get("/{genre_id}", response_model=schemas.Genre, tags=["genres"])
+async def get_genre(
+        db: Annotated[AsyncSession, Depends(get_db)], 
+        genre_id: int
+    ):
+
+    db_genre = await crud.get_genre(db, genre_id, schemas.Genre)
+    if db_genre is None:
+        raise HTTPException(status_code=404, detail="Genre does not exist")
+    return db_genre
 
 @router.patch("/{genre_id}", response_model=schemas.Genre, tags=["admin"])
-def update_genre(
-        db: Annotated[Session, Depends(get_db)], 
+async def update_genre(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         genre: schemas.GenreUpdate, genre_id: int
     ):
 
-    db_genre = crud.update_genre(db, genre_id, genre)
+    db_genre = await crud.update_genre(db, genre_id, genre, schemas.Genre)
     if db_genre is None:
         raise HTTPException(status_code=404, detail="Genre does not exist")
     return db_genre
 
 @router.delete("/{genre_id}/delete", response_model=schemas.Genre, tags=["admin"])
-def delete_genre(
-        db: Annotated[Session, Depends(get_db)], 
+async def delete_genre(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         genre_id: int
     ):
 
-    db_genre = crud.delete_genre(db, genre_id)
+    db_genre = await crud.delete_genre(db, genre_id, schemas.Genre)
     if db_genre is None:
         raise HTTPException(status_code=404, detail="Genre does not exist")
     return db_genre
\ No newline at end of file
@@ -1,55 +1,66 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Security
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
-from sql import schemas, crud
+from sql import schemas, crud, models
 
-from dependencies import get_db, get_current_active_user
+from dependencies import get_db, get_current_active_user, get_cursor, list_row_schema, list_response, not_modified
 
 router = APIRouter(prefix="/languages")
 
 @router.post("/", response_model=schemas.Language, tags=["admin"])
-def create_language(
-        db: Annotated[Session, Depends(get_db)], 
+async def create_language(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         language: schemas.LanguageCreate
     ):
 
     try:
-        return crud.create_language(db, language)
+        return await crud.create_language(db, language, schemas.Language)
     except IntegrityError:
         raise HTTPException(status_code=400, detail="Failed to create language")
     
 @router.get("/", response_model=list[schemas.LanguageInline], tags=["languages"])
-def get_languages(
-        db: Annotated[Session, Depends(get_db)], 
+async def get_languages(
+        db: Annotated[AsyncSession, Depends(get_db)], 
+        request: Request,
+        response: Response,
+        cursor: Annotated[tuple | None, Depends(get_cursor)],
         skip: int = 0, limit: int = 100
     ):
+    """
+    Sends an ETag. Send it back in `If-None-Match` to get a 304 while
+    no language changed.
+    """
 
-    return crud.get_languages(db, skip, limit)
+    version = await crud.get_table_version(db, models.Language)
+    if unchanged := not_modified(request, response, version):
+        return unchanged
+    items = await crud.get_languages(db, skip, limit, cursor, list_row_schema(schemas.LanguageInline))
+    return list_response(response, items, limit)
 
 @router.patch("/{language_id}", response_model=schemas.Language, tags=["admin"])
-def update_language(
-        db: Annotated[Session, Depends(get_db)], 
+async def update_language(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         language: schemas.LanguageUpdate, language_id: int
     ):
 
-    db_language = crud.update_language(db, language_id, language)
+    db_language = await crud.update_language(db, language_id, language, schemas.Language)
     if db_language is None:
         raise HTTPException(status_code=404, detail="Language does not exist")
     return db_language
 
 @router.delete("/{language_id}/delete", response_model=schemas.Language, tags=["admin"])
-def delete_language(
-        db: Annotated[Session, Depends(get_db)], 
+async def delete_language(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         language_id: int
     ):
 
-    db_language = crud.delete_language(db, language_id)
+    db_language = await crud.delete_language(db, language_id, schemas.Language)
     if db_language is None:
         raise HTTPException(status_code=404, detail="Language does not exist")
     return db_language
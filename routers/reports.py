@@ -0,0 +1,37 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Security
+
+from sql import schemas, reports
+
+from dependencies import get_current_active_user
+from streaming import StreamFormat, stream_batches, stream_query, stream_response
+
+router = APIRouter(prefix="/reports")
+
+@router.get("/overdue", tags=["admin"])
+async def get_overdue_loans(
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])],
+        format: StreamFormat = StreamFormat.ndjson
+    ):
+    """
+    Every loan past its due date. NDJSON has one line per borrower with
+    their `loans`, CSV one row per loan, both ordered by borrower.
+    """
+
+    batches = stream_batches(reports.overdue_loans())
+    if format == StreamFormat.ndjson:
+        batches = reports.group_by_borrower(batches)
+    return stream_response(batches, [*reports.BORROWER_COLUMNS, *reports.LOAN_COLUMNS], format, "overdue")
+
+@router.get("/overdue/summary", tags=["admin"])
+async def get_overdue_summary(
+        current_user: Annotated[schemas.CurrentUser, Security(get_current_active_user, scopes=["super"])],
+        format: StreamFormat = StreamFormat.ndjson
+    ):
+    """
+    Overdue loan count and oldest due date per borrower, as of the last
+    `python cli.py refresh-overdue-summary`.
+    """
+
+    return stream_query(reports.overdue_summary(), format, "overdue-summary")
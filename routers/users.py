@@ -1,81 +1,83 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response, Security
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from sql import schemas, crud
 
-from dependencies import get_db, get_current_active_user
+from dependencies import get_db, get_current_active_user, get_cursor, list_row_schema, list_response
 
 
 router = APIRouter(prefix="/users")
 
 @router.post('/', response_model=schemas.User, tags=["users"])
-def create_user(
-        db: Annotated[Session, Depends(get_db)], 
+async def create_user(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         user: schemas.UserCreate
     ):
 
     try:
-        return crud.create_user(db, user)
+        return await crud.create_user(db, user, schemas.User)
     except IntegrityError:
         raise HTTPException(status_code=400, detail="User email/username already exists")
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid email format")
 
 @router.get("/", response_model=list[schemas.UserInline], tags=["users"])
-def get_users(
-        db: Annotated[Session, Depends(get_db)], 
+async def get_users(
+        db: Annotated[AsyncSession, Depends(get_db)], 
+        response: Response,
+        cursor: Annotated[tuple | None, Depends(get_cursor)],
         skip: int = 0, limit: int = 100
     ):
 
-    users = crud.get_users(db, skip, limit)
-    return users
+    users = await crud.get_users(db, skip, limit, cursor, list_row_schema(schemas.UserInline))
+    return list_response(response, users, limit)
 
 @router.get("/{user_id}", response_model=schemas.User, tags=["users"])
-def get_user(
-        db: Annotated[Session, Depends(get_db)], 
+async def get_user(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         user_id: int
     ):
 
-    db_user = crud.get_user(db, user_id)
+    db_user = await crud.get_user(db, user_id, schemas.User)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User does not exist")
     return db_user
 
 @router.patch("/me", response_model=schemas.User, tags=["users"])
-def update_profile(
-        db: Annotated[Session, Depends(get_db)], 
+async def update_profile(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user)],
         data: schemas.UserSelfUpdate
     ):
     
-    db_user = crud.update_user(db, current_user.id, data)
+    db_user = await crud.update_user(db, current_user.id, data, schemas.User)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User does not exist")
     return db_user
 
 @router.patch("/{user_id}", response_model=schemas.User, tags=["admin"])
-def update_user(
-        db: Annotated[Session, Depends(get_db)],
+async def update_user(
+        db: Annotated[AsyncSession, Depends(get_db)],
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         data: schemas.UserUpdate, user_id: int
     ):
 
-    db_user = crud.update_user(db, user_id, data)
+    db_user = await crud.update_user(db, user_id, data, schemas.User)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User does not exist")
     return db_user
 
 @router.delete("/{user_id}/delete", response_model=schemas.User, tags=["admin"])
-def delete_user(
-        db: Annotated[Session, Depends(get_db)], 
+async def delete_user(
+        db: Annotated[AsyncSession, Depends(get_db)], 
         current_user: Annotated[schemas.User, Security(get_current_active_user, scopes=["super"])],
         user_id: int
     ):
 
-    db_user = crud.delete_user(db, user_id)
+    db_user = await crud.delete_user(db, user_id, schemas.User)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User does not exist")
     return db_user
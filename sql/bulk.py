@@ -0,0 +1,240 @@
+"""
+Bulk catalogue import from NDJSON or CSV streams, used by the admin
+`/bulk` endpoints and by `cli.py import`.
+
+Rows are validated one by one, names (authors, genres, languages, book
+titles) are resolved to ids with one query per chunk, and each chunk is
+inserted with a single multi-row INSERT in its own transaction. A chunk
+the database refuses is retried row by row, so a bad row only costs
+itself. Errors are reported with the line they came from.
+"""
+from sqlalchemy import insert, select, func
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, ValidationError
+
+from collections import Counter
+import csv
+import json
+
+from sql import crud, models, schemas, search
+import cache
+
+CHUNK_SIZE = 1000
+
+OPENAPI_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "application/x-ndjson": {"schema": {"type": "string", "description": "one JSON object per line"}},
+        "text/csv": {"schema": {"type": "string", "description": "a header line, then one row per line"}},
+    },
+}
+
+# parsing
+async def iter_lines(chunks):
+    """
+    splits a stream of byte chunks into lines.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+def _decode(line: bytes) -> str:
+    return line.decode("utf-8").rstrip("\r")
+
+async def parse_ndjson(chunks):
+    """
+    yields (line number, row dict, error) for every non-empty line.
+    """
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        try:
+            text = _decode(line)
+            if not text.strip():
+                continue
+            row = json.loads(text)
+            if not isinstance(row, dict):
+                raise ValueError("Expected a JSON object")
+        except ValueError as exc:
+            yield line_number, None, str(exc)
+            continue
+        yield line_number, row, None
+
+async def parse_csv(chunks):
+    """
+    yields (line number, row dict, error) for every row after the header.
+    every row has to fit on one line. empty cells are left out of the
+    row, so they fall back to the field's default.
+    """
+    header = None
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        try:
+            text = _decode(line)
+            if not text.strip():
+                continue
+            cells = next(csv.reader([text]))
+        except (ValueError, csv.Error) as exc:
+            yield line_number, None, str(exc)
+            continue
+        if header is None:
+            header = [cell.strip() for cell in cells]
+            continue
+        if len(cells) != len(header):
+            yield line_number, None, f"Expected {len(header)} columns, got {len(cells)}"
+            continue
+        yield line_number, {key: value for key, value in zip(header, cells) if value != ""}, None
+
+def parse_rows(chunks, content_type: str | None):
+    if content_type and content_type.split(";")[0].strip() in ("text/csv", "application/csv"):
+        return parse_csv(chunks)
+    return parse_ndjson(chunks)
+
+# importing
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}"
+        for error in exc.errors())
+
+async def _batches(rows, size: int):
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def _ids_by_name(db: AsyncSession, column, id_column, names: set[str]) -> dict:
+    if not names:
+        return {}
+    result = await db.execute(select(column, func.min(id_column)).where(column.in_(names)).group_by(column))
+    return {name: id for name, id in result.all()}
+
+def _database_error(exc: DBAPIError) -> str:
+    # the first line of the driver's message, without the statement and
+    # parameters, e.g. "value too long for type character varying(100)".
+    # asyncpg's start with its exception class in angle brackets
+    lines = str(exc.orig).strip().splitlines()
+    message = lines[0].split(">: ", 1)[-1] if lines else type(exc.orig).__name__
+    return f"Row was refused by the database: {message}"
+
+async def _insert_batch(db: AsyncSession, model, batch: list, after_insert, result: schemas.BulkImportResult):
+    if not batch:
+        return
+    try:
+        ids = (await db.scalars(insert(model).returning(model.id), [values for _, values in batch])).all()
+        if after_insert:
+            await after_insert(db, [values for _, values in batch], ids)
+        await db.commit()
+        result.inserted += len(ids)
+        return
+    except DBAPIError:
+        await db.rollback()
+    # the database refused something in the chunk (a conflict, or e.g. a
+    # value longer than its column on postgres), find out which rows
+    for line, values in batch:
+        try:
+            id = await db.scalar(insert(model).returning(model.id), values)
+            if after_insert:
+                await after_insert(db, [values], [id])
+            await db.commit()
+            result.inserted += 1
+        except IntegrityError:
+            await db.rollback()
+            result.errors.append(schemas.BulkImportError(line=line, error="Row conflicts with an existing one"))
+        except DBAPIError as exc:
+            await db.rollback()
+            result.errors.append(schemas.BulkImportError(line=line, error=_database_error(exc)))
+
+async def _import(db: AsyncSession, rows, row_schema: type[BaseModel], model, resolve, after_insert=None):
+    result = schemas.BulkImportResult()
+    # book instances also change their books' counters
+    tags = (model.__tablename__, "books") if model is models.BookInstance else (model.__tablename__,)
+    async for batch in _batches(rows, CHUNK_SIZE):
+        valid = []
+        for line, data, error in batch:
+            if error is None:
+                try:
+                    valid.append((line, row_schema.model_validate(data)))
+                    continue
+                except ValidationError as exc:
+                    error = _validation_message(exc)
+            result.errors.append(schemas.BulkImportError(line=line, error=error))
+        resolved = await resolve(db, valid, result)
+        await _insert_batch(db, model, resolved, after_insert, result)
+        if resolved:
+            cache.invalidate_responses(*tags)
+    result.errors.sort(key=lambda error: error.line)
+    return result
+
+async def _resolve_authors(db: AsyncSession, rows: list, result: schemas.BulkImportResult):
+    return [(line, row.model_dump()) for line, row in rows]
+
+async def _resolve_books(db: AsyncSession, rows: list, result: schemas.BulkImportResult):
+    author_name = models.Author.first_name + " " + models.Author.last_name
+    author_ids = await _ids_by_name(
+        db, author_name, models.Author.id, {row.author for _, row in rows if row.author_id is None and row.author})
+    genre_ids = await _ids_by_name(
+        db, models.Genre.name, models.Genre.id, {row.genre for _, row in rows if row.genre_id is None and row.genre})
+    language_ids = await _ids_by_name(
+        db, models.Language.name, models.Language.id, {row.language for _, row in rows if row.language_id is None and row.language})
+    resolved = []
+    for line, row in rows:
+        values = {"title": row.title, "description": row.description}
+        missing = None
+        for field, name, ids in (("author", row.author, author_ids),
+                                 ("genre", row.genre, genre_ids),
+                                 ("language", row.language, language_ids)):
+            id = getattr(row, f"{field}_id")
+            if id is None:
+                id = ids.get(name)
+            if id is None:
+                missing = f"Unknown {field} '{name}'" if name else f"Missing {field} or {field}_id"
+                break
+            values[f"{field}_id"] = id
+        if missing:
+            result.errors.append(schemas.BulkImportError(line=line, error=missing))
+        else:
+            resolved.append((line, values))
+    return resolved
+
+async def _resolve_book_instances(db: AsyncSession, rows: list, result: schemas.BulkImportResult):
+    book_ids = await _ids_by_name(
+        db, models.Book.title, models.Book.id, {row.book for _, row in rows if row.book_id is None and row.book})
+    resolved = []
+    for line, row in rows:
+        book_id = row.book_id if row.book_id is not None else book_ids.get(row.book)
+        if book_id is None:
+            error = f"Unknown book '{row.book}'" if row.book else "Missing book or book_id"
+            result.errors.append(schemas.BulkImportError(line=line, error=error))
+            continue
+        values = row.model_dump(exclude={"book"})
+        values["book_id"] = book_id
+        resolved.append((line, values))
+    return resolved
+
+async def _index_books(db: AsyncSession, rows: list[dict], ids: list[int]):
+    await search.index_books(db, ids)
+
+async def _count_book_instances(db: AsyncSession, rows: list[dict], ids: list[str]):
+    for (book_id, status), count in Counter((row["book_id"], row["status"]) for row in rows).items():
+        await crud.shift_book_counters(db, book_id, None, status, count)
+
+async def import_authors(db: AsyncSession, rows):
+    return await _import(db, rows, schemas.AuthorCreate, models.Author, _resolve_authors)
+
+async def import_books(db: AsyncSession, rows):
+    return await _import(db, rows, schemas.BookImport, models.Book, _resolve_books, _index_books)
+
+async def import_book_instances(db: AsyncSession, rows):
+    return await _import(
+        db, rows, schemas.BookInstanceImport, models.BookInstance, _resolve_book_instances, _count_book_instances)
@@ -1,257 +1,689 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy import select, insert, update, delete, inspect, func, distinct, case, true, and_, or_
+from pydantic import BaseModel
+
+from collections import Counter
+from functools import lru_cache
+from typing import get_args
+from datetime import date, timedelta
 
 from sql import models, schemas
 from sql.models import BookInstanceStatus
+from sql.pagination import paginate
+from sql import search
 import dependencies
-
+import cache
+
+
+@lru_cache
+def loader_options(model, schema: type[BaseModel] | None) -> tuple:
+    """
+    returns the eager loading options needed to render `schema` from
+    `model` without lazy loading. collections are loaded with selectinload
+    and many-to-one relationships with joinedload, recursively following
+    nested schemas (e.g. Author -> books -> instances).
+    """
+    if schema is None:
+        return ()
+    relationships = inspect(model).relationships
+    options = []
+    for name, field in schema.model_fields.items():
+        if name not in relationships:
+            continue
+        relationship = relationships[name]
+        attribute = getattr(model, name)
+        loader = selectinload(attribute) if relationship.uselist else joinedload(attribute)
+        nested_schema = _nested_schema(field.annotation)
+        nested_options = loader_options(relationship.mapper.class_, nested_schema)
+        if nested_options:
+            loader = loader.options(*nested_options)
+        options.append(loader)
+    return tuple(options)
+
+def _nested_schema(annotation):
+    for candidate in (annotation, *get_args(annotation)):
+        if isinstance(candidate, type) and issubclass(candidate, BaseModel):
+            return candidate
+    return None
+
+@lru_cache
+def schema_columns(model, schema: type[BaseModel]) -> tuple:
+    """
+    returns the columns of `model` that `schema` renders, in field order.
+    """
+    columns = inspect(model).column_attrs
+    return tuple(getattr(model, name) for name in schema.model_fields if name in columns)
+
+async def _all(db: AsyncSession, query, model, row_schema: type[BaseModel] | None = None):
+    """
+    runs a SELECT of `model`. with `row_schema` only the columns that
+    schema renders are loaded, as plain rows instead of ORM objects.
+    """
+    if row_schema is None:
+        return (await db.scalars(query)).all()
+    return (await db.execute(query.with_only_columns(*schema_columns(model, row_schema)))).all()
 
 # users
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user(db: AsyncSession, user_id: int, schema: type[BaseModel] | None = None):
+    return await db.scalar(
+        select(models.User).
+        options(*loader_options(models.User, schema)).
+        where(models.User.id == user_id))
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).where(models.User.username == username))
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(models.User).where(models.User.email == email))
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: tuple | None = None,
+                    row_schema: type[BaseModel] | None = None):
+    return await _all(
+        db, paginate(select(models.User), (models.User.id,), skip, limit, cursor), models.User, row_schema)
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = dependencies.hash_password(user.password)
+async def create_user(db: AsyncSession, user: schemas.UserCreate, schema: type[BaseModel] | None = None):
+    hashed_password = await dependencies.hash_password_async(user.password)
     db_user = models.User(username=user.username,
                           email = user.email,
                           hashed_password = hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
-
-def update_user(db: Session, user_id: int, data: schemas.UserUpdate):
-    db_user = db.query(models.User).filter(models.User.id == user_id)
+    await db.flush()
+    # sqlite can reuse the id of a deleted user, whose tokens stay revoked
+    revoked_version = await db.scalar(
+        select(models.TokenRevocation.token_version).where(models.TokenRevocation.user_id == db_user.id))
+    if revoked_version is not None:
+        db_user.token_version = revoked_version
+    await db.commit()
+    return await get_user(db, db_user.id, schema)
+
+# user fields tokens embed (see dependencies.create_user_token), changing
+# one revokes the user's tokens
+TOKEN_CLAIM_FIELDS = ("username", "is_active", "is_superuser")
+
+async def _revoke_tokens(db: AsyncSession, user_id: int, token_version: int):
+    await db.execute(delete(models.TokenRevocation).where(models.TokenRevocation.user_id == user_id))
+    await db.execute(insert(models.TokenRevocation).values(
+        user_id=user_id, token_version=token_version, revoked_at=models.utcnow()))
+
+async def update_user(db: AsyncSession, user_id: int, data: schemas.UserUpdate, schema: type[BaseModel] | None = None):
+    db_user = await get_user(db, user_id)
+    if db_user is None:
+        return None
     json_data = data.model_dump(exclude_none=True)
     if json_data:
-        db_user.update(json_data)
-        db.commit()
-    return db_user.first()
-
-def delete_user(db: Session, user_id: int):
-    db_user = get_user(db, user_id)
+        username = db_user.username
+        revoke = any(json_data[field] != getattr(db_user, field) for field in TOKEN_CLAIM_FIELDS if field in json_data)
+        statement = update(models.User).where(models.User.id == user_id).values(json_data)
+        if revoke:
+            token_version = await db.scalar(statement.
+                values(token_version=models.User.token_version + 1).
+                returning(models.User.token_version))
+            await _revoke_tokens(db, user_id, token_version)
+        else:
+            await db.execute(statement)
+        await db.commit()
+        cache.invalidate_user(username)
+        if revoke:
+            cache.revoke_tokens(user_id, token_version)
+    return await get_user(db, user_id, schema)
+
+async def delete_user(db: AsyncSession, user_id: int, schema: type[BaseModel] | None = None):
+    db_user = await get_user(db, user_id, schema)
     if db_user:
-        statement = update(models.BookInstance).\
-            where(models.BookInstance.borrower_id == user_id).\
-            values({'status': models.BookInstanceStatus.a})
         # for bi in db_user.borrowed_book_instances:
         #     bi.status = models.BookInstanceStatus.a
-        #     bi.borrower_id = 0
-        db.execute(statement)
-        db.delete(db_user) # borrower_id of 'BookInstace's get set to None automatically
-        db.commit()
+        #     bi.borrower_id = None
+        for status in (BookInstanceStatus.o, BookInstanceStatus.r, BookInstanceStatus.m):
+            statement = update(models.BookInstance).\
+                where(models.BookInstance.borrower_id == user_id).\
+                where(models.BookInstance.status == status).\
+                values({'status': models.BookInstanceStatus.a, 'borrower_id': None}).\
+                returning(models.BookInstance.book_id)
+            book_ids = (await db.scalars(statement)).all()
+            for book_id, count in Counter(book_ids).items():
+                await shift_book_counters(db, book_id, status, BookInstanceStatus.a, count)
+        # the released instances aren't the user's anymore
+        await db.refresh(db_user, ["borrowed_book_instances"])
+        token_version = db_user.token_version + 1
+        await _revoke_tokens(db, user_id, token_version)
+        await db.execute(delete(models.UserSession).where(models.UserSession.user_id == user_id))
+        await db.delete(db_user)
+        await db.commit()
+        cache.invalidate_responses("books", "bookinstances")
+        cache.invalidate_user(db_user.username)
+        cache.revoke_tokens(user_id, token_version)
     return db_user
 
-# authors
-def get_author(db: Session, author_id: int):
-    return db.query(models.Author).filter(models.Author.id == author_id).first()
+def _token_revocations_cutoff():
+    # a revocation older than the token lifetime has nothing left to revoke
+    return models.utcnow() - timedelta(minutes=dependencies.ACCESS_TOKEN_EXPIRE_MINUTES)
+
+async def get_token_revocations(db: AsyncSession) -> dict[int, int]:
+    """
+    user id -> lowest token version still valid, for the users whose
+    tokens were revoked within the token lifetime.
+    """
+    rows = await db.execute(
+        select(models.TokenRevocation.user_id, models.TokenRevocation.token_version).
+        where(models.TokenRevocation.revoked_at >= _token_revocations_cutoff()))
+    return dict(rows.all())
+
+async def prune_token_revocations(db: AsyncSession) -> int:
+    result = await db.execute(
+        delete(models.TokenRevocation).where(models.TokenRevocation.revoked_at < _token_revocations_cutoff()))
+    await db.commit()
+    return result.rowcount
+
+# sessions
+async def create_session(db: AsyncSession, user_id: int, session_id: str, secret_hash: str, expires_at):
+    await db.execute(insert(models.UserSession).values(
+        id=session_id, user_id=user_id, secret_hash=secret_hash, expires_at=expires_at))
+    await db.commit()
+
+async def rotate_session(db: AsyncSession, session_id: str, secret_hash: str, new_secret_hash: str, expires_at):
+    """
+    swaps the secret of an unexpired session of an active user from
+    `secret_hash` to `new_secret_hash` and returns its user, in one
+    conditional UPDATE so only one of concurrent refreshes wins. any
+    other outcome returns None and ends the session: the user was
+    deactivated, the token was expired, or already used, which means it
+    leaked or the client lost a response, either way the session can't
+    be trusted anymore.
+    """
+    user_id = await db.scalar(
+        update(models.UserSession).
+        where(models.UserSession.id == session_id,
+              models.UserSession.secret_hash == secret_hash,
+              models.UserSession.expires_at > models.utcnow(),
+              models.UserSession.user_id.in_(select(models.User.id).where(models.User.is_active == True))).
+        values(secret_hash=new_secret_hash, expires_at=expires_at).
+        returning(models.UserSession.user_id))
+    if user_id is None:
+        await db.execute(delete(models.UserSession).where(models.UserSession.id == session_id))
+        await db.commit()
+        return None
+    await db.commit()
+    return await get_user(db, user_id)
 
-def get_authors(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Author).offset(skip).limit(100).all()
+async def delete_expired_sessions(db: AsyncSession) -> int:
+    result = await db.execute(delete(models.UserSession).where(models.UserSession.expires_at <= models.utcnow()))
+    await db.commit()
+    return result.rowcount
 
-def create_author(db: Session, author: schemas.AuthorCreate):
+# authors
+async def get_author(db: AsyncSession, author_id: int, schema: type[BaseModel] | None = None):
+    return await db.scalar(
+        select(models.Author).
+        options(*loader_options(models.Author, schema)).
+        where(models.Author.id == author_id))
+
+async def get_authors(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: tuple | None = None,
+                      row_schema: type[BaseModel] | None = None):
+    return await _all(
+        db, paginate(select(models.Author), (models.Author.id,), skip, limit, cursor), models.Author, row_schema)
+
+async def create_author(db: AsyncSession, author: schemas.AuthorCreate, schema: type[BaseModel] | None = None):
     db_author = models.Author(**author.model_dump())
     db.add(db_author)
-    db.commit()
-    db.refresh(db_author)
-    return db_author
+    await db.commit()
+    cache.invalidate_responses("authors")
+    return await get_author(db, db_author.id, schema)
 
-def update_author(db: Session, author_id: int, data: schemas.AuthorUpdate):
-    db_author = db.query(models.Author).filter(models.Author.id == author_id)
+async def update_author(db: AsyncSession, author_id: int, data: schemas.AuthorUpdate, schema: type[BaseModel] | None = None):
     json_data = data.model_dump(exclude_none=True)
     if json_data:
-        db_author.update(json_data)
-        db.commit()
-    return db_author.first()
-
-def delete_author(db: Session, author_id: int):
-    db_author = get_author(db, author_id)
+        await db.execute(update(models.Author).where(models.Author.id == author_id).values(json_data))
+        if "first_name" in json_data or "last_name" in json_data:
+            await search.index_books(db, await _author_book_ids(db, author_id))
+        await db.commit()
+        cache.invalidate_responses("authors")
+    return await get_author(db, author_id, schema)
+
+async def delete_author(db: AsyncSession, author_id: int, schema: type[BaseModel] | None = None):
+    db_author = await get_author(db, author_id, schema)
     if db_author:
         # del_statement = delete(models.Book).where(models.Book.author_id)
         # db.execute(del_statement)
-        db.delete(db_author)
-        db.commit()
+        await search.remove_books(db, await _author_book_ids(db, author_id))
+        await db.delete(db_author)
+        await db.commit()
+        cache.invalidate_responses("authors", "books", "bookinstances")
     return db_author
 
+async def _author_book_ids(db: AsyncSession, author_id: int):
+    return (await db.scalars(select(models.Book.id).where(models.Book.author_id == author_id))).all()
+
 # genre
-def get_genre_by_name(db: Session, genre_name: str):
-    return db.query(models.Genre).filter(models.Genre.name == genre_name).first()
+async def get_genre(db: AsyncSession, genre_id: int, schema: type[BaseModel] | None = None):
+    return await db.scalar(
+        select(models.Genre).
+        options(*loader_options(models.Genre, schema)).
+        where(models.Genre.id == genre_id))
+
+async def get_genre_by_name(db: AsyncSession, genre_name: str):
+    return await db.scalar(select(models.Genre).where(models.Genre.name == genre_name))
 
-def get_genres(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Genre).offset(skip).limit(limit).all()
+async def get_genres(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: tuple | None = None,
+                     row_schema: type[BaseModel] | None = None):
+    return await _all(
+        db, paginate(select(models.Genre), (models.Genre.id,), skip, limit, cursor), models.Genre, row_schema)
 
-def create_genre(db: Session, genre: schemas.GenreCreate):
+async def create_genre(db: AsyncSession, genre: schemas.GenreCreate, schema: type[BaseModel] | None = None):
     db_genre = models.Genre(**genre.model_dump())
     db.add(db_genre)
-    db.commit()
-    db.refresh(db_genre)
-    return db_genre
+    await db.commit()
+    cache.invalidate_responses("genres")
+    return await get_genre(db, db_genre.id, schema)
 
-def update_genre(db: Session, genre_id: int, data: schemas.GenreUpdate):
-    db_genre = db.query(models.Genre).filter(models.Genre.id == genre_id)
+async def update_genre(db: AsyncSession, genre_id: int, data: schemas.GenreUpdate, schema: type[BaseModel] | None = None):
     json_data = data.model_dump(exclude_none=True)
     if json_data:
-        db_genre.update(json_data)
-        db.commit()
-    return db_genre.first()
+        await db.execute(update(models.Genre).where(models.Genre.id == genre_id).values(json_data))
+        await db.commit()
+        cache.invalidate_responses("genres")
+    return await get_genre(db, genre_id, schema)
 
-def delete_genre(db: Session, genre_id: int):
-    db_genre = db.query(models.Genre).filter(models.Genre.id == genre_id).first()
+async def delete_genre(db: AsyncSession, genre_id: int, schema: type[BaseModel] | None = None):
+    db_genre = await get_genre(db, genre_id, schema)
     if db_genre:
-        db.delete(db_genre)
-        db.commit()
+        await db.delete(db_genre)
+        await db.commit()
+        cache.invalidate_responses("genres")
     return db_genre
 
 # language
-def get_language_by_name(db: Session, language_name: str):
-    return db.query(models.Language).filter(models.Language.name == language_name).first()
+async def get_language(db: AsyncSession, language_id: int, schema: type[BaseModel] | None = None):
+    return await db.scalar(
+        select(models.Language).
+        options(*loader_options(models.Language, schema)).
+        where(models.Language.id == language_id))
+
+async def get_language_by_name(db: AsyncSession, language_name: str):
+    return await db.scalar(select(models.Language).where(models.Language.name == language_name))
 
-def get_languages(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Language).offset(skip).limit(limit).all()
+async def get_languages(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: tuple | None = None,
+                        row_schema: type[BaseModel] | None = None):
+    return await _all(
+        db, paginate(select(models.Language), (models.Language.id,), skip, limit, cursor), models.Language, row_schema)
 
-def create_language(db: Session, language: schemas.LanguageCreate):
+async def create_language(db: AsyncSession, language: schemas.LanguageCreate, schema: type[BaseModel] | None = None):
     db_language = models.Language(**language.model_dump())
     db.add(db_language)
-    db.commit()
-    db.refresh(db_language)
-    return db_language
+    await db.commit()
+    cache.invalidate_responses("languages")
+    return await get_language(db, db_language.id, schema)
 
-def update_language(db: Session, language_id: int, data: schemas.LanguageUpdate):
-    db_language = db.query(models.Language).filter(models.Language.id == language_id)
+async def update_language(db: AsyncSession, language_id: int, data: schemas.LanguageUpdate, schema: type[BaseModel] | None = None):
     json_data = data.model_dump(exclude_none=True)
     if json_data:
-        db_language.update(json_data)
-        db.commit()
-    return db_language.first()
+        await db.execute(update(models.Language).where(models.Language.id == language_id).values(json_data))
+        await db.commit()
+        cache.invalidate_responses("languages")
+    return await get_language(db, language_id, schema)
 
-def delete_language(db: Session, langauge_id: int):
-    db_lanuage = db.query(models.Language).filter(models.Language.id == langauge_id).first()
+async def delete_language(db: AsyncSession, langauge_id: int, schema: type[BaseModel] | None = None):
+    db_lanuage = await get_language(db, langauge_id, schema)
     if db_lanuage:
-        db.delete(db_lanuage)
-        db.commit()
+        await db.delete(db_lanuage)
+        await db.commit()
+        cache.invalidate_responses("languages")
     return db_lanuage
 
 # books
-def get_book(db: Session, book_id: int):
-    return db.query(models.Book).filter(models.Book.id == book_id).first()
-
-def get_book_by_title(db: Session, book_title: str):
-    return db.query(models.Book).filter(models.Book.title == book_title).first()
-
-def get_books(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Book).offset(skip).limit(limit).all()
-
-def get_books_by_genre(db: Session, 
-                       genre_name: str, 
-                       skip: int = 0, 
-                       limit: int = 100):
-    genre = get_genre_by_name(db, genre_name)
-    if genre:
-        return db.query(models.Book).\
-            filter(models.Book.genre_id == genre.id).\
-            offset(skip).limit(limit).all()
-    else:
-        return None
-
-def get_books_by_language(db: Session, 
-                          language_name: str, 
-                          skip: int = 0, 
-                          limit: int = 100):
-    language = get_language_by_name(db, language_name)
-    if language:
-        return db.query(models.Book).\
-            filter(models.Book.language_id == language.id).\
-            offset(skip).limit(limit).all()
-    else:
-        return None
-    
-def filter_books_by_language_and_genre(db: Session, 
-                                       language_name: str, 
-                                       genre_name: str, 
-                                       skip: int = 0, 
-                                       limit: int = 100):
-    language = get_language_by_name(db, language_name)
-    genre = get_genre_by_name(db, genre_name)
-    if language and genre:
-        return db.query(models.Book).\
-            filter(models.Book.genre_id == genre.id).\
-            filter(models.Book.language_id == language.id).\
-            offset(skip).limit(limit)
-    else:
-        return None
-    
-def create_book(db: Session, book: schemas.BookCreate):
+async def get_book(db: AsyncSession, book_id: int, schema: type[BaseModel] | None = None):
+    return await db.scalar(
+        select(models.Book).
+        options(*loader_options(models.Book, schema)).
+        where(models.Book.id == book_id))
+
+async def get_book_by_title(db: AsyncSession, book_title: str):
+    return await db.scalar(select(models.Book).where(models.Book.title == book_title))
+
+def books_query(genres: list[str] = (),
+                languages: list[str] = (),
+                author_ids: list[int] = (),
+                available: bool | None = None):
+    """
+    builds the SELECT for books matching every given facet. several
+    values of one facet match any of them. genres and languages are
+    matched by name with joins, so the whole filter is one statement.
+    `available` keeps books that do (or don't) have an available copy,
+    going by their counters.
+    """
+    query = select(models.Book)
+    if genres:
+        query = query.\
+            join(models.Genre, models.Book.genre_id == models.Genre.id).\
+            where(models.Genre.name.in_(genres))
+    if languages:
+        query = query.\
+            join(models.Language, models.Book.language_id == models.Language.id).\
+            where(models.Language.name.in_(languages))
+    if author_ids:
+        query = query.where(models.Book.author_id.in_(author_ids))
+    if available is not None:
+        if available:
+            query = query.where(models.Book.available_count > 0)
+        else:
+            query = query.where(models.Book.available_count == 0)
+    return query
+
+async def get_books(db: AsyncSession,
+                    skip: int = 0,
+                    limit: int = 100,
+                    cursor: tuple | None = None,
+                    genres: list[str] = (),
+                    languages: list[str] = (),
+                    author_ids: list[int] = (),
+                    available: bool | None = None,
+                    row_schema: type[BaseModel] | None = None):
+    query = books_query(genres, languages, author_ids, available)
+    return await _all(db, paginate(query, (models.Book.id,), skip, limit, cursor), models.Book, row_schema)
+
+async def search_books(db: AsyncSession, query: str, skip: int = 0, limit: int = 20):
+    return await search.search_books(db, query, skip, limit)
+
+async def create_book(db: AsyncSession, book: schemas.BookCreate, schema: type[BaseModel] | None = None):
     db_book = models.Book(**book.model_dump())
     db.add(db_book)
-    db.commit()
-    db.refresh(db_book)
-    return db_book
+    await db.flush()
+    await search.index_books(db, [db_book.id])
+    await db.commit()
+    cache.invalidate_responses("books")
+    return await get_book(db, db_book.id, schema)
 
-def update_book(db: Session, book_id: int, data: schemas.BookUpdate):
-    db_book = db.query(models.Book).filter(models.Book.id == book_id)
+async def update_book(db: AsyncSession, book_id: int, data: schemas.BookUpdate, schema: type[BaseModel] | None = None):
     json_data = data.model_dump(exclude_none=True)
     if json_data:
-        db_book.update(json_data)
-        db.commit()
-    return db_book.first()
-
-def delete_book(db: Session, book_id: int):
-    db_book = get_book(db, book_id)
+        await db.execute(update(models.Book).where(models.Book.id == book_id).values(json_data))
+        await search.index_books(db, [book_id])
+        await db.commit()
+        cache.invalidate_responses("books")
+    return await get_book(db, book_id, schema)
+
+async def delete_book(db: AsyncSession, book_id: int, schema: type[BaseModel] | None = None):
+    db_book = await get_book(db, book_id, schema)
     if db_book:
-        db.delete(db_book)
-        db.commit()
+        await search.remove_books(db, [book_id])
+        await db.delete(db_book)
+        await db.commit()
+        cache.invalidate_responses("books", "bookinstances")
     return db_book
     
 # book instances
-def get_book_instance(db: Session, instance_id: str): # str id because this one is uuid
-    return db.query(models.BookInstance).filter(models.BookInstance.id == instance_id).first()
+async def get_book_instance(db: AsyncSession, instance_id: str): # str id because this one is uuid
+    return await db.scalar(select(models.BookInstance).where(models.BookInstance.id == instance_id))
 
-def get_book_instances(
-        db: Session, 
+async def get_book_instances(
+        db: AsyncSession, 
         skip: int = 0, 
         limit: int = 100, 
-        status: BookInstanceStatus | None = None
+        status: BookInstanceStatus | None = None,
+        cursor: tuple | None = None,
+        row_schema: type[BaseModel] | None = None
     ):
-    result = db.query(models.BookInstance)
+    result = select(models.BookInstance)
     if status:
-        result = result.filter(models.BookInstance.status == status)
-    return result.offset(skip).limit(limit).all()
-
-def get_book_instances_by_borrower(db: Session, 
-                                   borrower_id: int, # user id
-                                   skip: int = 0,
-                                   limit: int = 100):
-    return db.query(models.BookInstance).\
-        filter(models.BookInstance.borrower_id == borrower_id).\
-        offset(skip).limit(limit).all()
-
-def create_book_instance(db: Session, book_instance: schemas.BookInstanceCreate):
+        result = result.where(models.BookInstance.status == status)
+    return await _all(
+        db, paginate(result, (models.BookInstance.id,), skip, limit, cursor), models.BookInstance, row_schema)
+
+async def get_book_instances_by_borrower(db: AsyncSession, 
+                                         borrower_id: int, # user id
+                                         skip: int = 0,
+                                         limit: int = 100,
+                                         cursor: tuple | None = None):
+    query = select(models.BookInstance).\
+        where(models.BookInstance.borrower_id == borrower_id)
+    return (await db.scalars(paginate(query, (models.BookInstance.id,), skip, limit, cursor))).all()
+
+async def create_book_instance(db: AsyncSession, book_instance: schemas.BookInstanceCreate):
     db_book_instance = models.BookInstance(**book_instance.model_dump())
     db.add(db_book_instance)
-    db.commit()
-    db.refresh(db_book_instance)
+    await db.flush()
+    await shift_book_counters(db, db_book_instance.book_id, None, db_book_instance.status)
+    await db.commit()
+    cache.invalidate_responses("books", "bookinstances")
     return db_book_instance
 
-def update_book_instance(db: Session, instance_id: str, data: schemas.BookInstanceUpdate):
-    db_instance = db.query(models.BookInstance).filter(models.BookInstance.id == instance_id)
+async def update_book_instance(db: AsyncSession, instance_id: str, data: schemas.BookInstanceUpdate):
     json_data = data.model_dump(exclude_none=True)
     if json_data:
-        db_instance.update(json_data)
-        db.commit()
-    return db_instance.first()
-
-def delete_book_instance(db: Session, instance_id: str):
-    db_instance = get_book_instance(db, instance_id)
+        old = (await db.execute(
+            select(models.BookInstance.book_id, models.BookInstance.status).
+            where(models.BookInstance.id == instance_id).
+            with_for_update())).first()
+        if old is None:
+            return None
+        statement = update(models.BookInstance).\
+            where(models.BookInstance.id == instance_id).\
+            values(json_data).\
+            returning(models.BookInstance.book_id, models.BookInstance.status)
+        new = (await db.execute(statement)).first()
+        if (old.book_id, old.status) != (new.book_id, new.status):
+            await shift_book_counters(db, old.book_id, old.status, None)
+            await shift_book_counters(db, new.book_id, None, new.status)
+        await db.commit()
+        cache.invalidate_responses("books", "bookinstances")
+    return await get_book_instance(db, instance_id)
+
+async def delete_book_instance(db: AsyncSession, instance_id: str):
+    db_instance = await get_book_instance(db, instance_id)
     if db_instance:
-        db.delete(db_instance)
-        db.commit()
-    return db_instance
\ No newline at end of file
+        await db.delete(db_instance)
+        await shift_book_counters(db, db_instance.book_id, db_instance.status, None)
+        await db.commit()
+        cache.invalidate_responses("books", "bookinstances")
+    return db_instance
+
+# availability counters
+# every book counts its available, on loan and reserved instances, so
+# lists can show them without loading the instances. they are shifted in
+# the same transaction as every change of an instance's status.
+BOOK_COUNTERS = {
+    BookInstanceStatus.a: "available_count",
+    BookInstanceStatus.o: "on_loan_count",
+    BookInstanceStatus.r: "reserved_count",
+}
+
+async def shift_book_counters(db: AsyncSession,
+                              book_id: int | None,
+                              old_status: BookInstanceStatus | None,
+                              new_status: BookInstanceStatus | None,
+                              count: int = 1):
+    """
+    moves `count` instances of a book from the counter of `old_status` to
+    the counter of `new_status`. None stands for an instance that wasn't
+    there before (or isn't anymore).
+    """
+    old_counter = BOOK_COUNTERS.get(old_status)
+    new_counter = BOOK_COUNTERS.get(new_status)
+    if book_id is None or old_counter == new_counter:
+        return
+    values = {}
+    if old_counter:
+        values[old_counter] = getattr(models.Book, old_counter) - count
+    if new_counter:
+        values[new_counter] = getattr(models.Book, new_counter) + count
+    await db.execute(update(models.Book).where(models.Book.id == book_id).values(values))
+
+async def reconcile_book_counters(db: AsyncSession):
+    """
+    recomputes the counters of every book from its instances with one
+    GROUP BY, for when they drifted (e.g. after editing rows by hand).
+    """
+    counts = select(
+        models.BookInstance.book_id,
+        *(func.count(case((models.BookInstance.status == status, 1))).label(counter)
+          for status, counter in BOOK_COUNTERS.items())).\
+        group_by(models.BookInstance.book_id).\
+        subquery()
+    await db.execute(update(models.Book).values({counter: 0 for counter in BOOK_COUNTERS.values()}))
+    await db.execute(
+        update(models.Book).
+        where(models.Book.id == counts.c.book_id).
+        values({counter: counts.c[counter] for counter in BOOK_COUNTERS.values()}))
+    await db.commit()
+    cache.invalidate_responses("books")
+
+# book instance transitions. each one is a conditional UPDATE ...
+# RETURNING from one known status, so two users can't both win the same
+# copy and the book's counters can be shifted in the same transaction.
+# they return None when the instance doesn't exist or isn't in a state
+# allowing the change.
+LOAN_DAYS = 14
+RESERVATION_DAYS = 1
+
+def _reservation_expired():
+    """
+    true for a reservation whose due date passed more than 1 day ago
+    without the copy being borrowed.
+    """
+    return models.BookInstance.due_back < date.today() - timedelta(days=1)
+
+def _claims(user_id: int):
+    """
+    the statuses an instance can be borrowed or reserved from, each with
+    its condition: available, or reserved by this user or expired. the
+    sweeper releases expired reservations, this covers the time until
+    it runs (or when it's off).
+    """
+    return (
+        (BookInstanceStatus.a, true()),
+        (BookInstanceStatus.r, or_(
+            models.BookInstance.borrower_id == user_id,
+            _reservation_expired())),
+    )
+
+async def _transition_book_instance(db: AsyncSession, condition, old_status: BookInstanceStatus, values: dict):
+    statement = update(models.BookInstance).\
+        where(condition).\
+        where(models.BookInstance.status == old_status).\
+        values(values).\
+        returning(models.BookInstance)
+    db_instance = (await db.scalars(statement)).first()
+    if db_instance is None:
+        await db.rollback()
+        return None
+    await shift_book_counters(db, db_instance.book_id, old_status, values["status"])
+    await db.commit()
+    cache.invalidate_responses("books", "bookinstances")
+    return db_instance
+
+async def _claim_book_instance(db: AsyncSession, instance_id: str, user_id: int, values: dict):
+    for old_status, condition in _claims(user_id):
+        db_instance = await _transition_book_instance(
+            db, and_(models.BookInstance.id == instance_id, condition), old_status, values)
+        if db_instance is not None:
+            return db_instance
+    return None
+
+async def borrow_book_instance(db: AsyncSession, instance_id: str, user_id: int):
+    return await _claim_book_instance(
+        db, instance_id, user_id,
+        {
+            "status": BookInstanceStatus.o,
+            "borrower_id": user_id,
+            "due_back": date.today() + timedelta(days=LOAN_DAYS),
+        })
+
+async def reserve_book_instance(db: AsyncSession, instance_id: str, user_id: int):
+    return await _claim_book_instance(
+        db, instance_id, user_id,
+        {
+            "status": BookInstanceStatus.r,
+            "borrower_id": user_id,
+            "due_back": date.today() + timedelta(days=RESERVATION_DAYS),
+        })
+
+async def return_book_instance(db: AsyncSession, instance_id: str, user_id: int):
+    return await _transition_book_instance(
+        db,
+        and_(
+            models.BookInstance.id == instance_id,
+            models.BookInstance.borrower_id == user_id),
+        BookInstanceStatus.o,
+        {
+            "status": BookInstanceStatus.a,
+            "borrower_id": None,
+        })
+
+async def borrow_any_book_instance(db: AsyncSession, book_id: int, user_id: int):
+    """
+    borrows whichever available instance of the book comes first. on
+    postgres the candidate row is picked with FOR UPDATE SKIP LOCKED, so
+    concurrent borrowers are handed different copies instead of queueing
+    on the same one. sqlite has a single writer and ignores the lock
+    clause, which leaves one conditional UPDATE there as well.
+    """
+    candidate = select(models.BookInstance.id).\
+        where(models.BookInstance.book_id == book_id).\
+        where(models.BookInstance.status == BookInstanceStatus.a).\
+        limit(1).\
+        with_for_update(skip_locked=True).\
+        scalar_subquery()
+    return await _transition_book_instance(
+        db,
+        models.BookInstance.id == candidate,
+        BookInstanceStatus.a,
+        {
+            "status": BookInstanceStatus.o,
+            "borrower_id": user_id,
+            "due_back": date.today() + timedelta(days=LOAN_DAYS),
+        })
+
+async def release_expired_reservations(db: AsyncSession, batch_size: int = 500) -> int:
+    """
+    makes up to `batch_size` expired reservations available again, in
+    one UPDATE found through the due_back index, and returns how many
+    it released.
+    """
+    expired = and_(models.BookInstance.status == BookInstanceStatus.r, _reservation_expired())
+    batch = select(models.BookInstance.id).\
+        where(expired).\
+        limit(batch_size).\
+        with_for_update(skip_locked=True)
+    statement = update(models.BookInstance).\
+        where(models.BookInstance.id.in_(batch)).\
+        where(expired).\
+        values({"status": BookInstanceStatus.a, "borrower_id": None}).\
+        returning(models.BookInstance.book_id)
+    book_ids = (await db.scalars(statement)).all()
+    for book_id, count in Counter(book_ids).items():
+        await shift_book_counters(db, book_id, BookInstanceStatus.r, BookInstanceStatus.a, count)
+    await db.commit()
+    if book_ids:
+        cache.invalidate_responses("books", "bookinstances")
+    return len(book_ids)
+
+# versions
+# a version is a tuple that changes whenever the representation of a
+# resource does: the newest updated_at and the row count of every table
+# the resource is rendered from. counts catch deleted rows. None means
+# the resource doesn't exist.
+async def get_book_version(db: AsyncSession, book_id: int):
+    row = (await db.execute(
+        select(models.Book.updated_at,
+               func.max(models.BookInstance.updated_at),
+               func.count(models.BookInstance.id)).
+        outerjoin(models.BookInstance, models.BookInstance.book_id == models.Book.id).
+        where(models.Book.id == book_id).
+        group_by(models.Book.id))).first()
+    return tuple(row) if row else None
+
+async def get_author_version(db: AsyncSession, author_id: int):
+    row = (await db.execute(
+        select(models.Author.updated_at,
+               func.max(models.Book.updated_at),
+               func.count(distinct(models.Book.id)),
+               func.max(models.BookInstance.updated_at),
+               func.count(models.BookInstance.id)).
+        outerjoin(models.Book, models.Book.author_id == models.Author.id).
+        outerjoin(models.BookInstance, models.BookInstance.book_id == models.Book.id).
+        where(models.Author.id == author_id).
+        group_by(models.Author.id))).first()
+    return tuple(row) if row else None
+
+async def get_table_version(db: AsyncSession, model):
+    return tuple((await db.execute(select(func.max(model.updated_at), func.count()).select_from(model))).one())
@@ -1,13 +1,145 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+import json
+import os
+import time
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+import metrics
+
+def _load_settings():
+    try:
+        with open(".env", "r") as env_file:
+            return json.loads(env_file.read())
+    except FileNotFoundError:
+        return {}
+
+settings = _load_settings()
+
+# the DATABASE_URL environment variable wins over .env, which makes it
+# easy to point a worker (or a benchmark) at another database.
+SQLALCHEMY_DATABASE_URL = os.environ.get(
+    "DATABASE_URL",
+    settings.get("database_url", "sqlite:///./sql_app.db"))
+
+# connection pool
+POOL_SIZE = settings.get("db_pool_size", 5)
+MAX_OVERFLOW = settings.get("db_max_overflow", 10)
+POOL_TIMEOUT = settings.get("db_pool_timeout", 30) # seconds to wait for a free connection
+POOL_PRE_PING = settings.get("db_pool_pre_ping", True)
+POOL_RECYCLE = settings.get("db_pool_recycle", 1800) # seconds, -1 disables it
+STATEMENT_TIMEOUT_MS = settings.get("db_statement_timeout_ms", 30000) # postgres only, 0 disables it
+
+# sqlite profile tuned for concurrent readers and a single writer
+SQLITE_JOURNAL_MODE = settings.get("sqlite_journal_mode", "WAL")
+SQLITE_SYNCHRONOUS = settings.get("sqlite_synchronous", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = settings.get("sqlite_busy_timeout_ms", 5000)
+SQLITE_MMAP_SIZE = settings.get("sqlite_mmap_size", 256 * 1024 * 1024)
+
+POOL_WAIT = metrics.Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the pool.", ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0))
+POOL_TIMEOUTS = metrics.Counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up after db_pool_timeout.", ["engine"])
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a
+    connection (including opening a new one) in POOL_WAIT.
+    """
+    engine_label = "sync"
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc(self.engine_label)
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started_at, self.engine_label)
+
+class TimedAsyncAdaptedQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    engine_label = "async"
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def async_url(url):
+    """
+    the same database as `url`, reached through an asyncio driver.
+    """
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+def is_sqlite(url) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+def is_sqlite_memory(url) -> bool:
+    return is_sqlite(url) and make_url(url).database in (None, "", ":memory:")
+
+def engine_options(url, is_async: bool = False) -> dict:
+    """
+    keyword arguments for create_engine that apply the pool and timeout
+    settings above to the kind of database `url` points at.
+    """
+    if is_sqlite_memory(url):
+        # every connection to :memory: is a new empty database, so the
+        # default single connection pool is the only one that works.
+        return {"connect_args": {"check_same_thread": False}}
+    options = {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_pre_ping": POOL_PRE_PING,
+        "pool_recycle": POOL_RECYCLE,
+        # also what aiosqlite needs, it defaults to opening a new
+        # connection per checkout
+        "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+    }
+    if is_sqlite(url):
+        options["connect_args"] = {"check_same_thread": False}
+    elif make_url(url).get_backend_name() == "postgresql" and STATEMENT_TIMEOUT_MS:
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(int(STATEMENT_TIMEOUT_MS))}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={int(STATEMENT_TIMEOUT_MS)}"}
+    return options
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+    cursor.close()
+
+def make_engine(url):
+    new_engine = create_engine(url, **engine_options(url))
+    if is_sqlite(url) and not is_sqlite_memory(url):
+        event.listen(new_engine, "connect", set_sqlite_pragmas)
+    return new_engine
+
+def make_async_engine(url):
+    new_engine = create_async_engine(async_url(url), **engine_options(url, is_async=True))
+    if is_sqlite(url) and not is_sqlite_memory(url):
+        event.listen(new_engine.sync_engine, "connect", set_sqlite_pragmas)
+    return new_engine
+
+# the blocking engine is kept for schema management and scripts, the
+# request path goes through async_engine.
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+async_engine = make_async_engine(SQLALCHEMY_DATABASE_URL)
+# objects stay usable after commit, since an AsyncSession can't lazy
+# load expired attributes while a response is being serialized.
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
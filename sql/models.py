@@ -1,12 +1,19 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Uuid, Date, Text, Enum
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Uuid, Date, DateTime, Text, Enum, Index
 from sqlalchemy.orm import relationship, validates
 
+import datetime
 import uuid
 import enum
 import re
 
 from .database import Base
 
+def utcnow():
+    """
+    naive utc time, the way the `updated_at` columns store it.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -16,6 +23,8 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     is_superuser = Column(Boolean, default=False)
+    # bumped when tokens issued so far must stop working, see TokenRevocation
+    token_version = Column(Integer, nullable=False, default=0, server_default='0')
 
     borrowed_book_instances = relationship("BookInstance", back_populates='borrower')
 
@@ -34,6 +43,7 @@ class Author(Base):
     last_name = Column(String(length=100), nullable=False)
     date_of_birth = Column(Date, nullable=False)
     date_of_death = Column(Date, nullable=True, default=None)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow) # bumped by every insert and update, for ETags
 
     books = relationship("Book", back_populates='author', cascade='all, delete, save-update')
 
@@ -41,6 +51,7 @@ class Genre(Base):
     __tablename__ = 'genres'
     id = Column(Integer, primary_key=True)
     name = Column(String(length=50), unique=True, index=True, nullable=False)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow) # bumped by every insert and update, for ETags
 
     books = relationship('Book', back_populates='genre')
 
@@ -48,6 +59,7 @@ class Language(Base):
     __tablename__ = 'languages'
     id = Column(Integer, primary_key=True)
     name = Column(String(length=50), unique=True, index=True, nullable=False)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow) # bumped by every insert and update, for ETags
 
     books = relationship('Book', back_populates='language')
 
@@ -60,6 +72,11 @@ class Book(Base):
     author_id = Column(Integer, ForeignKey('authors.id'))
     genre_id = Column(Integer, ForeignKey('genres.id'))
     language_id = Column(Integer, ForeignKey('languages.id'))
+    # instance counters, kept up to date by crud (see shift_book_counters)
+    available_count = Column(Integer, nullable=False, default=0, server_default='0')
+    on_loan_count = Column(Integer, nullable=False, default=0, server_default='0')
+    reserved_count = Column(Integer, nullable=False, default=0, server_default='0')
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow) # bumped by every insert and update, for ETags
 
     author = relationship("Author", back_populates='books')
     genre = relationship('Genre', back_populates='books')
@@ -67,6 +84,12 @@ class Book(Base):
 
     instances = relationship('BookInstance', back_populates='book', cascade='all, delete, save-update')
 
+    __table_args__ = (
+        Index('ix_books_genre_id_language_id_id', 'genre_id', 'language_id', 'id'), # genre (and language) filters
+        Index('ix_books_language_id_id', 'language_id', 'id'), # language filter
+        Index('ix_books_author_id', 'author_id'), # author's books
+    )
+
 class BookInstanceStatus(enum.Enum):
     m = 'Maintenance'
     o = 'On loan'
@@ -76,12 +99,60 @@ class BookInstanceStatus(enum.Enum):
 class BookInstance(Base):
     __tablename__ = 'bookinstances'
 
-    id = Column(Uuid(as_uuid=False), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
     book_id = Column(Integer, ForeignKey('books.id'))
     imprint = Column(String)
     due_back = Column(Date, nullable=True, index=True)
     borrower_id = Column(Integer, ForeignKey('users.id'))
     status = Column(Enum(BookInstanceStatus), default='m')
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow) # bumped by every insert and update, for ETags
 
     book = relationship('Book', back_populates='instances')
-    borrower = relationship('User', back_populates='borrowed_book_instances')
\ No newline at end of file
+    borrower = relationship('User', back_populates='borrowed_book_instances')
+
+    __table_args__ = (
+        Index('ix_bookinstances_book_id_status', 'book_id', 'status'), # book's instances, borrow any copy
+        Index('ix_bookinstances_status_id', 'status', 'id'), # status filter, paginated on id
+        Index('ix_bookinstances_borrower_id_status', 'borrower_id', 'status'), # borrower's instances
+        Index('ix_bookinstances_status_due_back', 'status', 'due_back'), # overdue loans, expired reservations
+    )
+
+class OverdueSummary(Base):
+    """
+    overdue loans per borrower, as of `refreshed_at`. a snapshot filled by
+    `reports.refresh_overdue_summary`, cheap to read for dashboards.
+    """
+    __tablename__ = 'overdue_summary'
+
+    borrower_id = Column(Integer, primary_key=True)
+    username = Column(String(length=100), nullable=False)
+    email = Column(String(length=150), nullable=False)
+    overdue_count = Column(Integer, nullable=False)
+    oldest_due_back = Column(Date, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False)
+
+class TokenRevocation(Base):
+    """
+    users whose tokens issued before `revoked_at` were revoked: tokens
+    carrying a version below `token_version` are refused. rows older than
+    the token lifetime revoke nothing anymore and are pruned.
+    """
+    __tablename__ = 'token_revocations'
+
+    user_id = Column(Integer, primary_key=True)
+    token_version = Column(Integer, nullable=False)
+    revoked_at = Column(DateTime, nullable=False, index=True)
+
+class UserSession(Base):
+    """
+    a login, renewed through its refresh token `{id}.{secret}` without
+    the password. only an HMAC of the secret is stored, and every refresh
+    replaces it, so a refresh token works once.
+    """
+    __tablename__ = 'sessions'
+
+    id = Column(String(length=32), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True, nullable=False)
+    secret_hash = Column(String(length=64), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,68 @@
+from sqlalchemy import tuple_
+
+import base64
+import json
+import uuid
+
+
+def encode_cursor(key: tuple) -> str:
+    """
+    turns the sort key of the last row of a page into an opaque cursor
+    string the client sends back to get the next page.
+    """
+    payload = json.dumps(list(key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+def _is_key_part(part, key_type) -> bool:
+    if key_type is uuid.UUID:
+        try:
+            uuid.UUID(part)
+        except (ValueError, TypeError, AttributeError):
+            return False
+        return True
+    # json's true/false would pass as ints
+    return isinstance(part, key_type) and not isinstance(part, bool)
+
+def decode_cursor(cursor: str, key_types: tuple = (int,)) -> tuple:
+    """
+    raises ValueError if the cursor was not made by encode_cursor for a
+    sort key of `key_types` (int, or uuid.UUID for uuid strings).
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != len(key_types):
+        raise ValueError("Invalid cursor")
+    if not all(_is_key_part(part, key_type) for part, key_type in zip(key, key_types)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+def paginate(query, key_columns: tuple, skip: int = 0, limit: int = 100, cursor: tuple | None = None):
+    """
+    orders `query` by `key_columns` and returns one page of it. with a
+    cursor the page starts right after the row the cursor points at
+    (a seek on the key index), otherwise `skip` rows are skipped.
+    """
+    query = query.order_by(*key_columns)
+    if cursor is not None:
+        if len(cursor) != len(key_columns):
+            raise ValueError("Invalid cursor")
+        if len(key_columns) == 1:
+            query = query.filter(key_columns[0] > cursor[0])
+        else:
+            query = query.filter(tuple_(*key_columns) > tuple_(*cursor))
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+def next_cursor(items, limit: int, key_attributes: tuple = ("id",)) -> str | None:
+    """
+    returns the cursor of the page after `items`, or None if `items` was
+    the last page.
+    """
+    if not items or len(items) < limit:
+        return None
+    last = items[-1]
+    return encode_cursor(tuple(getattr(last, attribute) for attribute in key_attributes))
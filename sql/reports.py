@@ -0,0 +1,96 @@
+"""
+Overdue loans report: every copy on loan past its due date, with its
+borrower and book, grouped by borrower.
+
+The loans come from one query on the (status, due_back) index joined
+with users and books, ordered by borrower so a stream of rows can be
+grouped on the fly. `refresh_overdue_summary` stores one line per
+borrower in the `overdue_summary` table for dashboards.
+"""
+from sqlalchemy import select, delete, insert, func, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from datetime import date
+
+from sql import models
+from sql.models import BookInstanceStatus
+
+BORROWER_COLUMNS = ("borrower_id", "username", "email")
+LOAN_COLUMNS = ("instance_id", "book_id", "title", "due_back")
+
+def _overdue(today: date | None = None):
+    return (models.BookInstance.status == BookInstanceStatus.o) & \
+        (models.BookInstance.due_back < (today or date.today()))
+
+def overdue_loans(today: date | None = None):
+    """
+    the SELECT of every overdue loan, one row per copy, ordered by
+    borrower and then by due date.
+    """
+    return select(
+            models.User.id.label("borrower_id"),
+            models.User.username,
+            models.User.email,
+            models.BookInstance.id.label("instance_id"),
+            models.Book.id.label("book_id"),
+            models.Book.title,
+            models.BookInstance.due_back).\
+        select_from(models.BookInstance).\
+        join(models.User, models.User.id == models.BookInstance.borrower_id).\
+        join(models.Book, models.Book.id == models.BookInstance.book_id).\
+        where(_overdue(today)).\
+        order_by(models.BookInstance.borrower_id, models.BookInstance.due_back)
+
+async def group_by_borrower(batches):
+    """
+    turns batches of `overdue_loans` rows into batches of borrowers, each
+    with the list of their loans. a borrower whose loans span two batches
+    is only yielded once all of them were seen.
+    """
+    current = None
+    async for batch in batches:
+        borrowers = []
+        for row in batch:
+            if current is None or current["borrower_id"] != row["borrower_id"]:
+                if current is not None:
+                    borrowers.append(current)
+                current = {column: row[column] for column in BORROWER_COLUMNS}
+                current["loans"] = []
+            current["loans"].append({column: row[column] for column in LOAN_COLUMNS})
+        if borrowers:
+            yield borrowers
+    if current is not None:
+        yield [current]
+
+def overdue_summary():
+    return select(
+            models.OverdueSummary.borrower_id,
+            models.OverdueSummary.username,
+            models.OverdueSummary.email,
+            models.OverdueSummary.overdue_count,
+            models.OverdueSummary.oldest_due_back,
+            models.OverdueSummary.refreshed_at).\
+        order_by(models.OverdueSummary.oldest_due_back, models.OverdueSummary.borrower_id)
+
+async def refresh_overdue_summary(db: AsyncSession, today: date | None = None) -> int:
+    """
+    replaces the summary with one aggregate over the overdue loans and
+    returns the number of borrowers in it.
+    """
+    aggregate = select(
+            models.User.id,
+            models.User.username,
+            models.User.email,
+            func.count(models.BookInstance.id),
+            func.min(models.BookInstance.due_back),
+            literal(models.utcnow(), models.OverdueSummary.refreshed_at.type)).\
+        select_from(models.BookInstance).\
+        join(models.User, models.User.id == models.BookInstance.borrower_id).\
+        where(_overdue(today)).\
+        group_by(models.User.id, models.User.username, models.User.email)
+    await db.execute(delete(models.OverdueSummary))
+    await db.execute(insert(models.OverdueSummary).from_select(
+        ["borrower_id", "username", "email", "overdue_count", "oldest_due_back", "refreshed_at"], aggregate))
+    count = await db.scalar(select(func.count()).select_from(models.OverdueSummary))
+    await db.commit()
+    return count
@@ -7,9 +7,9 @@ import uuid
 # book instance
 class BookInstanceBase(BaseModel):
     imprint: str
-    due_back: datetime.date
+    due_back: datetime.date | None
     status: BookInstanceStatus
-    borrower_id: int
+    borrower_id: int | None = None
     book_id: int
 
 class BookInstanceCreate(BookInstanceBase):
@@ -20,7 +20,7 @@ class BookInstanceCreate(BookInstanceBase):
                     "imprint": "Foo",
                     "due_back": None,
                     "status": "Available",
-                    "borrower_id": 0,
+                    "borrower_id": None,
                     "book_id": 3
                 }
             ]
@@ -42,8 +42,7 @@ class BookInstanceUpdate(BaseModel):
         "json_schema_extra": {
             "examples": [
                 {
-                    "status": "Maintenance",
-                    "borrower_id": 0
+                    "status": "Maintenance"
                 }
             ]
         }
@@ -135,6 +134,9 @@ class Book(BookBase):
 
 class BookInline(BookBase):
     id: int
+    available_count: int = 0
+    on_loan_count: int = 0
+    reserved_count: int = 0
 
     class Config:
         from_attributes = True
@@ -151,6 +153,27 @@ class BookInline(BookBase):
             ]
         }
 
+class BookSearchResult(BookInline):
+    rank: float
+    snippet: str
+
+    class Config:
+        from_attributes = True
+        json_schema_extra = {
+            "examples": [
+                {
+                    "title": "Foo",
+                    "description": "Lorem ipsum dolor sit amet, consectetur adipiscing elit",
+                    "author_id": 3,
+                    "genre_id": 9,
+                    "language_id": 1,
+                    "id": 2,
+                    "rank": 4.2,
+                    "snippet": "<mark>Lorem</mark> ipsum dolor sit amet…",
+                }
+            ]
+        }
+
 # genre
 class GenreBase(BaseModel):
     name: str
@@ -421,6 +444,16 @@ class User(UserBase):
             ]
         }
 
+class CurrentUser(BaseModel):
+    """
+    What authorization knows about the logged in user. It is cached
+    between requests, so it doesn't have the user's relationships.
+    """
+    id: int
+    username: str
+    is_active: bool
+    is_superuser: bool
+
 class UserInline(UserBase):
     id: int
     is_active: bool
@@ -435,4 +468,53 @@ class UserInline(UserBase):
                     "is_active": True,
                 }
             ]
-        }
\ No newline at end of file
+        }
+
+# bulk import
+class BookImport(BaseModel):
+    """
+    A book row of a bulk import. The author, genre and language can be
+    given by id or by name ("First Last" for authors).
+    """
+    title: str
+    description: str = ""
+    author_id: int | None = None
+    author: str | None = None
+    genre_id: int | None = None
+    genre: str | None = None
+    language_id: int | None = None
+    language: str | None = None
+
+class BookInstanceImport(BaseModel):
+    """
+    A book instance row of a bulk import. The book can be given by id
+    or by title.
+    """
+    book_id: int | None = None
+    book: str | None = None
+    imprint: str = ""
+    status: BookInstanceStatus = BookInstanceStatus.a
+    due_back: datetime.date | None = None
+    borrower_id: int | None = None
+
+class BulkImportError(BaseModel):
+    line: int
+    error: str
+
+class BulkImportResult(BaseModel):
+    inserted: int = 0
+    errors: list[BulkImportError] = []
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "inserted": 4998,
+                    "errors": [
+                        {"line": 17, "error": "Unknown genre 'Thriler'"},
+                        {"line": 342, "error": "Row conflicts with an existing one"},
+                    ],
+                }
+            ]
+        }
+    }
@@ -0,0 +1,146 @@
+"""
+Full-text index over book titles, descriptions and author names.
+
+sqlite keeps it in an FTS5 virtual table whose rowid is the book id,
+postgres in a `book_search` table holding a weighted tsvector per book
+behind a GIN index. crud keeps the index in sync when books or authors
+change, in the same transaction as the change.
+
+On sqlite every word of the query is quoted and the last one matches as
+a prefix. postgres reads the query with websearch_to_tsquery, which
+understands quotes, OR and -word but has no prefix matching.
+"""
+from sqlalchemy import text, bindparam, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+
+SEARCH_TABLE = "book_search"
+SNIPPET_START = "<mark>"
+SNIPPET_END = "</mark>"
+
+_SQLITE_CREATE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}
+USING fts5(title, description, author, tokenize = 'unicode61 remove_diacritics 2')
+"""
+
+_POSTGRES_CREATE = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (
+        book_id INTEGER PRIMARY KEY REFERENCES books (id) ON DELETE CASCADE,
+        document TSVECTOR NOT NULL
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)",
+]
+
+_SQLITE_INDEX = f"""
+INSERT INTO {SEARCH_TABLE} (rowid, title, description, author)
+SELECT books.id, books.title, coalesce(books.description, ''),
+       coalesce(authors.first_name || ' ' || authors.last_name, '')
+FROM books LEFT JOIN authors ON authors.id = books.author_id
+"""
+
+_POSTGRES_INDEX = f"""
+INSERT INTO {SEARCH_TABLE} (book_id, document)
+SELECT books.id,
+       setweight(to_tsvector('english', books.title), 'A') ||
+       setweight(to_tsvector('english', coalesce(authors.first_name || ' ' || authors.last_name, '')), 'B') ||
+       setweight(to_tsvector('english', coalesce(books.description, '')), 'C')
+FROM books LEFT JOIN authors ON authors.id = books.author_id
+"""
+
+_SQLITE_SEARCH = f"""
+SELECT books.id, books.title, books.description, books.author_id, books.genre_id, books.language_id,
+       books.available_count, books.on_loan_count, books.reserved_count,
+       -bm25({SEARCH_TABLE}, 10.0, 1.0, 5.0) AS rank,
+       snippet({SEARCH_TABLE}, -1, :start, :end, '…', 16) AS snippet
+FROM {SEARCH_TABLE} JOIN books ON books.id = {SEARCH_TABLE}.rowid
+WHERE {SEARCH_TABLE} MATCH :query
+ORDER BY rank DESC
+LIMIT :limit OFFSET :skip
+"""
+
+_POSTGRES_SEARCH = f"""
+SELECT books.id, books.title, books.description, books.author_id, books.genre_id, books.language_id,
+       books.available_count, books.on_loan_count, books.reserved_count,
+       ts_rank({SEARCH_TABLE}.document, query) AS rank,
+       ts_headline('english', coalesce(books.description, books.title), query,
+                   'StartSel=' || :start || ', StopSel=' || :end || ', MaxWords=24, MinWords=8') AS snippet
+FROM {SEARCH_TABLE}
+JOIN books ON books.id = {SEARCH_TABLE}.book_id,
+     websearch_to_tsquery('english', :query) AS query
+WHERE {SEARCH_TABLE}.document @@ query
+ORDER BY rank DESC
+LIMIT :limit OFFSET :skip
+"""
+
+def create_index(connection):
+    """
+    creates the index if it doesn't exist yet and fills it from the
+    books already in the database. takes a blocking connection, as used
+    at startup and by migrations.
+    """
+    if inspect(connection).has_table(SEARCH_TABLE):
+        return
+    if connection.dialect.name == "sqlite":
+        connection.execute(text(_SQLITE_CREATE))
+        connection.execute(text(_SQLITE_INDEX))
+    else:
+        for statement in _POSTGRES_CREATE:
+            connection.execute(text(statement))
+        connection.execute(text(_POSTGRES_INDEX))
+
+def drop_index(connection):
+    connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+
+def _is_sqlite(db: AsyncSession) -> bool:
+    return db.bind.dialect.name == "sqlite"
+
+async def remove_books(db: AsyncSession, book_ids: list[int]):
+    if not book_ids:
+        return
+    key = "rowid" if _is_sqlite(db) else "book_id"
+    statement = text(f"DELETE FROM {SEARCH_TABLE} WHERE {key} IN :book_ids").\
+        bindparams(bindparam("book_ids", expanding=True))
+    await db.execute(statement, {"book_ids": list(book_ids)})
+
+async def index_books(db: AsyncSession, book_ids: list[int]):
+    """
+    (re)indexes the given books. call it before committing the change
+    that made them stale.
+    """
+    if not book_ids:
+        return
+    await remove_books(db, book_ids)
+    insert = _SQLITE_INDEX if _is_sqlite(db) else _POSTGRES_INDEX
+    statement = text(insert + " WHERE books.id IN :book_ids").\
+        bindparams(bindparam("book_ids", expanding=True))
+    await db.execute(statement, {"book_ids": list(book_ids)})
+
+def _fts5_query(query: str) -> str:
+    """
+    quotes every word, so user input can't be read as FTS5 syntax. the
+    last word matches as a prefix, for search-as-you-type.
+    """
+    words = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+    if words:
+        words[-1] += "*"
+    return " ".join(words)
+
+async def search_books(db: AsyncSession, query: str, skip: int = 0, limit: int = 20):
+    """
+    books matching `query`, best match first, with a highlighted snippet.
+    """
+    if _is_sqlite(db):
+        statement, query = _SQLITE_SEARCH, _fts5_query(query)
+        if not query:
+            return []
+    else:
+        statement = _POSTGRES_SEARCH
+    result = await db.execute(text(statement), {
+        "query": query,
+        "start": SNIPPET_START,
+        "end": SNIPPET_END,
+        "limit": limit,
+        "skip": skip,
+    })
+    return result.mappings().all()
@@ -0,0 +1,88 @@
+"""
+Streams query results as NDJSON or CSV without holding them in memory.
+
+The rows are read with a server-side cursor `STREAM_BATCH_SIZE` at a
+time and each batch is encoded into one chunk of the response body.
+The session is opened by the stream itself, since a `get_db` session
+is closed before a StreamingResponse starts sending.
+"""
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+
+import csv
+import datetime
+import enum
+import io
+import json
+
+from sql import database
+
+STREAM_BATCH_SIZE = database.settings.get("stream_batch_size", 1000)
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+class StreamFormat(str, enum.Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+async def stream_batches(statement: Select, batch_size: int = STREAM_BATCH_SIZE):
+    """
+    yields the rows of `statement` as lists of mappings.
+    """
+    async with database.AsyncSessionLocal() as db:
+        result = await db.stream(statement.execution_options(yield_per=batch_size))
+        async for batch in result.mappings().partitions():
+            yield batch
+
+async def encode_ndjson(batches):
+    async for batch in batches:
+        yield "".join(json.dumps(dict(row), default=_json_default) + "\n" for row in batch)
+
+async def encode_csv(batches, columns: list[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    async for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(row[column]) for column in columns] for row in batch)
+        yield buffer.getvalue()
+
+def stream_response(batches, columns: list[str], stream_format: StreamFormat, filename: str):
+    """
+    a StreamingResponse encoding `batches` (an async iterator of lists
+    of mappings) in `stream_format`.
+    """
+    if stream_format == StreamFormat.csv:
+        body = encode_csv(batches, columns)
+    else:
+        body = encode_ndjson(batches)
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[stream_format.value],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{stream_format.value}"'},
+    )
+
+def stream_query(statement: Select, stream_format: StreamFormat, filename: str):
+    columns = [column.key for column in statement.selected_columns]
+    return stream_response(stream_batches(statement), columns, stream_format, filename)
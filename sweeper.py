@@ -0,0 +1,129 @@
+"""
+Background task releasing expired reservations, started by the app's
+lifespan.
+
+Every `SWEEP_INTERVAL_SECONDS` it runs `crud.release_expired_reservations`
+in batches until no expired reservation is left. With several workers
+(e.g. gunicorn) the `sweeper` setting picks who sweeps:
+
+- "advisory_lock" (default): every worker tries, but a sweep only runs
+  while holding a lock, so one worker does the work and another one
+  takes over if it dies. postgres uses pg_try_advisory_lock, sqlite a
+  lock file next to the database.
+- "all": every worker sweeps. harmless, the UPDATEs are conditional,
+  just redundant.
+- "off": nothing is started. `python cli.py sweep-reservations` can be
+  run from cron instead.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+
+from sql import crud, database
+
+try:
+    import fcntl
+except ImportError: # windows, where every worker sweeps
+    fcntl = None
+
+SWEEPER_MODE = database.settings.get("sweeper", "advisory_lock")
+SWEEP_INTERVAL_SECONDS = database.settings.get("sweep_interval_seconds", 60)
+SWEEP_BATCH_SIZE = database.settings.get("sweep_batch_size", 500)
+ADVISORY_LOCK_KEY = 72_110_018 # any number, as long as nothing else locks it
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def _postgres_lock():
+    async with database.async_engine.connect() as connection:
+        locked = await connection.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+        try:
+            yield locked
+        finally:
+            if locked:
+                await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            await connection.commit()
+
+@asynccontextmanager
+async def _file_lock(path: str):
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+@asynccontextmanager
+async def _no_lock():
+    # an in-memory database lives in one process, and without fcntl
+    # every worker sweeps
+    yield True
+
+def sweep_lock():
+    """
+    an async context manager yielding whether this worker may sweep now.
+    """
+    url = database.SQLALCHEMY_DATABASE_URL
+    if not database.is_sqlite(url):
+        return _postgres_lock()
+    if database.is_sqlite_memory(url) or fcntl is None:
+        return _no_lock()
+    return _file_lock(make_url(url).database + ".sweeper.lock")
+
+async def sweep(batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """
+    releases every expired reservation and returns how many there were.
+    expired sessions and token revocations older than any token are
+    dropped on the way.
+    """
+    released = 0
+    async with database.AsyncSessionLocal() as db:
+        await crud.prune_token_revocations(db)
+        await crud.delete_expired_sessions(db)
+        while True:
+            count = await crud.release_expired_reservations(db, batch_size)
+            released += count
+            if count < batch_size:
+                return released
+
+async def sweep_once(mode: str = SWEEPER_MODE) -> int | None:
+    """
+    one sweep, or None if another worker holds the lock.
+    """
+    if mode == "all":
+        return await sweep()
+    async with sweep_lock() as locked:
+        if not locked:
+            return None
+        return await sweep()
+
+async def run(interval: float = SWEEP_INTERVAL_SECONDS, mode: str = SWEEPER_MODE):
+    while True:
+        try:
+            released = await sweep_once(mode)
+            if released:
+                logger.info("released %d expired reservations", released)
+        except Exception:
+            logger.exception("reservation sweep failed")
+        await asyncio.sleep(interval)
+
+def start() -> asyncio.Task | None:
+    if SWEEPER_MODE == "off":
+        return None
+    return asyncio.create_task(run())
+
+async def stop(task: asyncio.Task | None):
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
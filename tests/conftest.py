@@ -0,0 +1,75 @@
+"""
+The app runs from a temporary directory of its own, with a .env for the
+tests and a throwaway sqlite database there, so sql_app.db is never
+touched. Set DATABASE_URL to run the tests against another database,
+every test starts by emptying its tables.
+"""
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_directory = tempfile.TemporaryDirectory()
+os.chdir(_directory.name)
+with open(".env", "w") as env_file:
+    json.dump({
+        "secret_key": "test secret",
+        "super_user_username": "admin",
+        "super_user_password": "admin password",
+        "super_user_email": "admin@example.com",
+    }, env_file)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_directory.name, 'test.db')}")
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def app():
+    from sqlalchemy import text
+
+    import cache
+    import main
+    from sql import database, models, search
+
+    with database.engine.begin() as connection:
+        # sqlite reuses the ids of deleted books, which must not match
+        # what's left in the search index
+        connection.execute(text(f"DELETE FROM {search.SEARCH_TABLE}"))
+        for table in reversed(models.Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    cache.invalidate_responses(*{tag for tags in main.CACHED_ROUTES.values() for tag in tags})
+    cache.set_user_backend(cache.LocalCache(cache.USER_CACHE_MAX_SIZE))
+    cache.set_token_revocations({})
+    yield main.app
+    # the pooled connections belong to this test's event loop
+    await database.async_engine.dispose()
+
+@pytest.fixture
+async def client(app):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+@pytest.fixture
+def db(app):
+    from sql import database
+
+    with database.SessionLocal() as db:
+        yield db
+
+@pytest.fixture
+def superuser_headers(db):
+    import dependencies
+    from sql import models
+
+    user = models.User(username="admin", email="admin@example.com", hashed_password="x", is_superuser=True)
+    db.add(user)
+    db.commit()
+    return {"Authorization": f"Bearer {dependencies.create_user_token(user)}"}
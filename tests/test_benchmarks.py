@@ -0,0 +1,83 @@
+"""
+Smoke runs of the benchmark scripts against a tiny seed, each in its own
+process with its own throwaway database, like they are run by hand.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TINY_SEED = ["--authors", "5", "--books", "20", "--instances", "60", "--users", "10"]
+
+def run_script(module: str, *args: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # the scripts seed a database of their own, not the tests' one
+    env.pop("DATABASE_URL", None)
+    # the .env of the tests is in the working directory
+    result = subprocess.run([sys.executable, "-m", module, *args], env=env, capture_output=True,
+                            text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout)
+
+def test_load_benchmark():
+    report = run_script("benchmarks.load", *TINY_SEED, "--bcrypt-rounds", "4",
+                        "--concurrency", "3", "--duration", "1")
+
+    assert report["config"]["database"] == "sqlite"
+    assert report["total"]["requests"] > 3
+    assert report["total"]["errors"] == 0
+    assert report["routes"]["POST /token"]["requests"] == 3
+    books = report["routes"]["GET /books/?genre="]
+    assert books["p50_ms"] <= books["p95_ms"] <= books["p99_ms"]
+    # read from Server-Timing, cache hits count 0
+    assert books["mean_queries"] is not None
+
+LOG = [
+    {"timestamp": "2024-03-01T10:00:00.000Z", "path": "/books/", "query": {"genre": "genre 3"}},
+    {"timestamp": "2024-03-01T10:00:00.050Z", "path": "/authors/1"},
+    {"timestamp": "2024-03-01T10:00:00.100Z", "path": "/authors/999", "status": 404},
+    {"path": "/users/me/", "user": "user2"},
+    {"timestamp": 1709287200.2, "path": "/users/me/", "user": "nobody", "status": 401},
+    {"timestamp": 1709287200.2, "method": "post", "path": "/token",
+     "form": {"username": "user3", "password": "benchmark"}},
+]
+
+@pytest.fixture
+def log(tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in LOG))
+    return str(path)
+
+def test_read_log(log):
+    from benchmarks.replay import read_log
+
+    entries = read_log(log)
+
+    assert [entry["path"] for entry in entries] == [entry["path"] for entry in LOG]
+    assert entries[3]["timestamp"] == entries[2]["timestamp"]
+    assert entries[-1]["method"] == "POST"
+    assert len(read_log(log, limit=2)) == 2
+
+def test_route_template():
+    from benchmarks.replay import route_template
+    import main
+
+    assert route_template(main.app, "GET", "/authors/1") == "GET /authors/{author_id}"
+    assert route_template(main.app, "DELETE", "/books/") == "DELETE /books/"
+    assert route_template(main.app, "GET", "/nowhere") == "GET (unmatched)"
+
+@pytest.mark.parametrize("mode", [["--speed", "10"], ["--fast", "--concurrency", "2"]])
+def test_replay(log, mode):
+    report = run_script("benchmarks.replay", log, *TINY_SEED, *mode)
+
+    assert report["config"]["entries"] == len(LOG)
+    assert report["total"]["requests"] == len(LOG)
+    # the recorded 404 and 401 are what the app answers too
+    assert report["total"]["errors"] == 0
+    assert report["routes"]["GET /authors/{author_id}"]["statuses"] == {"200": 1, "404": 1}
+    assert report["routes"]["GET /users/me/"]["statuses"] == {"200": 1, "401": 1}
+    assert report["routes"]["POST /token"]["statuses"] == {"200": 1}
+    assert ("schedule_lag_ms" in report) == ("--fast" not in mode)
@@ -0,0 +1,100 @@
+"""
+The available/on loan/reserved counters on books follow every change to
+their instances.
+"""
+import datetime
+
+import pytest
+from sqlalchemy import func, select, update
+
+import dependencies
+from sql import crud, database, models
+
+pytestmark = pytest.mark.anyio
+
+def counters(db, book_id: int) -> tuple:
+    """
+    the counters of the book, after checking they agree with its
+    instances.
+    """
+    db.expire_all()
+    book = db.get(models.Book, book_id)
+    stored = (book.available_count, book.on_loan_count, book.reserved_count)
+    by_status = dict(db.execute(
+        select(models.BookInstance.status, func.count()).
+        where(models.BookInstance.book_id == book_id).
+        group_by(models.BookInstance.status)).all())
+    counted = tuple(by_status.get(status, 0) for status in (
+        models.BookInstanceStatus.a, models.BookInstanceStatus.o, models.BookInstanceStatus.r))
+    assert stored == counted
+    return stored
+
+@pytest.fixture
+def books(db):
+    author = models.Author(first_name="Jane", last_name="Doe", date_of_birth=datetime.date(1900, 1, 1))
+    books = [models.Book(title=title, description="", author=author) for title in ("first", "second")]
+    reader = models.User(username="reader", email="reader@example.com", hashed_password="x")
+    other = models.User(username="other", email="other@example.com", hashed_password="x")
+    db.add_all([*books, reader, other])
+    db.commit()
+    return {"ids": [book.id for book in books], "reader": reader,
+            "headers": {"Authorization": f"Bearer {dependencies.create_user_token(reader)}"},
+            "other_headers": {"Authorization": f"Bearer {dependencies.create_user_token(other)}"}}
+
+async def test_counters_follow_instance_changes(client, db, superuser_headers, books):
+    book_id, other_book_id = books["ids"]
+    headers = books["headers"]
+    instance_ids = []
+    for status in ("Available", "Available", "Maintenance"):
+        response = await client.post("/bookinstances/", headers=superuser_headers, json={
+            "imprint": "imprint", "due_back": None, "status": status, "book_id": book_id})
+        assert response.status_code == 200
+        instance_ids.append(response.json()["id"])
+    first, second, third = instance_ids
+    assert counters(db, book_id) == (2, 0, 0)
+
+    assert (await client.post(f"/bookinstances/{first}/borrow", headers=headers)).status_code == 200
+    assert counters(db, book_id) == (1, 1, 0)
+    assert (await client.post(f"/bookinstances/{second}/reserve", headers=headers)).status_code == 200
+    assert counters(db, book_id) == (0, 1, 1)
+    # refused transitions change nothing
+    other_headers = books["other_headers"]
+    assert (await client.post(f"/bookinstances/{second}/borrow", headers=other_headers)).status_code == 409
+    assert (await client.post(f"/bookinstances/{first}/return", headers=other_headers)).status_code == 409
+    assert (await client.post(f"/books/{book_id}/borrow", headers=other_headers)).status_code == 409
+    assert counters(db, book_id) == (0, 1, 1)
+    assert (await client.post(f"/bookinstances/{first}/return", headers=headers)).status_code == 200
+    assert counters(db, book_id) == (1, 0, 1)
+    # the reserver borrowing the reserved copy
+    assert (await client.post(f"/bookinstances/{second}/borrow", headers=headers)).status_code == 200
+    assert counters(db, book_id) == (1, 1, 0)
+    assert (await client.post(f"/bookinstances/{second}/return", headers=headers)).status_code == 200
+    assert (await client.post(f"/bookinstances/{second}/reserve", headers=headers)).status_code == 200
+    assert counters(db, book_id) == (1, 0, 1)
+
+    response = await client.patch(f"/bookinstances/{third}", headers=superuser_headers, json={"status": "Available"})
+    assert response.status_code == 200
+    assert counters(db, book_id) == (2, 0, 1)
+    response = await client.patch(f"/bookinstances/{first}", headers=superuser_headers, json={"book_id": other_book_id})
+    assert response.status_code == 200
+    assert counters(db, book_id) == (1, 0, 1)
+    assert counters(db, other_book_id) == (1, 0, 0)
+
+    assert (await client.delete(f"/bookinstances/{third}/delete", headers=superuser_headers)).status_code == 200
+    assert counters(db, book_id) == (0, 0, 1)
+    # the reservation is released with its user
+    response = await client.delete(f"/users/{books['reader'].id}/delete", headers=superuser_headers)
+    assert response.status_code == 200
+    assert counters(db, book_id) == (1, 0, 0)
+
+async def test_reconcile_repairs_drifted_counters(db, books):
+    book_id = books["ids"][0]
+    db.add_all(models.BookInstance(book_id=book_id, imprint="imprint", status=models.BookInstanceStatus.a)
+               for _ in range(2))
+    db.execute(update(models.Book).values(available_count=7, on_loan_count=3))
+    db.commit()
+
+    async with database.AsyncSessionLocal() as async_db:
+        await crud.reconcile_book_counters(async_db)
+
+    assert counters(db, book_id) == (2, 0, 0)
@@ -0,0 +1,66 @@
+"""
+GET /books/ filters by genre, language, author and availability in one
+query.
+"""
+import datetime
+import re
+
+import pytest
+
+from sql import models
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def library(db):
+    authors = [models.Author(first_name="Jane", last_name=name, date_of_birth=datetime.date(1900, 1, 1))
+               for name in ("Austen", "Eyre")]
+    genres = {name: models.Genre(name=name) for name in ("Fantasy", "Horror", "Romance")}
+    languages = {name: models.Language(name=name) for name in ("English", "French")}
+    books = [
+        models.Book(title="A", description="", author=authors[0], genre=genres["Fantasy"],
+                    language=languages["English"], available_count=1),
+        models.Book(title="B", description="", author=authors[0], genre=genres["Horror"],
+                    language=languages["French"]),
+        models.Book(title="C", description="", author=authors[1], genre=genres["Fantasy"],
+                    language=languages["French"], available_count=2),
+        models.Book(title="D", description="", author=authors[1], genre=genres["Romance"],
+                    language=languages["English"], on_loan_count=1),
+    ]
+    db.add_all(books)
+    db.commit()
+    return {"authors": [author.id for author in authors]}
+
+async def titles(client, params) -> list:
+    response = await client.get("/books/", params=params)
+    assert response.status_code == 200
+    return [book["title"] for book in response.json()]
+
+@pytest.mark.parametrize("params, expected", [
+    ({}, ["A", "B", "C", "D"]),
+    ({"genre": "Fantasy"}, ["A", "C"]),
+    ({"genre": ["Fantasy", "Horror"]}, ["A", "B", "C"]),
+    ({"language": "French"}, ["B", "C"]),
+    ({"genre": "Fantasy", "language": "French"}, ["C"]),
+    ({"genre": "Romance", "language": "French"}, []),
+    ({"genre": "Unknown"}, []),
+    ({"available": "true"}, ["A", "C"]),
+    ({"available": "false"}, ["B", "D"]),
+    ({"language": "English", "available": "true"}, ["A"]),
+])
+async def test_filters(client, library, params, expected):
+    assert await titles(client, params) == expected
+
+async def test_author_filter(client, library):
+    first, second = library["authors"]
+
+    assert await titles(client, {"author_id": first}) == ["A", "B"]
+    assert await titles(client, {"author_id": [first, second], "genre": "Fantasy"}) == ["A", "C"]
+
+async def test_filtered_list_is_one_query(client, library):
+    response = await client.get("/books/", params={"genre": ["Fantasy", "Horror"], "language": "French",
+                                                   "available": "true"})
+
+    assert [book["title"] for book in response.json()] == ["C"]
+    queries = re.search(r'desc="(\d+) queries"', response.headers["server-timing"])
+    assert int(queries.group(1)) == 1
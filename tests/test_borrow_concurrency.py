@@ -0,0 +1,64 @@
+"""
+Borrowing is a conditional UPDATE, so of many users racing for the same
+copy exactly one gets it, and of many racing for any copy of a book
+each copy goes to exactly one of them.
+"""
+import asyncio
+import datetime
+
+import pytest
+
+import dependencies
+from sql import models
+
+pytestmark = pytest.mark.anyio
+
+BORROWERS = 20
+
+async def test_concurrent_borrows_of_one_copy(client, db):
+    users = [models.User(username=f"reader{number}", email=f"reader{number}@example.com", hashed_password="x")
+             for number in range(BORROWERS)]
+    author = models.Author(first_name="Jane", last_name="Doe", date_of_birth=datetime.date(1900, 1, 1))
+    book = models.Book(title="book", description="description", author=author, available_count=1)
+    instance = models.BookInstance(book=book, imprint="imprint", status=models.BookInstanceStatus.a)
+    db.add_all([*users, author, book, instance])
+    db.commit()
+    headers = [{"Authorization": f"Bearer {dependencies.create_user_token(user)}"} for user in users]
+
+    responses = await asyncio.gather(*(
+        client.post(f"/bookinstances/{instance.id}/borrow", headers=user_headers) for user_headers in headers))
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200] + [409] * (BORROWERS - 1)
+    winner = next(user for user, response in zip(users, responses) if response.status_code == 200)
+    db.expire_all()
+    assert instance.borrower_id == winner.id
+    assert instance.status == models.BookInstanceStatus.o
+    assert (book.available_count, book.on_loan_count) == (0, 1)
+
+COPIES = 3
+
+async def test_concurrent_borrows_of_any_copy(client, db):
+    users = [models.User(username=f"reader{number}", email=f"reader{number}@example.com", hashed_password="x")
+             for number in range(BORROWERS)]
+    author = models.Author(first_name="Jane", last_name="Doe", date_of_birth=datetime.date(1900, 1, 1))
+    book = models.Book(title="book", description="description", author=author, available_count=COPIES)
+    instances = [models.BookInstance(book=book, imprint="imprint", status=models.BookInstanceStatus.a)
+                 for _ in range(COPIES)]
+    db.add_all([*users, author, book, *instances])
+    db.commit()
+    headers = [{"Authorization": f"Bearer {dependencies.create_user_token(user)}"} for user in users]
+
+    responses = await asyncio.gather(*(
+        client.post(f"/books/{book.id}/borrow", headers=user_headers) for user_headers in headers))
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200] * COPIES + [409] * (BORROWERS - COPIES)
+    borrowed = {response.json()["id"]: user.id
+                for user, response in zip(users, responses) if response.status_code == 200}
+    assert sorted(borrowed) == sorted(instance.id for instance in instances)
+    db.expire_all()
+    for instance in instances:
+        assert instance.status == models.BookInstanceStatus.o
+        assert instance.borrower_id == borrowed[instance.id]
+    assert (book.available_count, book.on_loan_count) == (0, COPIES)
@@ -0,0 +1,85 @@
+"""
+cache.py: backends, the user cache and the response cache.
+"""
+import types
+
+import pytest
+
+import cache
+import dependencies
+from sql import models
+
+def test_incomplete_backend_is_refused():
+    class GetOnly(cache.CacheBackend):
+        def get(self, key: str):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+def test_local_cache_expires_entries_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    backend = cache.LocalCache()
+    backend.set("key", {"value": 1}, ttl=30)
+
+    now[0] += 29
+    assert backend.get("key") == {"value": 1}
+    now[0] += 2
+    assert backend.get("key") is None
+
+def test_local_cache_evicts_the_least_recently_used():
+    backend = cache.LocalCache(maxsize=2)
+    backend.set("a", 1, ttl=60)
+    backend.set("b", 2, ttl=60)
+    backend.get("a")
+    backend.set("c", 3, ttl=60)
+
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == (1, None, 3)
+
+def test_generations_survive_a_full_response_cache(monkeypatch):
+    monkeypatch.setattr(cache, "_response_backend", cache.LocalCache(maxsize=2))
+    before = cache.generations(["books", "genres"])
+    cache.set_response("/books/?", {"body": "[]", "headers": {}}, before)
+
+    for number in range(10):
+        cache.set_response(f"/genres/?skip={number}", {"body": "[]", "headers": {}}, before)
+
+    assert cache.generations(["books", "genres"]) == before
+    cache.invalidate_responses("books")
+    assert cache.generations(["books"]) != {"books": before["books"]}
+
+@pytest.mark.anyio
+async def test_mutation_invalidates_cached_responses(client, superuser_headers):
+    response = await client.post("/genres/", headers=superuser_headers, json={"name": "poetry"})
+    assert response.status_code == 200
+    genre_id = response.json()["id"]
+    assert (await client.get("/genres/")).headers["x-cache"] == "MISS"
+    assert (await client.get("/genres/")).headers["x-cache"] == "HIT"
+    assert (await client.get("/books/")).headers["x-cache"] == "MISS"
+    assert (await client.get("/books/")).headers["x-cache"] == "HIT"
+
+    response = await client.patch(f"/genres/{genre_id}", headers=superuser_headers, json={"name": "verse"})
+    assert response.status_code == 200
+
+    # /books/ is rendered from genres as well
+    for url in ("/genres/", "/books/"):
+        response = await client.get(url)
+        assert response.headers["x-cache"] == "MISS"
+    assert (await client.get("/genres/")).json()[0]["name"] == "verse"
+
+@pytest.mark.anyio
+async def test_cached_user_is_dropped_when_deactivated(client, db, superuser_headers):
+    user = models.User(username="reader", email="reader@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    # a token without the user's claims is checked against the user cache
+    headers = {"Authorization": f"Bearer {dependencies.create_access_token({'sub': 'reader', 'scopes': []})}"}
+    assert (await client.get("/users/me/", headers=headers)).status_code == 200
+    assert cache.get_user("reader")["is_active"] is True
+
+    response = await client.patch(f"/users/{user.id}", headers=superuser_headers, json={"is_active": False})
+    assert response.status_code == 200
+
+    assert cache.get_user("reader") is None
+    assert (await client.get("/users/me/", headers=headers)).status_code == 400
@@ -0,0 +1,96 @@
+"""
+Catalogue reads send an ETag and answer a matching If-None-Match with a
+304 until what they render from changes.
+"""
+import datetime
+
+import pytest
+
+import dependencies
+from sql import models
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def book(db):
+    author = models.Author(first_name="Jane", last_name="Doe", date_of_birth=datetime.date(1900, 1, 1))
+    book = models.Book(title="Book", description="", author=author, genre=models.Genre(name="Fantasy"),
+                       language=models.Language(name="English"), available_count=2)
+    reader = models.User(username="reader", email="reader@example.com", hashed_password="x")
+    db.add_all([book, reader])
+    db.add_all(models.BookInstance(book=book, imprint="imprint", status=models.BookInstanceStatus.a) for _ in range(2))
+    db.commit()
+    return {"id": book.id, "author_id": author.id, "instance_ids": [instance.id for instance in book.instances],
+            "headers": {"Authorization": f"Bearer {dependencies.create_user_token(reader)}"}}
+
+async def etag(client, url: str) -> str:
+    response = await client.get(url)
+    assert response.status_code == 200
+    assert "last-modified" in response.headers
+    return response.headers["etag"]
+
+async def test_matching_etag_gets_304(client, book):
+    url = f"/books/{book['id']}"
+    tag = await etag(client, url)
+    assert await etag(client, url) == tag
+
+    for if_none_match in (tag, f"W/{tag}", f'"other", {tag}', "*"):
+        response = await client.get(url, headers={"If-None-Match": if_none_match})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == tag
+    response = await client.get(url, headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+async def test_304_only_reads_the_version(client, book):
+    url = f"/books/{book['id']}"
+    tag = await etag(client, url)
+
+    response = await client.get(url, headers={"If-None-Match": tag})
+
+    assert response.status_code == 304
+    assert 'desc="1 queries"' in response.headers["server-timing"]
+
+async def test_book_etag_changes_with_its_copies(client, superuser_headers, book):
+    url = f"/books/{book['id']}"
+    first, second = book["instance_ids"]
+    tags = [await etag(client, url)]
+
+    assert (await client.post(f"/bookinstances/{first}/borrow", headers=book["headers"])).status_code == 200
+    tags.append(await etag(client, url))
+    assert (await client.delete(f"/bookinstances/{second}/delete", headers=superuser_headers)).status_code == 200
+    tags.append(await etag(client, url))
+    response = await client.patch(url, headers=superuser_headers, json={"description": "new"})
+    assert response.status_code == 200
+    tags.append(await etag(client, url))
+
+    assert len(set(tags)) == len(tags)
+    response = await client.get(url, headers={"If-None-Match": tags[0]})
+    assert response.status_code == 200
+    assert response.json()["description"] == "new"
+
+async def test_author_etag_changes_with_their_books(client, superuser_headers, book):
+    url = f"/authors/{book['author_id']}"
+    tag = await etag(client, url)
+
+    response = await client.patch(f"/books/{book['id']}", headers=superuser_headers, json={"title": "Renamed"})
+    assert response.status_code == 200
+
+    response = await client.get(url, headers={"If-None-Match": tag})
+    assert response.status_code == 200
+    assert response.json()["books"][0]["title"] == "Renamed"
+
+async def test_cached_list_etag(client, superuser_headers):
+    await client.post("/genres/", headers=superuser_headers, json={"name": "Poetry"})
+    tag = await etag(client, "/genres/")
+
+    # served from the response cache
+    response = await client.get("/genres/", headers={"If-None-Match": tag})
+    assert response.status_code == 304
+    assert response.headers["x-cache"] == "HIT"
+
+    await client.post("/genres/", headers=superuser_headers, json={"name": "Horror"})
+    response = await client.get("/genres/", headers={"If-None-Match": tag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert response.headers["etag"] != tag
@@ -0,0 +1,86 @@
+"""
+The streamed exports hold the same rows as the paginated list routes.
+"""
+import csv
+import datetime
+import io
+import json
+
+import pytest
+from sqlalchemy import insert
+
+from sql import models
+
+pytestmark = pytest.mark.anyio
+
+BOOK_FIELDS = ("id", "title", "description", "author_id", "genre_id", "language_id")
+INSTANCE_FIELDS = ("id", "book_id", "imprint", "status", "due_back", "borrower_id")
+
+async def list_all(client, url: str) -> list:
+    items, params = [], {"limit": 100}
+    while True:
+        response = await client.get(url, params=params)
+        items.extend(response.json())
+        if "x-next-cursor" not in response.headers:
+            return items
+        params["cursor"] = response.headers["x-next-cursor"]
+
+async def export(client, headers, url: str, format: str) -> list[dict]:
+    response = await client.get(url, headers=headers, params={"format": format})
+    assert response.status_code == 200
+    if format == "csv":
+        assert response.headers["content-type"].startswith("text/csv")
+        return list(csv.DictReader(io.StringIO(response.text)))
+    assert response.headers["content-type"] == "application/x-ndjson"
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def project(rows, fields) -> list[tuple]:
+    return [tuple(row[field] for field in fields) for row in rows]
+
+def as_csv(value) -> str:
+    return "" if value is None else str(value)
+
+async def test_book_export_matches_the_list(client, db, superuser_headers):
+    author = models.Author(first_name="Jane", last_name="Doe", date_of_birth=datetime.date(1900, 1, 1))
+    genre, language = models.Genre(name="Fantasy"), models.Language(name="English")
+    db.add_all([author, genre, language])
+    db.commit()
+    # more than one batch of the stream
+    db.execute(insert(models.Book), [
+        {"title": f"Book {number}", "description": f"Description, \"quoted\"\n{number}" if number % 2 else "",
+         "author_id": author.id, "genre_id": genre.id, "language_id": language.id}
+        for number in range(2500)])
+    db.commit()
+
+    listed = project(await list_all(client, "/books/"), BOOK_FIELDS)
+    assert len(listed) == 2500
+    assert project(await export(client, superuser_headers, "/export/books", "ndjson"), BOOK_FIELDS) == listed
+    assert project(await export(client, superuser_headers, "/export/books", "csv"), BOOK_FIELDS) == \
+        [tuple(as_csv(value) for value in row) for row in listed]
+
+async def test_book_instance_export_matches_the_list(client, db, superuser_headers):
+    reader = models.User(username="reader", email="reader@example.com", hashed_password="x")
+    book = models.Book(title="Book", description="")
+    db.add_all([reader, book])
+    db.add_all([
+        models.BookInstance(book=book, imprint="first", status=models.BookInstanceStatus.a),
+        models.BookInstance(book=book, imprint="second, with a comma", status=models.BookInstanceStatus.o,
+                            borrower=reader, due_back=datetime.date(2030, 1, 31)),
+        models.BookInstance(book=book, imprint="third", status=models.BookInstanceStatus.m),
+    ])
+    db.commit()
+
+    listed = project(await list_all(client, "/bookinstances/"), INSTANCE_FIELDS)
+    assert len(listed) == 3
+    assert project(await export(client, superuser_headers, "/export/bookinstances", "ndjson"), INSTANCE_FIELDS) == listed
+    assert project(await export(client, superuser_headers, "/export/bookinstances", "csv"), INSTANCE_FIELDS) == \
+        [tuple(as_csv(value) for value in row) for row in listed]
+
+async def test_user_export_leaves_out_password_hashes(client, superuser_headers):
+    rows = await export(client, superuser_headers, "/export/users", "ndjson")
+
+    assert [row["username"] for row in rows] == ["admin"]
+    assert set(rows[0]) == {"id", "username", "email", "is_active", "is_superuser"}
+
+async def test_export_needs_a_superuser(client):
+    assert (await client.get("/export/books")).status_code == 401
@@ -0,0 +1,46 @@
+"""
+The hashing pool gives every hash a slot until it's done, cancelled
+ones included.
+"""
+import asyncio
+import threading
+
+import pytest
+
+import hashing
+
+pytestmark = pytest.mark.anyio
+
+async def test_cancelled_hash_releases_its_slot():
+    pool = hashing.HashingPool(workers=1, max_pending=2)
+    release = threading.Event()
+    running = asyncio.create_task(pool.run_async(release.wait))
+    queued = asyncio.create_task(pool.run_async(lambda: "hash"))
+    try:
+        await asyncio.sleep(0.01)
+        assert pool.stats()["pending"] == 2
+
+        # the queued hash never starts
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert pool.stats()["pending"] == 1
+    finally:
+        release.set()
+        await running
+
+    assert pool.stats()["pending"] == 0
+    assert await pool.run_async(lambda: "hash") == "hash"
+
+async def test_full_pool_refuses_new_hashes():
+    pool = hashing.HashingPool(workers=1, max_pending=1)
+    release = threading.Event()
+    running = asyncio.create_task(pool.run_async(release.wait))
+    try:
+        await asyncio.sleep(0.01)
+        with pytest.raises(hashing.HashingPoolBusy):
+            await pool.run_async(lambda: "hash")
+    finally:
+        release.set()
+        await running
+    assert pool.stats()["rejected"] == 1
@@ -0,0 +1,130 @@
+"""
+GET /metrics renders the Prometheus text format, and with a metrics
+directory the snapshots of every worker are merged.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import instrumentation
+import metrics
+
+pytestmark = pytest.mark.anyio
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def parse(text: str) -> dict:
+    """
+    {(sample name, labels): value} of an exposition, checking every
+    sample comes after the HELP and TYPE lines of its family.
+    """
+    samples, declared = {}, set()
+    assert text.endswith("\n")
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            continue
+        if line.startswith("# TYPE "):
+            name, kind = line.split()[2:]
+            assert kind in ("counter", "gauge", "histogram")
+            declared.add(name)
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name, labels, value = match.groups()
+        assert re.sub(r"_(bucket|sum|count)$", "", name) in declared or name in declared, line
+        samples[name, tuple(LABEL.findall(labels or ""))] = float(value)
+    return samples
+
+async def scrape(client) -> dict:
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+    return parse(response.text)
+
+def requests_total(samples: dict, route: str, status: str) -> float:
+    labels = (("method", "GET"), ("router", "/" + route.strip("/").split("/")[0]), ("route", route),
+              ("status", status))
+    return samples.get(("http_requests_total", labels), 0)
+
+async def test_metrics_exposition(client):
+    before = await scrape(client)
+
+    await client.get("/authors/1")
+    await client.get("/authors/2")
+    await client.get("/genres/")
+    await client.get("/nowhere/1")
+    samples = await scrape(client)
+
+    assert requests_total(samples, "/authors/{author_id}", "404") - \
+        requests_total(before, "/authors/{author_id}", "404") == 2
+    assert requests_total(samples, "/genres/", "200") - requests_total(before, "/genres/", "200") == 1
+    # unknown paths share one series
+    unmatched = (("method", "GET"), ("router", ""), ("route", "(unmatched)"), ("status", "404"))
+    assert samples["http_requests_total", unmatched] >= 1
+    assert not any("nowhere" in str(labels) for _, labels in samples)
+    # the scrape itself is in progress
+    assert samples["http_requests_in_progress", ()] == 1
+    for name in ("hashing_workers", "threadpool_threads"):
+        assert (name, ()) in samples
+
+    route = (("method", "GET"), ("router", "/authors"), ("route", "/authors/{author_id}"))
+    buckets = [value for (name, labels), value in samples.items()
+               if name == "http_request_duration_seconds_bucket" and labels[:3] == route]
+    assert buckets == sorted(buckets)
+    assert samples["http_request_duration_seconds_bucket", (*route, ("le", "+Inf"))] == \
+        samples["http_request_duration_seconds_count", route] == \
+        sum(requests_total(samples, "/authors/{author_id}", status) for status in ("200", "404"))
+
+def test_render_escapes_label_values():
+    text = metrics.render([metrics.family("things", "gauge", "Things.\nMany.", [
+        ("things", {"name": 'a "quoted"\\name'}, 1.5), ("things", {}, 2.0)])])
+
+    assert text == ('# HELP things Things.\\nMany.\n'
+                    '# TYPE things gauge\n'
+                    'things{name="a \\"quoted\\"\\\\name"} 1.5\n'
+                    'things 2\n')
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+def snapshot(directory, file_name: str, pid: int, requests: int, in_progress: int):
+    (directory / file_name).write_text(json.dumps({"pid": pid, "families": [
+        metrics.family("requests_total", "counter", "Requests.", [("requests_total", {"route": "/"}, requests)]),
+        metrics.family("in_progress", "gauge", "In progress.", [("in_progress", {}, in_progress)]),
+    ]}))
+
+def test_snapshots_are_merged(tmp_path):
+    live, dead = 1, dead_pid()
+    snapshot(tmp_path, "live.json", live, requests=3, in_progress=2)
+    snapshot(tmp_path, "dead.json", dead, requests=4, in_progress=5)
+    (tmp_path / "torn.json").write_text('{"pid": ')
+    (tmp_path / "other.json.tmp").write_text("not yet")
+
+    families = {family["name"]: family for family in metrics.read_snapshots(str(tmp_path))}
+
+    # an exited worker's requests still count, its gauges are gone
+    assert families["requests_total"]["samples"] == [("requests_total", {"route": "/"}, 7)]
+    assert families["in_progress"]["samples"] == [("in_progress", {"pid": str(live)}, 2)]
+    assert families["requests_total"]["type"] == "counter"
+
+async def test_scrape_merges_every_worker(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, "METRICS_DIR", str(tmp_path))
+    own = parse(metrics.render(metrics.collect(instrumentation.COLLECTORS)))
+    other = [metrics.family(
+        "http_requests_total", "counter", "Requests served.",
+        [("http_requests_total", {"method": "GET", "router": "/genres", "route": "/genres/", "status": "200"}, 10)])]
+    (tmp_path / "other.json").write_text(json.dumps({"pid": 1, "families": other}))
+
+    samples = await scrape(client)
+
+    assert requests_total(samples, "/genres/", "200") == requests_total(own, "/genres/", "200") + 10
+    # this worker wrote its own snapshot, and its gauges carry its pid
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    assert {labels for name, labels in samples if name == "threadpool_threads"} == {(("pid", str(os.getpid())),)}
@@ -0,0 +1,76 @@
+"""
+Keyset pagination through X-Next-Cursor.
+"""
+import datetime
+import uuid
+
+import pytest
+
+from sql import models
+from sql.pagination import encode_cursor
+
+pytestmark = pytest.mark.anyio
+
+async def walk(client, url: str, between_pages=None) -> list:
+    items = []
+    response = await client.get(url)
+    while True:
+        assert response.status_code == 200
+        items.extend(response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return items
+        if between_pages is not None:
+            await between_pages()
+        response = await client.get(url, params={"cursor": cursor})
+
+async def test_walk_with_inserts_between_pages(client, superuser_headers):
+    async def add_author(number):
+        response = await client.post("/authors/", headers=superuser_headers, json={
+            "first_name": "Jane", "last_name": f"Doe {number}", "date_of_birth": "1900-01-01"})
+        assert response.status_code == 200
+        return response.json()["id"]
+    existing = [await add_author(number) for number in range(10)]
+    added = []
+    async def between_pages():
+        added.append(await add_author(100 + len(added)))
+
+    ids = [author["id"] for author in await walk(client, "/authors/?limit=3", between_pages)]
+
+    assert len(ids) == len(set(ids))
+    assert ids == sorted(ids)
+    # new ids sort after the cursor, so they show up on a later page
+    assert set(ids) == set(existing) | set(added)
+
+async def test_walk_uuid_keys_with_inserts_between_pages(client, db):
+    book = models.Book(title="book", description="description")
+    db.add(book)
+    db.add_all(models.BookInstance(book=book, imprint="imprint") for _ in range(10))
+    db.commit()
+    existing = [instance.id for instance in book.instances]
+    async def between_pages():
+        # a new uuid can sort before or after the cursor
+        db.add(models.BookInstance(book_id=book.id, imprint="imprint"))
+        db.commit()
+
+    ids = [instance["id"] for instance in await walk(client, "/bookinstances/?limit=3", between_pages)]
+
+    assert len(ids) == len(set(ids))
+    assert set(existing) <= set(ids)
+
+@pytest.mark.parametrize("url, cursor", [
+    ("/authors/", "not a cursor"),
+    ("/authors/", "%%%"),
+    ("/authors/", encode_cursor(("1",))),
+    ("/authors/", encode_cursor((True,))),
+    ("/authors/", encode_cursor((1, 2))),
+    ("/authors/", encode_cursor(())),
+    ("/authors/", encode_cursor(({"id": 1},))),
+    ("/bookinstances/", encode_cursor((1,))),
+    ("/bookinstances/", encode_cursor(("not a uuid",))),
+    ("/bookinstances/", encode_cursor((str(uuid.uuid4()), 1))),
+])
+async def test_malformed_cursor_is_refused(client, url, cursor):
+    response = await client.get(url, params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
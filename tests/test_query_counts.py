@@ -0,0 +1,60 @@
+"""
+The detail endpoints render nested relationships (an author's books and
+their instances, a user's borrowed instances, ...). They must load them
+with a fixed number of queries, however many rows there are.
+"""
+import contextlib
+import datetime
+
+import pytest
+from sqlalchemy import event
+
+from sql import database, models
+
+pytestmark = pytest.mark.anyio
+
+@contextlib.contextmanager
+def count_queries():
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(database.async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+def add_library(db, books: int, instances_per_book: int) -> dict:
+    user = models.User(username=f"reader{books}", email=f"reader{books}@example.com", hashed_password="x")
+    author = models.Author(first_name="Jane", last_name=f"Doe {books}", date_of_birth=datetime.date(1900, 1, 1))
+    genre = models.Genre(name=f"genre {books}")
+    language = models.Language(name=f"language {books}")
+    db.add_all([user, author, genre, language])
+    db.flush()
+    for number in range(books):
+        book = models.Book(title=f"book {books}-{number}", description="description", author=author, genre=genre, language=language)
+        db.add(book)
+        for _ in range(instances_per_book):
+            db.add(models.BookInstance(book=book, imprint="imprint", status=models.BookInstanceStatus.o,
+                                       borrower=user, due_back=datetime.date(2030, 1, 1)))
+    db.commit()
+    return {"authors": author.id, "books": book.id, "genres": genre.id, "users": user.id}
+
+@pytest.mark.parametrize("route, expected", [
+    ("authors", 4), # the ETag version, the author, its books, their instances
+    ("books", 3), # the ETag version, the book, its instances
+    ("genres", 3), # the genre, its books, their instances
+    ("users", 2), # the user, the instances they borrowed
+])
+async def test_detail_query_count(client, db, route, expected):
+    small = add_library(db, books=1, instances_per_book=1)
+    large = add_library(db, books=5, instances_per_book=4)
+    # the first request opens the connection
+    await client.get("/")
+    await client.get(f"/{route}/{small[route]}")
+
+    for ids in (small, large):
+        with count_queries() as statements:
+            response = await client.get(f"/{route}/{ids[route]}")
+        assert response.status_code == 200
+        assert len(statements) == expected, statements
@@ -0,0 +1,100 @@
+"""
+Refresh tokens rotate on every use, end their session when reused and
+only work for active users.
+"""
+import pytest
+from sqlalchemy import func, select, update
+
+import dependencies
+import hashing
+from sql import models
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def reader(db):
+    user = models.User(username="reader", email="reader@example.com",
+                       hashed_password=await dependencies.hash_password_async("password"))
+    db.add(user)
+    db.commit()
+    return user
+
+async def log_in(client) -> dict:
+    response = await client.post("/token", data={"username": "reader", "password": "password"})
+    assert response.status_code == 200
+    return response.json()
+
+async def refresh(client, refresh_token: str):
+    return await client.post("/token/refresh", data={"refresh_token": refresh_token})
+
+def sessions(db) -> int:
+    return db.scalar(select(func.count()).select_from(models.UserSession))
+
+async def test_refresh_rotates_the_token(client, db, reader):
+    tokens = await log_in(client)
+    submitted = hashing.pool.stats()["submitted"]
+
+    response = await refresh(client, tokens["refresh_token"])
+
+    assert response.status_code == 200
+    refreshed = response.json()
+    assert refreshed["refresh_token"] != tokens["refresh_token"]
+    assert refreshed["refresh_token"].split(".")[0] == tokens["refresh_token"].split(".")[0]
+    # no bcrypt for a refresh
+    assert hashing.pool.stats()["submitted"] == submitted
+    headers = {"Authorization": f"Bearer {refreshed['access_token']}"}
+    assert (await client.get("/users/me/", headers=headers)).json()["username"] == "reader"
+    assert (await refresh(client, refreshed["refresh_token"])).status_code == 200
+    assert sessions(db) == 1
+
+async def test_reused_token_ends_the_session(client, db, reader):
+    tokens = await log_in(client)
+    other_session = await log_in(client)
+    refreshed = (await refresh(client, tokens["refresh_token"])).json()
+
+    # a replay of the rotated token, by a thief or a client that lost the response
+    assert (await refresh(client, tokens["refresh_token"])).status_code == 401
+    # which also locks out whoever holds the current one
+    assert (await refresh(client, refreshed["refresh_token"])).status_code == 401
+    assert sessions(db) == 1
+    assert (await refresh(client, other_session["refresh_token"])).status_code == 200
+
+@pytest.mark.parametrize("refresh_token", ["", "garbage", "no-secret.", ".no-session", "a.b.c"])
+async def test_malformed_token_is_refused(client, reader, refresh_token):
+    await log_in(client)
+    response = await refresh(client, refresh_token)
+    assert response.status_code in (401, 422)
+
+async def test_forged_secret_ends_the_session(client, db, reader):
+    session_id = (await log_in(client))["refresh_token"].split(".")[0]
+
+    assert (await refresh(client, f"{session_id}.forged")).status_code == 401
+    assert sessions(db) == 0
+
+async def test_expired_token_is_refused(client, db, reader):
+    tokens = await log_in(client)
+    db.execute(update(models.UserSession).values(expires_at=models.utcnow()))
+    db.commit()
+
+    assert (await refresh(client, tokens["refresh_token"])).status_code == 401
+
+async def test_refresh_refused_for_inactive_user(client, db, reader):
+    refresh_token = (await log_in(client))["refresh_token"]
+    response = await refresh(client, refresh_token)
+    assert response.status_code == 200
+    refresh_token = response.json()["refresh_token"]
+
+    reader.is_active = False
+    db.commit()
+    response = await refresh(client, refresh_token)
+
+    assert response.status_code == 401
+    assert sessions(db) == 0
+
+async def test_deleting_a_user_ends_their_sessions(client, db, superuser_headers, reader):
+    refresh_token = (await log_in(client))["refresh_token"]
+
+    assert (await client.delete(f"/users/{reader.id}/delete", headers=superuser_headers)).status_code == 200
+
+    assert sessions(db) == 0
+    assert (await refresh(client, refresh_token)).status_code == 401
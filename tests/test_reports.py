@@ -0,0 +1,99 @@
+"""
+The overdue report and its summary count every overdue loan once, per
+borrower.
+"""
+import csv
+import datetime
+import io
+import json
+
+import pytest
+
+import dependencies
+import streaming
+from sql import database, models, reports
+
+pytestmark = pytest.mark.anyio
+
+TODAY = datetime.date.today()
+
+def days_ago(days: int) -> datetime.date:
+    return TODAY - datetime.timedelta(days=days)
+
+@pytest.fixture
+def loans(db):
+    author = models.Author(first_name="Jane", last_name="Doe", date_of_birth=datetime.date(1900, 1, 1))
+    book = models.Book(title="title", description="", author=author)
+    users = {name: models.User(username=name, email=f"{name}@example.com", hashed_password="x")
+             for name in ("alice", "bob", "carol")}
+    db.add_all([book, *users.values()])
+    db.flush()
+    S = models.BookInstanceStatus
+    copies = [
+        (S.o, days_ago(3), "alice"), (S.o, days_ago(10), "alice"), (S.o, days_ago(1), "alice"),
+        (S.o, days_ago(5), "bob"), (S.o, TODAY, "bob"), (S.o, TODAY + datetime.timedelta(days=7), "bob"),
+        # neither is a loan
+        (S.r, days_ago(20), "carol"), (S.a, None, None),
+    ]
+    db.add_all(models.BookInstance(imprint="imprint", status=status, due_back=due_back, book_id=book.id,
+                                   borrower_id=users[name].id if name else None)
+               for status, due_back, name in copies)
+    db.commit()
+    return {name: user.id for name, user in users.items()}
+
+async def get(client, headers, url: str, format: str = "ndjson"):
+    response = await client.get(url, headers=headers, params={"format": format})
+    assert response.status_code == 200
+    if format == "csv":
+        return list(csv.DictReader(io.StringIO(response.text)))
+    return [json.loads(line) for line in response.text.splitlines()]
+
+async def test_overdue_report(client, superuser_headers, loans):
+    borrowers = await get(client, superuser_headers, "/reports/overdue")
+
+    assert [borrower["username"] for borrower in borrowers] == ["alice", "bob"]
+    alice, bob = borrowers
+    assert alice["borrower_id"] == loans["alice"]
+    assert [loan["due_back"] for loan in alice["loans"]] == \
+        [days_ago(days).isoformat() for days in (10, 3, 1)]
+    assert [loan["due_back"] for loan in bob["loans"]] == [days_ago(5).isoformat()]
+
+    rows = await get(client, superuser_headers, "/reports/overdue", "csv")
+    assert [(row["username"], row["due_back"]) for row in rows] == \
+        [("alice", loan["due_back"]) for loan in alice["loans"]] + [("bob", days_ago(5).isoformat())]
+
+async def test_borrowers_span_batches(loans):
+    # batches of two split alice's three loans
+    batches = reports.group_by_borrower(streaming.stream_batches(reports.overdue_loans(), batch_size=2))
+    borrowers = [borrower async for batch in batches for borrower in batch]
+
+    assert [(borrower["username"], len(borrower["loans"])) for borrower in borrowers] == [("alice", 3), ("bob", 1)]
+
+async def test_overdue_summary(client, db, superuser_headers, loans):
+    assert await get(client, superuser_headers, "/reports/overdue/summary") == []
+
+    async with database.AsyncSessionLocal() as session:
+        assert await reports.refresh_overdue_summary(session) == 2
+    summary = await get(client, superuser_headers, "/reports/overdue/summary")
+
+    assert [(row["username"], row["overdue_count"], row["oldest_due_back"]) for row in summary] == \
+        [("alice", 3, days_ago(10).isoformat()), ("bob", 1, days_ago(5).isoformat())]
+    report = await get(client, superuser_headers, "/reports/overdue")
+    assert sum(row["overdue_count"] for row in summary) == sum(len(borrower["loans"]) for borrower in report)
+
+    # a refresh replaces the summary rather than adding to it
+    db.execute(models.BookInstance.__table__.update().
+               where(models.BookInstance.borrower_id == loans["bob"]).
+               values(status=models.BookInstanceStatus.a, borrower_id=None, due_back=None))
+    db.commit()
+    async with database.AsyncSessionLocal() as session:
+        assert await reports.refresh_overdue_summary(session) == 1
+    summary = await get(client, superuser_headers, "/reports/overdue/summary")
+    assert [(row["username"], row["overdue_count"]) for row in summary] == [("alice", 3)]
+
+async def test_reports_are_for_superusers(client, db, loans):
+    alice = db.get(models.User, loans["alice"])
+    headers = {"Authorization": f"Bearer {dependencies.create_user_token(alice)}"}
+
+    for url in ("/reports/overdue", "/reports/overdue/summary"):
+        assert (await client.get(url, headers=headers)).status_code == 401
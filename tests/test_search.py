@@ -0,0 +1,102 @@
+"""
+Full-text search, on the FTS5 index on sqlite and the tsvector table on
+postgres.
+"""
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def catalogue(client, superuser_headers):
+    async def post(url, body):
+        response = await client.post(url, headers=superuser_headers, json=body)
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+    author_id = await post("/authors/", {"first_name": "Frank", "last_name": "Herbert", "date_of_birth": "1920-10-08"})
+    genre_id = await post("/genres/", {"name": "science fiction"})
+    language_id = await post("/languages/", {"name": "english"})
+    async def add_book(title, description):
+        return await post("/books/", {"title": title, "description": description, "author_id": author_id,
+                                      "genre_id": genre_id, "language_id": language_id})
+    return {"author_id": author_id, "add_book": add_book}
+
+async def search(client, query: str) -> list:
+    response = await client.get("/books/search", params={"q": query})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+async def titles(client, query: str) -> list:
+    return [book["title"] for book in await search(client, query)]
+
+async def test_title_matches_rank_above_description_matches(client, catalogue):
+    await catalogue["add_book"]("Sandworms", "Set long after the events of Dune")
+    await catalogue["add_book"]("Dune Messiah", "Twelve years later")
+    await catalogue["add_book"]("The Dosadi Experiment", "A planet of prisoners")
+
+    assert await titles(client, "dune") == ["Dune Messiah", "Sandworms"]
+
+async def test_snippet_highlights_the_match(client, catalogue):
+    await catalogue["add_book"]("The Dosadi Experiment", "A crowded planet of prisoners")
+
+    results = await search(client, "prisoners")
+    assert [result["title"] for result in results] == ["The Dosadi Experiment"]
+    assert "<mark>prisoners</mark>" in results[0]["snippet"]
+
+async def test_author_names_are_searchable(client, catalogue):
+    await catalogue["add_book"]("Dune", "A desert planet")
+
+    assert await titles(client, "herbert") == ["Dune"]
+
+async def test_prefix_matching(client, catalogue, db):
+    if db.bind.dialect.name != "sqlite":
+        pytest.skip("websearch_to_tsquery has no prefix matching, only sqlite searches as you type")
+    await catalogue["add_book"]("Galaxy Outpost", "A station at the edge")
+
+    assert await titles(client, "gal") == ["Galaxy Outpost"]
+    assert await titles(client, "edge stat") == ["Galaxy Outpost"]
+    # only the last word is a prefix
+    assert await titles(client, "gal outpost") == []
+
+@pytest.mark.parametrize("query", [
+    '"', '""', '"dune', "*", "dune*", "NEAR", "NEAR(dune planet)", "OR", "dune OR", "AND dune",
+    "NOT", "-dune", "title:dune", "(dune", "dune)", "^dune", "'", "\\", "%_",
+])
+async def test_hostile_input_is_quoted(client, catalogue, query):
+    await catalogue["add_book"]("Dune", "A desert planet")
+
+    results = await search(client, query)
+    assert all(result["title"] == "Dune" for result in results)
+
+async def test_quoted_operators_are_words_on_sqlite(client, catalogue, db):
+    if db.bind.dialect.name != "sqlite":
+        pytest.skip("websearch_to_tsquery reads OR and a leading - as operators on purpose")
+    await catalogue["add_book"]("Dune", "A desert planet")
+    await catalogue["add_book"]("Foundation", "A galactic empire")
+
+    assert await titles(client, "dune OR foundation") == []
+    assert await titles(client, "dune NEAR planet") == []
+
+async def test_index_follows_book_update_and_delete(client, catalogue, superuser_headers):
+    book_id = await catalogue["add_book"]("Dune", "A desert planet")
+    assert await titles(client, "dune") == ["Dune"]
+
+    response = await client.patch(f"/books/{book_id}", headers=superuser_headers,
+                                  json={"title": "Arrakis", "description": "A spice world"})
+    assert response.status_code == 200
+    assert await titles(client, "dune") == []
+    assert await titles(client, "desert") == []
+    assert await titles(client, "arrakis") == ["Arrakis"]
+    assert await titles(client, "spice") == ["Arrakis"]
+
+    response = await client.delete(f"/books/{book_id}/delete", headers=superuser_headers)
+    assert response.status_code == 200
+    assert await titles(client, "arrakis") == []
+
+async def test_index_follows_author_rename(client, catalogue, superuser_headers):
+    await catalogue["add_book"]("Dune", "A desert planet")
+
+    response = await client.patch(f"/authors/{catalogue['author_id']}", headers=superuser_headers,
+                                  json={"last_name": "Atreides"})
+    assert response.status_code == 200
+    assert await titles(client, "herbert") == []
+    assert await titles(client, "atreides") == ["Dune"]
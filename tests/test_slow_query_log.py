@@ -0,0 +1,31 @@
+"""
+The slow query log must not leak password hashes or session secrets.
+"""
+import logging
+
+import pytest
+
+import dependencies
+import instrumentation
+from sql import models
+
+pytestmark = pytest.mark.anyio
+
+async def test_slow_query_log_redacts_users_and_sessions(client, db, monkeypatch, caplog):
+    hashed_password = await dependencies.hash_password_async("password")
+    user = models.User(username="reader", email="reader@example.com", hashed_password=hashed_password)
+    db.add(user)
+    db.commit()
+    # every statement is slow
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_MS", 1e-9)
+
+    with caplog.at_level(logging.WARNING, logger="instrumentation.slow_queries"):
+        response = await client.post("/token", data={"username": "reader", "password": "password"})
+    assert response.status_code == 200
+    session_id, secret = response.json()["refresh_token"].split(".", 1)
+
+    logged = "\n".join(record.getMessage() for record in caplog.records)
+    assert "sessions" in logged and "users" in logged
+    assert hashed_password not in logged
+    assert dependencies._refresh_secret_hash(secret) not in logged
+    assert "<str len=64>" in logged
@@ -0,0 +1,101 @@
+"""
+The sweeper releases expired reservations, and with the advisory_lock
+mode only one worker sweeps at a time.
+"""
+import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+import sweeper
+from sql import models
+
+pytestmark = pytest.mark.anyio
+
+TODAY = datetime.date.today()
+EXPIRED = TODAY - datetime.timedelta(days=3)
+
+@pytest.fixture
+def book(db):
+    author = models.Author(first_name="Jane", last_name="Doe", date_of_birth=datetime.date(1900, 1, 1))
+    book = models.Book(title="title", description="", author=author, genre=models.Genre(name="Fantasy"),
+                       language=models.Language(name="English"))
+    reader = models.User(username="reader", email="reader@example.com", hashed_password="x")
+    db.add_all([book, reader])
+    db.flush()
+    S = models.BookInstanceStatus
+    copies = [(S.r, EXPIRED)] * 3 + [(S.r, TODAY), (S.o, EXPIRED), (S.a, None)]
+    db.add_all(models.BookInstance(imprint="imprint", status=status, due_back=due_back,
+                                   book_id=book.id, borrower_id=None if status == S.a else reader.id)
+               for status, due_back in copies)
+    book.available_count, book.on_loan_count, book.reserved_count = 1, 1, 4
+    db.commit()
+    return book.id
+
+def statuses(db, book_id: int) -> dict:
+    db.expire_all()
+    book = db.get(models.Book, book_id)
+    counted = dict(db.execute(
+        select(models.BookInstance.status, func.count()).
+        where(models.BookInstance.book_id == book_id).
+        group_by(models.BookInstance.status)).all())
+    assert (book.available_count, book.on_loan_count, book.reserved_count) == tuple(
+        counted.get(status, 0) for status in (
+            models.BookInstanceStatus.a, models.BookInstanceStatus.o, models.BookInstanceStatus.r))
+    return counted
+
+async def test_sweep_releases_expired_reservations(db, book):
+    # a batch smaller than the backlog, so it takes several rounds
+    assert await sweeper.sweep(batch_size=2) == 3
+
+    S = models.BookInstanceStatus
+    assert statuses(db, book) == {S.a: 4, S.o: 1, S.r: 1}
+    released = db.scalars(select(models.BookInstance).where(models.BookInstance.status == S.a)).all()
+    assert all(instance.borrower_id is None for instance in released)
+    # overdue loans and current reservations stay
+    assert await sweeper.sweep() == 0
+
+async def test_sweep_invalidates_cached_books(client, book):
+    first = await client.get("/books/")
+    assert first.json()[0]["reserved_count"] == 4
+    assert (await client.get("/books/")).headers["X-Cache"] == "HIT"
+
+    await sweeper.sweep()
+
+    response = await client.get("/books/")
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.json()[0]["reserved_count"] == 1
+
+async def test_sweep_drops_expired_sessions(db, book):
+    reader = db.scalar(select(models.User))
+    now = models.utcnow()
+    db.add_all([
+        models.UserSession(id="expired", user_id=reader.id, secret_hash="x", expires_at=now),
+        models.UserSession(id="current", user_id=reader.id, secret_hash="x",
+                           expires_at=now + datetime.timedelta(days=1)),
+    ])
+    db.commit()
+
+    await sweeper.sweep()
+
+    db.expire_all()
+    assert db.scalars(select(models.UserSession.id)).all() == ["current"]
+
+async def test_only_one_worker_sweeps_at_a_time(db, book):
+    async with sweeper.sweep_lock() as locked:
+        assert locked
+        # another worker, as far as the lock can tell
+        assert await sweeper.sweep_once("advisory_lock") is None
+        assert statuses(db, book)[models.BookInstanceStatus.r] == 4
+        async with sweeper.sweep_lock() as also_locked:
+            assert not also_locked
+
+    assert await sweeper.sweep_once("advisory_lock") == 3
+    # and the lock is free again afterwards
+    async with sweeper.sweep_lock() as locked:
+        assert locked
+
+async def test_all_mode_ignores_the_lock(db, book):
+    async with sweeper.sweep_lock() as locked:
+        assert locked
+        assert await sweeper.sweep_once("all") == 3
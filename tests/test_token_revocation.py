@@ -0,0 +1,76 @@
+"""
+Access tokens carry their user's claims and are checked against the
+revocation table only. Changing a claim, or deleting the user, must
+revoke the tokens issued before.
+"""
+import pytest
+from sqlalchemy import select
+
+import cache
+import dependencies
+from sql import models
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def reader(db):
+    user = models.User(username="reader", email="reader@example.com", hashed_password="x", is_superuser=True)
+    db.add(user)
+    db.commit()
+    return user
+
+def bearer(user) -> dict:
+    return {"Authorization": f"Bearer {dependencies.create_user_token(user)}"}
+
+def revocation(db, user_id: int):
+    return db.scalar(select(models.TokenRevocation.token_version).where(models.TokenRevocation.user_id == user_id))
+
+@pytest.mark.parametrize("change", [{"is_active": False}, {"is_superuser": False}, {"username": "renamed"}])
+async def test_claim_change_revokes_old_tokens(client, db, superuser_headers, reader, change):
+    old_headers = bearer(reader)
+    assert (await client.get("/admin/stats/cache", headers=old_headers)).status_code == 200
+
+    response = await client.patch(f"/users/{reader.id}", headers=superuser_headers, json=change)
+    assert response.status_code == 200
+
+    db.expire_all()
+    assert reader.token_version == 1
+    assert revocation(db, reader.id) == 1
+    assert (await client.get("/users/me/", headers=old_headers)).status_code == 401
+    assert (await client.get("/admin/stats/cache", headers=old_headers)).status_code == 401
+    # a token issued now carries the new claims
+    new_headers = bearer(reader)
+    expected = 400 if change == {"is_active": False} else 200
+    assert (await client.get("/users/me/", headers=new_headers)).status_code == expected
+
+async def test_other_changes_keep_tokens(client, db, superuser_headers, reader):
+    headers = bearer(reader)
+
+    response = await client.patch(f"/users/{reader.id}", headers=superuser_headers,
+                                  json={"email": "new@example.com", "is_superuser": True})
+    assert response.status_code == 200
+
+    db.expire_all()
+    assert reader.token_version == 0
+    assert revocation(db, reader.id) is None
+    assert (await client.get("/users/me/", headers=headers)).status_code == 200
+
+async def test_deleting_a_user_revokes_their_tokens(client, db, superuser_headers, reader):
+    headers = bearer(reader)
+
+    response = await client.delete(f"/users/{reader.id}/delete", headers=superuser_headers)
+    assert response.status_code == 200
+
+    assert revocation(db, reader.id) == 1
+    assert (await client.get("/users/me/", headers=headers)).status_code == 401
+
+async def test_revocations_of_other_workers_are_loaded(client, db, superuser_headers, reader, monkeypatch):
+    headers = bearer(reader)
+    response = await client.patch(f"/users/{reader.id}", headers=superuser_headers, json={"is_active": False})
+    assert response.status_code == 200
+    # a worker that didn't make the change, once its table is due a reload
+    cache.set_token_revocations({})
+    assert (await client.get("/users/me/", headers=headers)).status_code == 200
+    monkeypatch.setattr(cache, "_token_revocations_loaded_at", None)
+
+    assert (await client.get("/users/me/", headers=headers)).status_code == 401